@@ -95,14 +95,14 @@ def delete_conversation(conv_id):
     return False
 
 def fetch_messages(conv_id):
-    """Fetch messages for a conversation"""
+    """Fetch the latest page of messages for a conversation"""
     try:
         response = requests.get(
             f"{API_BASE_URL}/api/conversations/{conv_id}/messages",
             headers=get_headers()
         )
         if response.status_code == 200:
-            return response.json()
+            return response.json().get("messages", [])
     except requests.exceptions.RequestException as e:
         st.error(f"Error fetching messages: {str(e)}")
     return []
@@ -0,0 +1,92 @@
+"""
+Login throughput benchmark.
+
+Registers a set of users, then drives POST /auth/token at a fixed concurrency
+for a fixed duration while probing GET /health, and reports logins/sec,
+latency percentiles, 503 rejections and /health latency under load (to show
+bcrypt is not starving the event loop).
+
+Runs the app in-process against a throwaway SQLite database:
+
+    python -m benchmarks.bench_login --concurrency 32 --duration 10
+
+Compare settings with e.g. PASSWORD_HASH_WORKERS=2 or BCRYPT_ROUNDS=10.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+_db_file = os.path.join(tempfile.mkdtemp(), "bench_login.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_db_file}")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import httpx
+
+from database import upgrade_schema
+from main import app
+from utils.security import BCRYPT_ROUNDS, PASSWORD_HASH_QUEUE, PASSWORD_HASH_WORKERS
+
+PASSWORD = "benchmark-password"
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def main(users: int, concurrency: int, duration: float):
+    await upgrade_schema()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(users):
+            await client.post("/auth/register", json={"username": f"bench_user_{i}", "password": PASSWORD})
+        
+        latencies, health_latencies = [], []
+        statuses = {}
+        deadline = time.perf_counter() + duration
+        
+        async def login_worker(worker_id: int):
+            i = worker_id
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.post(
+                    "/auth/token",
+                    data={"username": f"bench_user_{i % users}", "password": PASSWORD},
+                )
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                i += concurrency
+        
+        async def health_probe():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                await client.get("/health")
+                health_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.05)
+        
+        started = time.perf_counter()
+        await asyncio.gather(health_probe(), *(login_worker(w) for w in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    
+    ok = statuses.get(200, 0)
+    print(f"bcrypt rounds={BCRYPT_ROUNDS} workers={PASSWORD_HASH_WORKERS} queue={PASSWORD_HASH_QUEUE} "
+          f"concurrency={concurrency} duration={elapsed:.1f}s")
+    print(f"logins/sec      {ok / elapsed:8.1f}   statuses {dict(sorted(statuses.items()))}")
+    print(f"login latency   p50 {percentile(latencies, 50) * 1000:7.1f} ms   "
+          f"p95 {percentile(latencies, 95) * 1000:7.1f} ms   p99 {percentile(latencies, 99) * 1000:7.1f} ms")
+    if health_latencies:
+        print(f"/health latency p50 {statistics.median(health_latencies) * 1000:7.1f} ms   "
+              f"max {max(health_latencies) * 1000:7.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.concurrency, args.duration))
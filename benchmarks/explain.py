@@ -0,0 +1,162 @@
+"""
+Query-plan check: every hot query must be answered from an index.
+
+EXPLAINs the queries behind the busiest endpoints and the background
+loops, built the way the app builds them. On PostgreSQL sequential scans
+are disabled first, so a Seq Scan left in a plan means no index can serve
+the query at all, however small the tables are. On SQLite any full SCAN of
+a table fails the check; FTS5 reports a full-text MATCH as a scan of its
+virtual table with an M in the plan string, which is an index lookup.
+
+Some queries must also take a particular path (PLAN_REQUIREMENTS): search
+for a word nearly every message has must reach the messages through the
+user's conversations, not rank the matches of every user first.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.explain
+
+Exits 1 if a query fails. benchmarks.run checks the seeded database the
+same way before measuring anything.
+"""
+import asyncio
+import json
+import re
+import sys
+
+# Query name -> dialect -> pattern its plan must contain
+PLAN_REQUIREMENTS = {
+    "search_common_term": {
+        "postgresql": r"using ix_messages_conversation_id_id",
+        "sqlite": r"SEARCH conversations USING (COVERING )?INDEX \w+ \(user_id=\?\)",
+    },
+}
+
+def hot_queries(dialect: str) -> list:
+    """
+    (name, statement) for each query that must use an index. Parameters are
+    rendered into the SQL, so times are now() rather than bound datetimes;
+    the plans are the same. Search is written per dialect.
+    """
+    from sqlalchemy import and_, delete, func, or_, select, tuple_, update
+    from sqlalchemy.orm import aliased
+    from database import Conversation, ConversationArchive, GenerationJob, Message, User
+    from services.jobs import PENDING
+    from services.search import archived_statement, search_statement
+
+    now = func.now()
+    conversations = select(Conversation).where(Conversation.user_id == 1, Conversation.deleted_at.is_(None))
+    messages = select(Message).where(Message.conversation_id == 1)
+    other = aliased(GenerationJob)
+    head = (
+        select(func.min(other.id))
+        .where(other.conversation_id == GenerationJob.conversation_id, other.status.in_(PENDING))
+        .scalar_subquery()
+    )
+    return [
+        ("login", select(User).where(User.username == "bench_user_0")),
+        ("list_conversations", conversations.order_by(
+            Conversation.updated_at.desc(), Conversation.id.desc()
+        ).limit(21)),
+        ("list_conversations_before", conversations.where(
+            tuple_(Conversation.updated_at, Conversation.id) < tuple_(now, 100)
+        ).order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(21)),
+        ("owned_conversation", select(Conversation).where(
+            Conversation.id == 1, Conversation.user_id == 1, Conversation.deleted_at.is_(None)
+        )),
+        ("messages_latest", messages.order_by(Message.id.desc()).limit(51)),
+        ("messages_before", messages.where(Message.id < 100).order_by(Message.id.desc()).limit(51)),
+        ("messages_after", messages.where(Message.id > 100).order_by(Message.id).limit(51)),
+        ("history", messages.where(Message.id > 0).order_by(Message.id)),
+        ("bulk_delete", update(Conversation).where(
+            Conversation.user_id == 1, Conversation.deleted_at.is_(None), Conversation.id.in_([1, 2, 3])
+        ).values(deleted_at=now)),
+        ("purge_queue", select(Conversation.id).where(
+            Conversation.deleted_at.is_not(None)
+        ).order_by(Conversation.deleted_at).limit(100)),
+        ("archive_candidates", select(Conversation.id).where(
+            Conversation.archived_at.is_(None), Conversation.deleted_at.is_(None), Conversation.updated_at < now,
+            or_(Conversation.rehydrated_at.is_(None), Conversation.rehydrated_at < now),
+            Conversation.message_count <= 10000
+        ).order_by(Conversation.updated_at).limit(50)),
+        ("rehydrate", delete(ConversationArchive).where(ConversationArchive.conversation_id == 1)),
+        ("search", search_statement(dialect, 1, "payout failed", 21, 0)),
+        ("search_common_term", search_statement(dialect, 1, "app", 21, 0)),
+        ("search_archived", archived_statement(dialect, 1, "payout failed", 5)),
+        ("purge_jobs", delete(GenerationJob).where(GenerationJob.conversation_id == 1)),
+        ("purge_messages", delete(Message).where(Message.id.in_(
+            select(Message.id).where(Message.conversation_id == 1).limit(1000)
+        ))),
+        ("cascade_jobs", select(GenerationJob.id).where(GenerationJob.user_message_id == 1)),
+        ("claim_job", select(GenerationJob).where(
+            or_(
+                and_(GenerationJob.status == "queued", GenerationJob.available_at <= now),
+                and_(GenerationJob.status == "running", GenerationJob.locked_until < now)
+            ),
+            GenerationJob.id == head
+        ).order_by(GenerationJob.id).limit(1)),
+    ]
+
+def _postgres_nodes(plan: dict) -> list:
+    """'Node Type on relation using index' for every node of a FORMAT JSON plan"""
+    node = plan["Node Type"]
+    if "Relation Name" in plan:
+        node += f" on {plan['Relation Name']}"
+    if "Index Name" in plan:
+        node += f" using {plan['Index Name']}"
+    nodes = [node]
+    for child in plan.get("Plans", []):
+        nodes += _postgres_nodes(child)
+    return nodes
+
+def _sqlite_scans(lines: list) -> list:
+    """Full table scans in EXPLAIN QUERY PLAN output"""
+    return [
+        line for line in lines
+        if line.startswith("SCAN ") and not re.search(r"VIRTUAL TABLE INDEX \d+:\S*M", line)
+    ]
+
+async def check_query_plans(engine=None, verbose: bool = True) -> list:
+    """EXPLAIN every hot query; returns the names of those that scan a table or miss a required path"""
+    if engine is None:
+        from database import get_engine
+
+        engine = get_engine()
+
+    failed = []
+    async with engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            await conn.exec_driver_sql("SET enable_seqscan = off")
+        for name, statement in hot_queries(conn.dialect.name):
+            sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+            if postgres:
+                result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}")
+                plan = result.scalar()
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+                lines = _postgres_nodes(plan[0]["Plan"])
+                scans = [line for line in lines if line.startswith("Seq Scan")]
+            else:
+                result = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")
+                lines = [row[-1] for row in result]
+                scans = _sqlite_scans(lines)
+            required = PLAN_REQUIREMENTS.get(name, {}).get(conn.dialect.name)
+            ok = not scans and (required is None or re.search(required, "; ".join(lines)))
+            if not ok:
+                failed.append(name)
+            if verbose:
+                print(f"{'ok' if ok else 'FAIL':<6}{name:<28}{'; '.join(lines) if not ok or not postgres else ''}")
+        await conn.rollback()
+    return failed
+
+if __name__ == "__main__":
+    async def _main():
+        from database import check_schema, dispose_engine
+
+        await check_schema()
+        failed = await check_query_plans()
+        await dispose_engine()
+        return failed
+
+    failed = asyncio.run(_main())
+    if failed:
+        print(f"{len(failed)} hot queries scan a table or miss their index path: {', '.join(failed)}")
+        sys.exit(1)
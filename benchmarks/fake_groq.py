@@ -0,0 +1,168 @@
+"""
+Local stand-in for the Groq chat-completions API.
+
+Speaks the OpenAI-compatible wire format the groq SDK uses, both plain and
+streamed (with usage in the final chunk's `x_groq`), so the app runs its real
+client code against it. Point the app at it with GROQ_BASE_URL:
+
+    python -m benchmarks.fake_groq --port 8089 --ttft 0.4 --token-delay 0.02
+    GROQ_BASE_URL=http://127.0.0.1:8089 uvicorn main:app
+
+Latency, reply length and injected failures (500s and 429s with
+retry-after) are set by the options below; benchmarks.run starts one
+itself unless given --groq-url.
+"""
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from dataclasses import dataclass
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+WORDS = (
+    "open the app tap wallet then choose request payout enter the amount and confirm "
+    "your balance updates once the transfer is approved which usually takes one to two "
+    "business days you can track every step from the history screen"
+).split()
+
+@dataclass
+class FakeGroqConfig:
+    ttft: float = 0.3           # seconds before the first token (whole reply when not streaming)
+    token_delay: float = 0.01   # seconds between streamed tokens
+    tokens: int = 60            # completion tokens per reply
+    jitter: float = 0.2         # +/- fraction applied to every delay
+    error_rate: float = 0.0     # share of calls answered with a 500
+    rate_limit_rate: float = 0.0  # share of calls answered with a 429
+    retry_after: int = 1        # retry-after seconds sent with a 429
+    seed: int = 0
+
+def create_app(config: FakeGroqConfig) -> Starlette:
+    rng = random.Random(config.seed)
+    stats = {"calls": 0, "streams": 0, "errors": 0, "rate_limited": 0}
+
+    def delay(seconds: float) -> float:
+        return max(seconds * (1 + rng.uniform(-config.jitter, config.jitter)), 0.0)
+
+    def usage(messages: list) -> dict:
+        prompt = sum(len(str(m.get("content", ""))) for m in messages) // 4
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": config.tokens,
+            "total_tokens": prompt + config.tokens,
+        }
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["calls"] += 1
+        roll = rng.random()
+        if roll < config.rate_limit_rate:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached (fake)", "type": "tokens", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after": str(config.retry_after)},
+            )
+        if roll < config.rate_limit_rate + config.error_rate:
+            stats["errors"] += 1
+            return JSONResponse(
+                {"error": {"message": "Internal server error (fake)", "type": "internal_server_error"}},
+                status_code=500,
+            )
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        model = body.get("model", "fake")
+        words = [rng.choice(WORDS) for _ in range(config.tokens)]
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay(config.ttft + config.token_delay * config.tokens))
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words).capitalize() + "."},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }],
+                "usage": usage(body.get("messages", [])),
+                "system_fingerprint": "fake",
+            })
+
+        stats["streams"] += 1
+
+        def chunk(delta: dict, finish_reason=None, x_groq=None) -> str:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "system_fingerprint": "fake",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}],
+            }
+            if x_groq is not None:
+                data["x_groq"] = x_groq
+            return f"data: {json.dumps(data)}\n\n"
+
+        async def events():
+            await asyncio.sleep(delay(config.ttft))
+            for i, word in enumerate(words):
+                yield chunk({"role": "assistant", "content": word if i == 0 else " " + word})
+                await asyncio.sleep(delay(config.token_delay))
+            yield chunk({}, "stop", {"id": f"req_{completion_id}", "usage": usage(body.get("messages", []))})
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def fake_stats(request: Request):
+        return JSONResponse(stats)
+
+    async def models(request: Request):
+        # The app's warmup request
+        return JSONResponse({"object": "list", "data": []})
+
+    return Starlette(routes=[
+        Route("/openai/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/openai/v1/models", models),
+        Route("/stats", fake_stats),
+    ])
+
+def add_arguments(parser: argparse.ArgumentParser):
+    defaults = FakeGroqConfig()
+    parser.add_argument("--ttft", type=float, default=defaults.ttft, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=defaults.token_delay, help="seconds between streamed tokens")
+    parser.add_argument("--tokens", type=int, default=defaults.tokens, help="completion tokens per reply")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter, help="+/- fraction applied to delays")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="share of calls failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate, help="share of calls failing with 429")
+    parser.add_argument("--retry-after", type=int, default=defaults.retry_after, help="retry-after seconds on a 429")
+
+def config_from_args(args) -> FakeGroqConfig:
+    return FakeGroqConfig(
+        ttft=args.ttft,
+        token_delay=args.token_delay,
+        tokens=args.tokens,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--seed", type=int, default=0)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
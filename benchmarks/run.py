@@ -0,0 +1,403 @@
+"""
+Throughput and tail-latency benchmark for the main API paths.
+
+Seeds a database (benchmarks.seed), starts a fake Groq server
+(benchmarks.fake_groq) and drives each scenario at each concurrency level for
+a fixed duration, reporting RPS, p50/p95/p99 latency, status codes, DB
+queries per request (from the X-DB-Queries header) and response size on the
+wire (as negotiated with --accept-encoding). In-process runs also report CPU
+time and peak memory per request:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --scenarios send_message,stream_message --concurrency 8,32 --ttft 1
+    python -m benchmarks.run --json before.json
+    python -m benchmarks.run --json after.json --compare before.json
+    python -m benchmarks.run --scenarios fetch_history,export_history --accept-encoding identity
+
+Runs the app in-process against a throwaway SQLite database by default.
+--database-url runs it against e.g. a local Postgres instead (with --reset,
+which drops every table first). --base-url targets a running server; start it
+with the same DATABASE_URL and SECRET_KEY, GROQ_BASE_URL pointing at the fake
+server (--groq-url) and QUERY_COUNT_HEADER=true. --stub-llm answers with the
+in-process stub provider instead of the fake server, leaving only the app's
+own overhead.
+
+Before measuring, the seeded database's query plans are checked
+(benchmarks.explain); a hot query that scans a table stops the run.
+
+Streamed replies are timed to the last byte; their query counts cover the
+work done before the first one.
+
+CPU ms is the process CPU time of the measured window over its requests,
+client included. Peak KiB is the most Python memory held at once while
+serving one request, above what was held before it, traced with tracemalloc
+over PROBE_REQUESTS sequential requests after each measurement.
+"""
+from contextlib import AsyncExitStack
+from dataclasses import asdict, dataclass, field, fields
+from datetime import timedelta
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_groq import FakeGroqConfig, add_arguments, config_from_args
+from benchmarks.seed import PASSWORD, QUESTIONS
+
+SCENARIOS = [
+    "login", "list_conversations", "fetch_history", "export_history", "search", "send_message", "stream_message"
+]
+# Search terms: words of the seeded questions, so most searches have hits
+SEARCH_TERMS = sorted({word.strip("?.,!").lower() for question in QUESTIONS for word in question.split() if len(word) > 4})
+# Sequential requests traced for peak memory after each measurement
+PROBE_REQUESTS = 10
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+@dataclass
+class Result:
+    scenario: str
+    concurrency: int
+    requests: int = 0
+    seconds: float = 0.0
+    rps: float = 0.0
+    p50_ms: float = 0.0
+    p95_ms: float = 0.0
+    p99_ms: float = 0.0
+    db_queries: float | None = None   # mean per request, when the header is served
+    kib: float | None = None          # mean response body on the wire
+    cpu_ms: float | None = None       # process CPU time per request, in-process runs only
+    peak_kib: float | None = None     # mean peak memory per request, in-process runs only
+    statuses: dict = field(default_factory=dict)
+
+class Scenarios:
+    """One request per call; each picks its user and conversation at random"""
+
+    def __init__(self, client, data, tokens: dict, long_thread_share: float):
+        self.client = client
+        self.data = data
+        self.tokens = tokens
+        self.long_thread_share = long_thread_share
+        self.owners = {conv_id: user_id for user_id, convs in data.conversations.items() for conv_id in convs}
+
+    def _user(self, rng: random.Random) -> tuple[int, dict]:
+        user_id, _ = rng.choice(self.data.users)
+        return user_id, {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+    def _long_thread(self, rng: random.Random) -> tuple[int, dict]:
+        conv_id = rng.choice(self.data.long_threads)
+        return conv_id, {"Authorization": f"Bearer {self.tokens[self.owners[conv_id]]}"}
+
+    def _conversation(self, rng: random.Random) -> tuple[int, dict]:
+        if self.data.long_threads and rng.random() < self.long_thread_share:
+            return self._long_thread(rng)
+        user_id, headers = self._user(rng)
+        return rng.choice(self.data.conversations[user_id]), headers
+
+    async def login(self, rng):
+        _, username = rng.choice(self.data.users)
+        return await self.client.post("/auth/token", data={"username": username, "password": PASSWORD})
+
+    async def list_conversations(self, rng):
+        _, headers = self._user(rng)
+        return await self.client.get("/api/conversations/", params={"limit": 20}, headers=headers)
+
+    async def fetch_history(self, rng):
+        conv_id, headers = self._conversation(rng)
+        return await self.client.get(f"/api/conversations/{conv_id}/messages", params={"limit": 50}, headers=headers)
+
+    async def export_history(self, rng):
+        """A whole thread, the long ones when seeded"""
+        conv_id, headers = self._long_thread(rng) if self.data.long_threads else self._conversation(rng)
+        async with self.client.stream(
+            "GET", f"/api/conversations/{conv_id}/messages/export", headers=headers
+        ) as response:
+            async for _ in response.aiter_raw():
+                pass
+        return response
+
+    async def search(self, rng):
+        _, headers = self._user(rng)
+        return await self.client.get(
+            "/api/conversations/search", params={"q": rng.choice(SEARCH_TERMS), "limit": 20}, headers=headers
+        )
+
+    async def send_message(self, rng):
+        conv_id, headers = self._conversation(rng)
+        return await self.client.post(
+            f"/api/conversations/{conv_id}/messages",
+            json={"content": rng.choice(QUESTIONS)},
+            headers=headers,
+        )
+
+    async def stream_message(self, rng):
+        conv_id, headers = self._conversation(rng)
+        async with self.client.stream(
+            "POST",
+            f"/api/conversations/{conv_id}/messages/stream",
+            json={"content": rng.choice(QUESTIONS)},
+            headers=headers,
+        ) as response:
+            async for _ in response.aiter_raw():
+                pass
+        return response
+
+async def probe_memory(call, scenario: str, seed: int) -> float:
+    """Mean peak KiB allocated while serving one request, over PROBE_REQUESTS in a row"""
+    rng = random.Random(f"{seed}:{scenario}:probe")
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(PROBE_REQUESTS):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await call(rng)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return round(sum(peaks) / len(peaks) / 1024, 1)
+
+async def measure(call, scenario: str, concurrency: int, duration: float, warmup: float, seed: int) -> Result:
+    latencies, queries, sizes = [], [], []
+    statuses = {}
+    recording = False
+    deadline = time.perf_counter() + warmup + duration
+
+    async def worker(worker_id: int):
+        rng = random.Random(f"{seed}:{scenario}:{concurrency}:{worker_id}")
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await call(rng)
+                status = response.status_code
+                count = response.headers.get("x-db-queries")
+                size = response.num_bytes_downloaded
+            except Exception as e:
+                status, count, size = type(e).__name__, None, None
+            if not recording:
+                continue
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if count is not None:
+                queries.append(int(count))
+            if size is not None:
+                sizes.append(size)
+
+    tasks = [asyncio.create_task(worker(w)) for w in range(concurrency)]
+    await asyncio.sleep(warmup)
+    recording = True
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    return Result(
+        scenario=scenario,
+        concurrency=concurrency,
+        requests=len(latencies),
+        seconds=round(elapsed, 2),
+        rps=round(len(latencies) / elapsed, 1),
+        p50_ms=round(percentile(latencies, 50) * 1000, 1),
+        p95_ms=round(percentile(latencies, 95) * 1000, 1),
+        p99_ms=round(percentile(latencies, 99) * 1000, 1),
+        db_queries=round(sum(queries) / len(queries), 1) if queries else None,
+        kib=round(sum(sizes) / len(sizes) / 1024, 1) if sizes else None,
+        cpu_ms=round(cpu / len(latencies) * 1000, 2) if latencies else None,
+        statuses=dict(sorted(statuses.items())),
+    )
+
+def _optional(value) -> str:
+    return f"{value:9.1f}" if value is not None else f"{'-':>9}"
+
+def print_result(r: Result, before: dict | None = None):
+    """One table row, plus the change against the baseline run when there is one"""
+    print(f"{r.scenario:<20}{r.concurrency:>5}{r.requests:>8}{r.rps:>9.1f}"
+          f"{r.p50_ms:>9.1f}{r.p95_ms:>9.1f}{r.p99_ms:>9.1f}{_optional(r.db_queries)}"
+          f"{_optional(r.kib)}{_optional(r.cpu_ms)}{_optional(r.peak_kib)}  {r.statuses}")
+    if before:
+        def delta(now, then):
+            return f"{(now - then) / then * 100:+.0f}%" if now is not None and then else f"{'-':>5}"
+        print(f"{'  vs baseline':<33}{delta(r.rps, before['rps']):>9}{delta(r.p50_ms, before['p50_ms']):>9}"
+              f"{delta(r.p95_ms, before['p95_ms']):>9}{delta(r.p99_ms, before['p99_ms']):>9}"
+              f"{_optional(before.get('db_queries'))}{delta(r.kib, before.get('kib')):>9}"
+              f"{delta(r.cpu_ms, before.get('cpu_ms')):>9}{delta(r.peak_kib, before.get('peak_kib')):>9}")
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_fake_groq(config: FakeGroqConfig) -> tuple[subprocess.Popen, str]:
+    """Run benchmarks.fake_groq in its own process so it doesn't share the app's event loop"""
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.fake_groq", "--port", str(port)]
+    for f in fields(config):
+        command += [f"--{f.name.replace('_', '-')}", str(getattr(config, f.name))]
+    process = subprocess.Popen(command, cwd=Path(__file__).resolve().parent.parent)
+    deadline = time.monotonic() + 15
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise SystemExit("Fake Groq server failed to start")
+            time.sleep(0.1)
+    return process, f"http://127.0.0.1:{port}"
+
+async def main(args, scenarios: list[str], levels: list[int], fake_config: FakeGroqConfig):
+    import httpx
+    from benchmarks.explain import check_query_plans
+    from benchmarks.seed import seed
+    from database import dispose_engine, get_engine
+    from utils.security import create_access_token
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    data = await seed(
+        args.users, args.conversations, args.messages,
+        args.long_threads, args.long_thread_messages, args.seed, args.reset,
+    )
+    engine = get_engine()
+    failed = await check_query_plans(engine, verbose=False)
+    if failed:
+        await dispose_engine()
+        raise SystemExit(f"Hot queries scan a table or miss their index path: {', '.join(failed)}; see python -m benchmarks.explain")
+    tokens = {
+        user_id: create_access_token({"sub": username, "uid": user_id}, timedelta(hours=12))
+        for user_id, username in data.users
+    }
+
+    lifespan = AsyncExitStack()
+    headers = {"Accept-Encoding": args.accept_encoding}
+    if args.base_url:
+        client = httpx.AsyncClient(
+            base_url=args.base_url, headers=headers, timeout=300, limits=httpx.Limits(max_connections=max(levels))
+        )
+    else:
+        from main import app
+        from services.warmup import warmup
+
+        logging.getLogger().setLevel(logging.WARNING)
+        await lifespan.enter_async_context(app.router.lifespan_context(app))
+        # Measure a warm worker, as a load balancer waiting on /ready would
+        await warmup.wait()
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://bench", headers=headers, timeout=300
+        )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+
+    results = []
+    print(f"{'scenario':<20}{'conc':>5}{'reqs':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'queries':>9}{'KiB':>9}{'cpu ms':>9}{'peak KiB':>9}  statuses")
+    try:
+        runner = Scenarios(client, data, tokens, args.long_thread_share)
+        for scenario in scenarios:
+            for concurrency in levels:
+                call = getattr(runner, scenario)
+                result = await measure(call, scenario, concurrency, args.duration, args.warmup, args.seed)
+                if args.base_url:
+                    # The server's CPU and memory are not this process's
+                    result.cpu_ms = None
+                else:
+                    result.peak_kib = await probe_memory(call, scenario, args.seed)
+                results.append(result)
+                print_result(result, (baseline or {}).get((scenario, concurrency)))
+    finally:
+        await client.aclose()
+        await lifespan.aclose()
+        await dispose_engine()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "database": engine.dialect.name,
+                "target": args.base_url or "in-process",
+                "llm": "stub" if args.stub_llm else args.groq_url or asdict(fake_config),
+                "settings": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+                "results": [asdict(r) for r in results],
+            }, f, indent=2)
+        print(f"Wrote {args.json}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per scenario and level")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before each run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="print deltas against results written by --json")
+    parser.add_argument("--accept-encoding", default="gzip", help="Accept-Encoding sent with every request")
+
+    target = parser.add_argument_group("target")
+    target.add_argument("--database-url", help="default: a throwaway SQLite file")
+    target.add_argument("--reset", action="store_true", help="drop all tables before migrating and seeding")
+    target.add_argument("--base-url", help="benchmark a running server instead of the app in-process")
+    target.add_argument("--groq-url", help="use this Groq endpoint instead of starting the fake server")
+    target.add_argument("--stub-llm", action="store_true",
+                        help="answer with the stub LLM provider (LLM_STUB_LATENCY) instead of a fake server")
+
+    seeded = parser.add_argument_group("seeded data")
+    seeded.add_argument("--users", type=int, default=20)
+    seeded.add_argument("--conversations", type=int, default=10, help="per user")
+    seeded.add_argument("--messages", type=int, default=20, help="average per conversation")
+    seeded.add_argument("--long-threads", type=int, default=2)
+    seeded.add_argument("--long-thread-messages", type=int, default=1000)
+    seeded.add_argument("--long-thread-share", type=float, default=0.2,
+                      help="share of history/send requests that hit a long thread")
+
+    add_arguments(parser.add_argument_group("fake Groq server"))
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    fake_config = config_from_args(args)
+
+    # The app reads its settings at import time, so they go in before main() imports it
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    os.environ.setdefault("AUTH_MODE", "production")
+    os.environ.setdefault("QUERY_COUNT_HEADER", "true")
+    # Measure the app, not Groq's free-tier quotas
+    os.environ.setdefault("GROQ_RPM", "0")
+    os.environ.setdefault("GROQ_TPM", "0")
+
+    fake_groq = None
+    if args.stub_llm:
+        os.environ["LLM_PROVIDER"] = "stub"
+    elif args.groq_url:
+        os.environ["GROQ_BASE_URL"] = args.groq_url
+    else:
+        fake_groq, os.environ["GROQ_BASE_URL"] = start_fake_groq(fake_config)
+        print(f"Fake Groq server on {os.environ['GROQ_BASE_URL']}")
+    try:
+        asyncio.run(main(args, scenarios, levels, fake_config))
+    finally:
+        if fake_groq is not None:
+            fake_groq.terminate()
+            fake_groq.wait()
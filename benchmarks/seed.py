@@ -0,0 +1,166 @@
+"""
+Seeded benchmark data: users, conversations and a few long threads.
+
+The same --seed always produces the same data, so before/after runs compare
+like with like. Every user gets the password "benchmark-password" (hashed
+once, at the configured BCRYPT_ROUNDS).
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.seed --users 50 --reset
+
+The schema is brought up to date with the migrations first. --reset drops
+every table before that; only point it at a throwaway database. benchmarks.run seeds its own database through seed().
+"""
+from dataclasses import dataclass, field
+from datetime import timedelta
+import argparse
+import asyncio
+import random
+
+PASSWORD = "benchmark-password"
+
+QUESTIONS = [
+    "How do I withdraw money from my wallet?",
+    "Why is my payout still pending?",
+    "How can I change the phone number on my account?",
+    "The app crashes when I open the history screen",
+    "Can I get a refund for a cancelled order?",
+    "How do referral bonuses work?",
+    "আমার পেমেন্ট কেন আটকে আছে?",
+    "কিভাবে পাসওয়ার্ড পরিবর্তন করব?",
+]
+ANSWER_SENTENCES = [
+    "Open the app and tap Wallet.",
+    "Choose Request Payout and enter the amount, at least $10.",
+    "Payouts are usually approved within one to two business days.",
+    "You can follow every step from the History screen.",
+    "If it takes longer, contact support with your transaction id.",
+    "Go to Settings, then Account, to update your details.",
+    "Make sure you are on the latest version of the app.",
+    "আপনার অনুরোধ প্রক্রিয়াধীন আছে, অনুগ্রহ করে অপেক্ষা করুন।",
+]
+
+@dataclass
+class SeededData:
+    """What the scenarios need to address the seeded rows"""
+    users: list = field(default_factory=list)          # (id, username)
+    conversations: dict = field(default_factory=dict)  # user_id -> [conversation ids]
+    long_threads: list = field(default_factory=list)   # conversation ids
+
+def _thread(rng: random.Random, conv_id: int, length: int) -> list:
+    from services.context import count_tokens
+
+    rows = []
+    for i in range(length):
+        if i % 2 == 0:
+            sender, content = "user", rng.choice(QUESTIONS)
+        else:
+            sender = "ai"
+            content = " ".join(rng.sample(ANSWER_SENTENCES, rng.randint(2, 5)))
+        rows.append({
+            "conversation_id": conv_id,
+            "sender": sender,
+            "content": content,
+            "token_count": count_tokens(content),
+        })
+    return rows
+
+async def seed(
+    users: int = 20,
+    conversations: int = 10,
+    messages: int = 20,
+    long_threads: int = 2,
+    long_thread_messages: int = 1000,
+    seed_value: int = 0,
+    reset: bool = False,
+) -> SeededData:
+    """
+    Insert users with `conversations` conversations of about `messages`
+    messages each; the first `long_threads` users also get one thread of
+    `long_thread_messages` messages. Conversation activity columns are set
+    as the app would have.
+    """
+    from sqlalchemy import func, insert, select, text, update
+    from database import SEARCH_TABLES, Base, Conversation, Message, PREVIEW_LENGTH, User, get_engine, upgrade_schema, utcnow
+    from utils.security import get_password_hash
+
+    rng = random.Random(seed_value)
+    engine = get_engine()
+    if reset:
+        async with engine.begin() as conn:
+            # The search tables are not in the metadata, and on Postgres
+            # they depend on tables in it
+            for table in SEARCH_TABLES:
+                await conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+            await conn.run_sync(Base.metadata.drop_all)
+            if conn.dialect.name == "postgresql":
+                await conn.execute(text("DROP TEXT SEARCH CONFIGURATION IF EXISTS chat_search"))
+            await conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
+    await upgrade_schema()
+    async with engine.begin() as conn:
+        if await conn.scalar(select(func.count()).select_from(User)):
+            raise SystemExit("Database already has users; seed a fresh one or pass --reset")
+
+    data = SeededData()
+    hashed = get_password_hash(PASSWORD)
+    now = utcnow()
+    async with engine.begin() as conn:
+        result = await conn.execute(
+            insert(User).returning(User.id, User.username, sort_by_parameter_order=True),
+            [{"username": f"bench_user_{i}", "hashed_password": hashed} for i in range(users)],
+        )
+        data.users = sorted((row.id, row.username) for row in result)
+
+        for index, (user_id, _) in enumerate(data.users):
+            lengths = [max(2, int(rng.gauss(messages, messages / 3))) // 2 * 2 for _ in range(conversations)]
+            if index < long_threads:
+                lengths.append(long_thread_messages)
+            result = await conn.execute(
+                insert(Conversation).returning(Conversation.id, sort_by_parameter_order=True),
+                [{"user_id": user_id, "title": rng.choice(QUESTIONS)[:50]} for _ in lengths],
+            )
+            conv_ids = [row.id for row in result]
+            data.conversations[user_id] = conv_ids
+            if index < long_threads:
+                data.long_threads.append(conv_ids[-1])
+
+            for conv_id, length in zip(conv_ids, lengths):
+                rows = _thread(rng, conv_id, length)
+                for start in range(0, len(rows), 1000):
+                    await conn.execute(insert(Message), rows[start:start + 1000])
+                last_active = now - timedelta(minutes=rng.randint(0, 30 * 24 * 60))
+                await conn.execute(
+                    update(Conversation)
+                    .where(Conversation.id == conv_id)
+                    .values(
+                        message_count=len(rows),
+                        last_message_at=last_active,
+                        last_message_preview=" ".join(rows[-1]["content"].split())[:PREVIEW_LENGTH],
+                        updated_at=last_active,
+                    )
+                )
+    return data
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--conversations", type=int, default=10, help="per user")
+    parser.add_argument("--messages", type=int, default=20, help="average per conversation")
+    parser.add_argument("--long-threads", type=int, default=2)
+    parser.add_argument("--long-thread-messages", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reset", action="store_true", help="drop all tables first")
+    args = parser.parse_args()
+
+    async def _main():
+        from database import dispose_engine
+
+        data = await seed(
+            args.users, args.conversations, args.messages,
+            args.long_threads, args.long_thread_messages, args.seed, args.reset,
+        )
+        await dispose_engine()
+        print(f"Seeded {len(data.users)} users, "
+              f"{sum(len(c) for c in data.conversations.values())} conversations, "
+              f"{len(data.long_threads)} long threads")
+
+    asyncio.run(_main())
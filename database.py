@@ -1,27 +1,178 @@
-from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 from dotenv import load_dotenv
+from datetime import datetime, timezone
+from uuid import uuid4
+import logging
 import os
+import time
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Connection pool, per worker process. Size it so that
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays below max_connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# "session": pool connections in-process (direct Postgres or pgbouncer session
+# pooling). "transaction": pgbouncer transaction pooling, where pgbouncer owns
+# the pooling and server-side prepared statements cannot be reused.
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "session").lower()
+
+def _async_database_url(url: str) -> str:
+    """Point plain postgresql:// and sqlite:// URLs at their async drivers"""
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+class PoolStats:
+    """Checkout counters for the engine's pool, reported by /health"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.overflow_events = 0
+        self.timeouts = 0
+
+    def record_checkout(self, waited: float):
+        self.checkouts += 1
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+pool_stats = PoolStats()
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records checkout wait time, overflow connections and timeouts"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            conn = super().connect()
+        except PoolTimeoutError:
+            pool_stats.timeouts += 1
+            logger.warning(f"DB pool checkout timed out after {DB_POOL_TIMEOUT}s: {self.status()}")
+            raise
+        pool_stats.record_checkout(time.perf_counter() - start)
+        return conn
+
+    def _create_connection(self):
+        # Only called for connections beyond the idle ones, right after the
+        # overflow counter is incremented: > 0 means past pool_size. Read it
+        # before connecting, other checkouts may increment it meanwhile.
+        if self._overflow > 0:
+            pool_stats.overflow_events += 1
+        return super()._create_connection()
+
+def _engine_options(url: str) -> dict:
+    """Pool settings from the environment; SQLite keeps its driver defaults"""
+    if url.startswith("sqlite"):
+        return {}
+    if DB_POOL_MODE == "transaction":
+        # Each checkout gets a fresh pgbouncer client connection. asyncpg's
+        # statement cache is disabled and statement names made unique so two
+        # clients never collide on one server connection.
+        return {
+            "poolclass": NullPool,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            },
+        }
+    return {
+        "poolclass": InstrumentedPool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+_engine = None
+
+def get_engine():
+    """
+    The process's engine, created on first use rather than at import, so
+    importing the app opens nothing and loads no database driver.
+    """
+    global _engine
+    if _engine is None:
+        url = _async_database_url(SQLALCHEMY_DATABASE_URL)
+        _engine = create_async_engine(url, **_engine_options(url))
+        if url.startswith("sqlite"):
+            # SQLite leaves foreign keys, and so ON DELETE CASCADE, off per connection
+            @event.listens_for(_engine.sync_engine, "connect")
+            def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA foreign_keys=ON")
+                cursor.close()
+    return _engine
+
+async def dispose_engine():
+    """Close the pool's connections, if an engine was ever created"""
+    if _engine is not None:
+        await _engine.dispose()
+
+def pool_status() -> dict:
+    """Live pool occupancy plus cumulative checkout stats for this worker"""
+    if _engine is None:
+        return {"mode": DB_POOL_MODE, "pool": None}
+    pool = _engine.sync_engine.pool
+    status = {"mode": DB_POOL_MODE, "pool": type(pool).__name__}
+    if isinstance(pool, InstrumentedPool):
+        status.update({
+            "size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "checkouts": pool_stats.checkouts,
+            "avg_wait_ms": round(1000 * pool_stats.wait_seconds / pool_stats.checkouts, 2) if pool_stats.checkouts else 0.0,
+            "max_wait_ms": round(1000 * pool_stats.max_wait_seconds, 2),
+            "overflow_events": pool_stats.overflow_events,
+            "timeouts": pool_stats.timeouts,
+        })
+    return status
+
+class _LazySessionmaker(async_sessionmaker):
+    """Binds to get_engine() when the first session is made"""
+
+    def __call__(self, **local_kw) -> AsyncSession:
+        if self.kw.get("bind") is None:
+            self.configure(bind=get_engine())
+        return super().__call__(**local_kw)
+
+# expire_on_commit=False: objects stay usable after commit without a lazy
+# reload, which an AsyncSession cannot do implicitly
+SessionLocal = _LazySessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # মডেলগুলো (আগের মতোই)
-from sqlalchemy import Column, Integer, String, Text, ForeignKey
+from sqlalchemy import Column, DateTime, Integer, LargeBinary, String, Text, ForeignKey, Index, func, text
 from sqlalchemy.orm import relationship
 
-def get_db():
-    db = SessionLocal()
-    try:
+PREVIEW_LENGTH = 100
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 class User(Base):
     __tablename__ = "users"
@@ -32,20 +183,153 @@ class User(Base):
 class Conversation(Base):
     __tablename__ = "conversations"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     title = Column(String, default="New Conversation")
+    # Denormalized activity, maintained by the message write path so the
+    # conversation list never has to touch the messages table
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_at = Column(DateTime(timezone=True))
+    last_message_preview = Column(String(PREVIEW_LENGTH))
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=utcnow, server_default=func.now())
+    # Rolling summary of every message with id <= summary_upto_id; only the
+    # newer tail is sent to the model verbatim
+    summary = Column(Text)
+    summary_upto_id = Column(Integer, nullable=False, default=0, server_default="0")
+    # Set when the user deletes it; hidden from then on and removed by the
+    # purger (services.purge)
+    deleted_at = Column(DateTime(timezone=True))
+    # Set while its messages live in conversation_archives instead of the
+    # messages table (services.archive)
+    archived_at = Column(DateTime(timezone=True))
+    # Last time it was brought back; counts as activity for the archiver
+    rehydrated_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), default=utcnow, server_default=func.now())
     user = relationship("User", back_populates="conversations")
 
+    # Every index here comes from a migration (migrations/versions)
+    __table_args__ = (
+        # Sidebar query: WHERE user_id = ? ORDER BY updated_at DESC, id DESC
+        Index("ix_conversations_user_activity", "user_id", "updated_at", "id"),
+        # Ownership checks and bulk deletes: WHERE user_id = ? AND id ...
+        Index("ix_conversations_user_id_id", "user_id", "id"),
+        # Purger's queue; stays tiny because only deleted rows are in it
+        Index(
+            "ix_conversations_deleted_at", "deleted_at",
+            postgresql_where=text("deleted_at IS NOT NULL"),
+            sqlite_where=text("deleted_at IS NOT NULL")
+        ),
+        # Archiver's queue: live, hot conversations by last activity
+        Index(
+            "ix_conversations_archive_candidates", "updated_at",
+            postgresql_where=text("archived_at IS NULL AND deleted_at IS NULL"),
+            sqlite_where=text("archived_at IS NULL AND deleted_at IS NULL")
+        ),
+    )
+
 class Message(Base):
     __tablename__ = "messages"
     id = Column(Integer, primary_key=True, index=True)
-    conversation_id = Column(Integer, ForeignKey("conversations.id"))
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"))
     sender = Column(String)  # "user" or "ai"
     content = Column(Text)
+    token_count = Column(Integer)  # estimated once at insert, see services.context
+    created_at = Column(DateTime(timezone=True), default=utcnow, server_default=func.now())
+
+    __table_args__ = (
+        # Message pages, history loads and purge batches:
+        # WHERE conversation_id = ? AND id > ? ORDER BY id
+        Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+    )
+
+class GenerationJob(Base):
+    """An AI reply waiting to be generated by a worker, see services.jobs"""
+    __tablename__ = "generation_jobs"
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    user_message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String(16), nullable=False, default="queued")  # queued, running, done, failed
+    # Every claim counts; it doubles as the lease version a worker must still hold to finish
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    available_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    locked_by = Column(String(100))
+    locked_until = Column(DateTime(timezone=True))
+    ai_message_id = Column(Integer, ForeignKey("messages.id", ondelete="SET NULL"))
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    finished_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        # Claim query: the oldest unfinished job of each conversation
+        Index("ix_generation_jobs_status_conversation", "status", "conversation_id", "id"),
+        # Purging a conversation's jobs
+        Index("ix_generation_jobs_conversation_id_id", "conversation_id", "id"),
+        # ON DELETE CASCADE / SET NULL lookups for every deleted message
+        Index("ix_generation_jobs_user_message_id", "user_message_id"),
+        Index("ix_generation_jobs_ai_message_id", "ai_message_id"),
+    )
+
+class ConversationArchive(Base):
+    """An archived conversation's messages as one compressed record, see services.archive"""
+    __tablename__ = "conversation_archives"
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)
+    codec = Column(String(16), nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    raw_bytes = Column(Integer, nullable=False)
+    compressed_bytes = Column(Integer, nullable=False)
+    archived_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+
+# Full-text search tables (migration 0005, services.search) are not ORM
+# models; on SQLite FTS5 adds shadow tables named after them
+SEARCH_TABLES = ("messages_fts", "conversation_archive_search")
 
 # রিলেশনশিপ (অপশনাল কিন্তু ভালো)
-User.conversations = relationship("Conversation", back_populates="user")
-Conversation.messages = relationship("Message")
+# passive_deletes: the database's ON DELETE CASCADE removes children, the ORM never loads them
+User.conversations = relationship("Conversation", back_populates="user", passive_deletes=True)
+Conversation.messages = relationship("Message", passive_deletes=True)
+
+# Schema: versioned Alembic migrations in migrations/, never create_all
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# Upgrade the database on startup. Off by default in production, where
+# `alembic upgrade head` runs once per deploy and processes only check the
+# schema is current, so several of them never race to migrate.
+DB_AUTO_MIGRATE = os.getenv(
+    "DB_AUTO_MIGRATE", "false" if os.getenv("AUTH_MODE") == "production" else "true"
+).lower() in ("1", "true", "yes")
+
+def _alembic_config(connection=None):
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    config.attributes["connection"] = connection
+    return config
+
+async def upgrade_schema():
+    """Apply every pending migration, like `alembic upgrade head`"""
+    from alembic import command
+
+    async with get_engine().connect() as conn:
+        await conn.run_sync(lambda sync_conn: command.upgrade(_alembic_config(sync_conn), "head"))
+        await conn.commit()
+
+async def check_schema():
+    """Raise RuntimeError unless the database is at the latest migration"""
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    head = ScriptDirectory.from_config(_alembic_config()).get_current_head()
+    async with get_engine().connect() as conn:
+        current = await conn.run_sync(lambda sync_conn: MigrationContext.configure(sync_conn).get_current_revision())
+    if current != head:
+        raise RuntimeError(
+            f"Database schema is at revision {current}, expected {head}; run `alembic upgrade head`"
+        )
 
-# টেবিল তৈরি (প্রথমবার চালালে)
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+async def ensure_schema():
+    """Startup hook: migrate, or with DB_AUTO_MIGRATE off only check"""
+    if DB_AUTO_MIGRATE:
+        await upgrade_schema()
+    else:
+        await check_schema()
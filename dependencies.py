@@ -1,8 +1,11 @@
-from fastapi import Request, Depends, HTTPException, status
+from fastapi import Request, Depends, HTTPException, WebSocket, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from dataclasses import dataclass
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import SessionLocal, User
-from utils.security import decode_access_token
+from utils.cache import TTLCache
+from utils.security import decode_access_token, hash_password_async
 import logging
 import os
 from typing import Optional
@@ -16,47 +19,116 @@ AUTH_MODE = os.getenv("AUTH_MODE", "development")
 DEV_USER_ID = 1
 DEV_USERNAME = "test_user"
 
-def get_db():
+# Resolved principals are cached per process. Changes made through the ORM
+# invalidate immediately in this worker; other workers see them within the TTL.
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """The authenticated principal; a plain value, safe to share between requests"""
+    id: int
+    username: str
+
+_principal_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+def invalidate_user(user_id: int, username: str | None = None):
+    """Drop a user from the principal cache after it is changed or deleted"""
+    _principal_cache.delete(("id", user_id))
+    if username:
+        _principal_cache.delete(("username", username))
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_on_change(mapper, connection, target):
+    invalidate_user(target.id, target.username)
+    # A rename must also drop the entry cached under the old username
+    for old_username in inspect(target).attrs.username.history.deleted:
+        invalidate_user(target.id, old_username)
+
+def _remember(user: User, *keys) -> CurrentUser:
+    principal = CurrentUser(id=user.id, username=user.username)
+    for key in keys:
+        _principal_cache.set(key, principal)
+    return principal
+
+async def get_db():
     """Database session dependency"""
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-def get_or_create_dev_user(db: Session) -> User:
+async def get_or_create_dev_user(db: AsyncSession) -> User:
     """Get or create a test user for development"""
-    user = db.query(User).filter(User.id == DEV_USER_ID).first()
+    user = await db.get(User, DEV_USER_ID)
     if not user:
-        from utils.security import get_password_hash
         user = User(
             id=DEV_USER_ID,
             username=DEV_USERNAME,
-            hashed_password=get_password_hash("dev_password")
+            hashed_password=await hash_password_async("dev_password")
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
         logger.info(f"Development user created: {DEV_USERNAME}")
     return user
 
-def get_current_user(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
+async def _load_principal(user_id: int | None, username: str) -> CurrentUser | None:
+    """Resolve a token's user from the database and cache it"""
+    async with SessionLocal() as db:
+        if user_id is not None:
+            user = await db.get(User, user_id)
+            # Guard against a recycled id now belonging to someone else
+            if user and user.username != username:
+                user = None
+        else:
+            result = await db.execute(select(User).where(User.username == username))
+            user = result.scalars().first()
+    if not user:
+        return None
+    return _remember(user, ("id", user.id), ("username", user.username))
+
+async def get_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
+) -> CurrentUser:
     """
     Get current authenticated user from JWT token or development mode.
     
     In development mode: Returns default test user
     In production mode: Requires valid JWT token
+    
+    Principals are served from an in-process TTL cache, so most requests
+    authenticate without a database round trip or session checkout.
+    """
+    principal, _ = await _authenticate(credentials.credentials if credentials else None)
+    return principal
+
+async def get_websocket_user(websocket: WebSocket) -> tuple[CurrentUser, float | None]:
+    """
+    Authenticate a WebSocket handshake, returning the user and the token's
+    expiry (epoch seconds, None in development mode).
+    
+    The token comes from an `Authorization: Bearer` header or, for clients
+    that cannot set headers on a WebSocket (browsers), a `token` query
+    parameter. Raises HTTPException like get_current_user.
     """
+    token = websocket.query_params.get("token")
+    scheme, _, value = websocket.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and value:
+        token = value
+    return await _authenticate(token)
+
+async def _authenticate(token: Optional[str]) -> tuple[CurrentUser, float | None]:
+    """Resolve a bearer token, ignored in development mode, to its user and expiry"""
     # Development mode - return default user without token validation
     if AUTH_MODE == "development":
         logger.debug("Development mode: Using default test user")
-        return get_or_create_dev_user(db)
+        principal = _principal_cache.get(("id", DEV_USER_ID))
+        if principal is None:
+            async with SessionLocal() as db:
+                principal = _remember(await get_or_create_dev_user(db), ("id", DEV_USER_ID))
+        return principal, None
     
     # Production mode - require valid token
-    if not credentials:
+    if not token:
         logger.warning("Missing authentication credentials in production mode")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -64,22 +136,25 @@ def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    token = credentials.credentials
     payload = decode_access_token(token)
     username: str = payload.get("sub")
+    # Tokens issued before "uid" was added carry only the username
+    user_id: Optional[int] = payload.get("uid")
     
-    # Fetch user from database
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
+    key = ("id", user_id) if user_id is not None else ("username", username)
+    principal = _principal_cache.get(key)
+    if principal is None or principal.username != username:
+        principal = await _load_principal(user_id, username)
+    if not principal:
         logger.warning(f"Token valid but user not found: {username}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
         )
-    return user
+    return principal, payload.get("exp")
 
-def get_current_user_id(
-    current_user: User = Depends(get_current_user)
+async def get_current_user_id(
+    current_user: CurrentUser = Depends(get_current_user)
 ) -> int:
     """Convenience function to get just the user_id"""
-    return current_user.id
\ No newline at end of file
+    return current_user.id
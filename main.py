@@ -1,10 +1,25 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.exceptions import RequestValidationError
 import logging
 import os
-from routes import conversations, messages
+from routes import auth, conversations, messages
+from database import dispose_engine, ensure_schema, get_engine, pool_status
+from services.ai_services import completions_in_flight
+from services.answer_cache import get_answer_cache
+from services.archive import ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL, conversation_archiver
+from services.hub import close_conversation_hub, get_conversation_hub
+from services.jobs import GENERATION_WORKERS, generation_workers
+from services.llm_gate import get_llm_gate
+from services.llm_providers import LLM_PROVIDER, close_provider
+from services.model_router import routing_stats
+from services.purge import PURGE_INTERVAL, conversation_purger
+from services.warmup import warmup
+from utils.metrics import MetricsMiddleware, instrument_engine, render_metrics
+from utils.profiling import ProfilingMiddleware
+from utils.responses import CompressionMiddleware, FastJSONResponse
 
 # Configure logging
 logging.basicConfig(
@@ -20,11 +35,45 @@ for var in required_env_vars:
         logger.error(f"Missing required environment variable: {var}")
         raise ValueError(f"Missing required environment variable: {var}")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Everything the app needs is created here or on first use, never at
+    import; warmup then runs in the background until /ready reports ready.
+    """
+    logger.info("=" * 50)
+    logger.info("🚀 Mobile App AI Chatbot Backend Starting")
+    logger.info("=" * 50)
+    await ensure_schema()
+    instrument_engine(get_engine())
+    if GENERATION_WORKERS > 0:
+        generation_workers.start(GENERATION_WORKERS)
+    if PURGE_INTERVAL > 0:
+        conversation_purger.start(PURGE_INTERVAL)
+    if ARCHIVE_AFTER_DAYS > 0 and ARCHIVE_INTERVAL > 0:
+        conversation_archiver.start(ARCHIVE_INTERVAL)
+    warmup.start()
+
+    yield
+
+    logger.info("=" * 50)
+    logger.info("🛑 Mobile App AI Chatbot Backend Shutting Down")
+    logger.info("=" * 50)
+    await warmup.stop()
+    await generation_workers.stop()
+    await conversation_purger.stop()
+    await conversation_archiver.stop()
+    await close_conversation_hub()
+    await close_provider()
+    await dispose_engine()
+
 # Create FastAPI app
 app = FastAPI(
     title="Mobile App AI Chatbot Backend",
     description="Production-grade AI chatbot API for mobile app support",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # CORS configuration
@@ -42,7 +91,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Gzip/brotli for large responses; inside the metrics middleware, so its
+# latency includes compression
+app.add_middleware(CompressionMiddleware)
+# Query-count headers and on-demand profiling; inside the metrics middleware,
+# which tracks the request's queries
+app.add_middleware(ProfilingMiddleware)
+# Request latency, in-flight and per-request DB metrics, served on /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
+app.include_router(auth.router)
 app.include_router(conversations.router)
 app.include_router(messages.router)
 
@@ -72,8 +131,33 @@ async def general_exception_handler(request: Request, exc: Exception):
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    """Health check endpoint for monitoring"""
-    return {"status": "ok", "service": "Mobile App AI Chatbot"}
+    """Health check endpoint for monitoring, with this worker's DB pool, LLM routing, queue, coalescing, answer cache, WebSocket and archive stats"""
+    answer_cache = get_answer_cache()
+    return {
+        "status": "ok",
+        "service": "Mobile App AI Chatbot",
+        "db_pool": pool_status(),
+        "llm": {"provider": LLM_PROVIDER, **routing_stats()},
+        "llm_gate": get_llm_gate().stats(),
+        "llm_singleflight": completions_in_flight.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache else {"backend": "off"},
+        "chat_hub": get_conversation_hub().stats(),
+        "archive": conversation_archiver.stats()
+    }
+
+# Readiness endpoint
+@app.get("/ready")
+async def readiness_check():
+    """Readiness for load balancers: 503 while warming up or shutting down, or when the database does not answer"""
+    ready, report = await warmup.readiness()
+    return JSONResponse(status_code=200 if ready else 503, content=report)
+
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus metrics, aggregated across workers in multiprocess mode"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 # Root endpoint
 @app.get("/")
@@ -84,17 +168,3 @@ def home():
         "version": "1.0.0",
         "docs": "/docs"
     }
-
-# Startup event
-@app.on_event("startup")
-async def startup_event():
-    logger.info("=" * 50)
-    logger.info("🚀 Mobile App AI Chatbot Backend Starting")
-    logger.info("=" * 50)
-
-# Shutdown event
-@app.on_event("shutdown")
-async def shutdown_event():
-    logger.info("=" * 50)
-    logger.info("🛑 Mobile App AI Chatbot Backend Shutting Down")
-    logger.info("=" * 50)
\ No newline at end of file
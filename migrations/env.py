@@ -0,0 +1,64 @@
+"""
+Alembic environment, sharing the app's engine and models (database.py).
+
+`alembic upgrade head` runs migrations on a connection of its own; the app
+(database.upgrade_schema) passes one in through config.attributes.
+"""
+from alembic import context
+from logging.config import fileConfig
+from database import SEARCH_TABLES, Base, get_engine
+import asyncio
+
+config = context.config
+
+# Only the CLI has an ini file; inside the app its logging stays as it is
+if config.config_file_name is not None and config.attributes.get("connection") is None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+def include_name(name, type_, parent_names):
+    """Keep the search tables, which have no models, out of autogenerate and `alembic check`"""
+    return not (type_ == "table" and name.startswith(SEARCH_TABLES))
+
+def run_migrations_offline():
+    """`alembic upgrade head --sql`: print the SQL instead of running it"""
+    context.configure(
+        url=get_engine().url.render_as_string(hide_password=False),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def do_run_migrations(connection):
+    # One transaction per migration, so one that builds indexes outside a
+    # transaction (0002) never commits half of another
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_name=include_name,
+        transaction_per_migration=True
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+async def run_async_migrations():
+    engine = get_engine()
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+        await connection.commit()
+    await engine.dispose()
+
+def run_migrations_online():
+    connection = config.attributes.get("connection")
+    if connection is None:
+        asyncio.run(run_async_migrations())
+    else:
+        do_run_migrations(connection)
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,58 @@
+"""Baseline: the schema the original create_all built
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+
+users, conversations and messages as they were before any of the later
+columns, indexes and foreign key actions; each of those is added by its
+own revision (0001a-0001d, then 0002 on).
+
+Databases created by the old startup create_all already have these tables;
+they are left alone here, and the following revisions add only what such
+a database is missing, whichever version of the app created it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    existing = set() if op.get_context().as_sql else set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("username", sa.String()),
+            sa.Column("hashed_password", sa.String()),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+    if "conversations" not in existing:
+        op.create_table(
+            "conversations",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+            sa.Column("title", sa.String()),
+        )
+        op.create_index("ix_conversations_id", "conversations", ["id"])
+
+    if "messages" not in existing:
+        op.create_table(
+            "messages",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("conversation_id", sa.Integer(), sa.ForeignKey("conversations.id")),
+            sa.Column("sender", sa.String()),
+            sa.Column("content", sa.Text()),
+        )
+        op.create_index("ix_messages_id", "messages", ["id"])
+
+def downgrade():
+    op.drop_table("messages")
+    op.drop_table("conversations")
+    op.drop_table("users")
@@ -0,0 +1,109 @@
+"""denormalized conversation activity
+
+Revision ID: 0001a
+Revises: 0001
+Create Date: 2026-10-17
+
+message_count, last_message_at, last_message_preview and updated_at on
+conversations, kept up to date by the message write path (services.chat),
+and the (user_id, updated_at, id) index the conversation list reads.
+
+Existing conversations are filled from their messages: the count, and the
+preview of the latest one. Messages had no timestamp yet, so
+last_message_at stays NULL for them, and updated_at is this migration's
+time, one millisecond earlier per step back in activity order (by latest
+message id), so the list keeps showing the most recently used first.
+
+Databases created by create_all after these columns existed already have
+them; each column and the index are only added where missing.
+"""
+from alembic import op
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+
+revision = "0001a"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+PREVIEW_LENGTH = 100
+_BATCH = 1000
+
+def upgrade():
+    existing = set()
+    if not op.get_context().as_sql:
+        existing = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("conversations")}
+    # SQLite cannot add a column with a non-constant default; every row is
+    # given its updated_at below, and the app sets it on insert
+    updated_default = sa.text("'1970-01-01 00:00:00'") if op.get_bind().dialect.name == "sqlite" else sa.func.now()
+    columns = [
+        sa.Column("message_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("last_message_at", sa.DateTime(timezone=True)),
+        sa.Column("last_message_preview", sa.String(PREVIEW_LENGTH)),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False, server_default=updated_default),
+    ]
+    added = [column.name for column in columns if column.name not in existing]
+    for column in columns:
+        if column.name in added:
+            op.add_column("conversations", column)
+    if "updated_at" in added:
+        _backfill()
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_conversations_user_activity", "conversations", ["user_id", "updated_at", "id"],
+            if_not_exists=True, postgresql_concurrently=True
+        )
+
+def _backfill():
+    """Activity of conversations that existed before the columns did"""
+    if op.get_context().as_sql:
+        return
+    bind = op.get_bind()
+    activity = bind.execute(sa.text("""
+        SELECT c.id, COUNT(m.id), MAX(m.id)
+        FROM conversations c LEFT JOIN messages m ON m.conversation_id = c.id
+        GROUP BY c.id
+    """)).all()
+    latest_ids = [latest for _, _, latest in activity if latest is not None]
+    previews = {}
+    for i in range(0, len(latest_ids), _BATCH):
+        rows = bind.execute(
+            sa.text("SELECT id, content FROM messages WHERE id IN :ids").bindparams(
+                sa.bindparam("ids", expanding=True)
+            ),
+            {"ids": latest_ids[i:i + _BATCH]}
+        )
+        previews.update({msg_id: " ".join((content or "").split())[:PREVIEW_LENGTH] for msg_id, content in rows})
+
+    conversations = sa.table(
+        "conversations",
+        sa.column("id", sa.Integer()),
+        sa.column("message_count", sa.Integer()),
+        sa.column("last_message_preview", sa.String()),
+        sa.column("updated_at", sa.DateTime(timezone=True)),
+    )
+    update = conversations.update().where(conversations.c.id == sa.bindparam("conv_id")).values(
+        message_count=sa.bindparam("count"),
+        last_message_preview=sa.bindparam("preview"),
+        updated_at=sa.bindparam("updated"),
+    )
+    now = datetime.now(timezone.utc)
+    # Most recent activity first; conversations without messages last
+    ordered = sorted(activity, key=lambda row: (row[2] or 0, row[0]), reverse=True)
+    params = [
+        {
+            "conv_id": conv_id,
+            "count": count,
+            "preview": previews.get(latest),
+            "updated": now - timedelta(milliseconds=rank)
+        }
+        for rank, (conv_id, count, latest) in enumerate(ordered)
+    ]
+    for i in range(0, len(params), _BATCH):
+        bind.execute(update, params[i:i + _BATCH])
+
+def downgrade():
+    op.drop_index("ix_conversations_user_activity", table_name="conversations")
+    for column in ("updated_at", "last_message_preview", "last_message_at", "message_count"):
+        op.drop_column("conversations", column)
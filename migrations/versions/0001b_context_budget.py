@@ -0,0 +1,48 @@
+"""token counts and rolling summaries
+
+Revision ID: 0001b
+Revises: 0001a
+Create Date: 2026-10-17
+
+messages.token_count, estimated once when a message is written, and
+conversations.summary / summary_upto_id, the rolling summary of the turns
+that no longer fit the context budget (services.context).
+
+Existing messages keep a NULL token_count rather than being rewritten
+here: context budgeting estimates a missing count from the content
+(services.context.message_tokens), which is what the backfill would store.
+A summary_upto_id of 0 means nothing is summarized yet.
+
+Databases created by create_all after these columns existed already have
+them; each is only added where missing.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001b"
+down_revision = "0001a"
+branch_labels = None
+depends_on = None
+
+COLUMNS = {
+    "messages": [
+        sa.Column("token_count", sa.Integer()),
+    ],
+    "conversations": [
+        sa.Column("summary", sa.Text()),
+        sa.Column("summary_upto_id", sa.Integer(), nullable=False, server_default="0"),
+    ],
+}
+
+def upgrade():
+    inspector = None if op.get_context().as_sql else sa.inspect(op.get_bind())
+    for table, columns in COLUMNS.items():
+        existing = {c["name"] for c in inspector.get_columns(table)} if inspector else set()
+        for column in columns:
+            if column.name not in existing:
+                op.add_column(table, column)
+
+def downgrade():
+    for table, columns in COLUMNS.items():
+        for column in reversed(columns):
+            op.drop_column(table, column.name)
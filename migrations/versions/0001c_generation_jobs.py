@@ -0,0 +1,46 @@
+"""generation jobs
+
+Revision ID: 0001c
+Revises: 0001b
+Create Date: 2026-10-17
+
+generation_jobs: AI replies waiting for a worker (services.jobs), and the
+(status, conversation_id, id) index its claim query reads. Its foreign
+keys get their ON DELETE actions in 0001d, with the others.
+
+Databases created by create_all after the table existed already have it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001c"
+down_revision = "0001b"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    existing = set() if op.get_context().as_sql else set(sa.inspect(op.get_bind()).get_table_names())
+    if "generation_jobs" not in existing:
+        op.create_table(
+            "generation_jobs",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("conversation_id", sa.Integer(), sa.ForeignKey("conversations.id"), nullable=False),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("user_message_id", sa.Integer(), sa.ForeignKey("messages.id"), nullable=False),
+            sa.Column("status", sa.String(16), nullable=False),
+            sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("available_at", sa.DateTime(timezone=True), nullable=False),
+            sa.Column("locked_by", sa.String(100)),
+            sa.Column("locked_until", sa.DateTime(timezone=True)),
+            sa.Column("ai_message_id", sa.Integer(), sa.ForeignKey("messages.id")),
+            sa.Column("error", sa.Text()),
+            sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+            sa.Column("finished_at", sa.DateTime(timezone=True)),
+        )
+    op.create_index(
+        "ix_generation_jobs_status_conversation", "generation_jobs", ["status", "conversation_id", "id"],
+        if_not_exists=True
+    )
+
+def downgrade():
+    op.drop_table("generation_jobs")
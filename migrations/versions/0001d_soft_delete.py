@@ -0,0 +1,102 @@
+"""soft delete and cascading foreign keys
+
+Revision ID: 0001d
+Revises: 0001c
+Create Date: 2026-10-17
+
+conversations.deleted_at with the partial index the purger reads
+(services.purge), and ON DELETE actions on every foreign key, so purging a
+conversation, or deleting a user, removes its rows in the database:
+
+- conversations.user_id, messages.conversation_id and generation_jobs'
+  conversation_id, user_id and user_message_id: CASCADE
+- generation_jobs.ai_message_id: SET NULL
+
+PostgreSQL swaps each constraint in place. SQLite cannot alter a
+constraint, so each table whose keys change is rebuilt (batch mode) with
+foreign key enforcement off, which is turned back on afterwards; without
+that, dropping the old table would delete or reject its children.
+Databases that already have the actions and the column are left as they are.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001d"
+down_revision = "0001c"
+branch_labels = None
+depends_on = None
+
+# (table, column, referred table, ON DELETE)
+FOREIGN_KEYS = [
+    ("conversations", "user_id", "users", "CASCADE"),
+    ("messages", "conversation_id", "conversations", "CASCADE"),
+    ("generation_jobs", "conversation_id", "conversations", "CASCADE"),
+    ("generation_jobs", "user_id", "users", "CASCADE"),
+    ("generation_jobs", "user_message_id", "messages", "CASCADE"),
+    ("generation_jobs", "ai_message_id", "messages", "SET NULL"),
+]
+
+# Names for SQLite's unnamed foreign keys, so batch mode can drop them
+SQLITE_NAMING = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+def _set_on_delete(wanted: list):
+    """Give each (table, column, referred, on_delete) foreign key that action, where it differs"""
+    context = op.get_context()
+    sqlite = op.get_bind().dialect.name == "sqlite"
+    changes = []
+    for table, column, referred, on_delete in wanted:
+        name = f"{table}_{column}_fkey"
+        if not context.as_sql:
+            current = next(
+                (fk for fk in sa.inspect(op.get_bind()).get_foreign_keys(table) if fk["constrained_columns"] == [column]),
+                None
+            )
+            if current is not None:
+                if (current["options"].get("ondelete") or "").upper() == (on_delete or ""):
+                    continue
+                name = current["name"] or name
+        changes.append((table, column, referred, on_delete, name))
+    if not changes:
+        return
+
+    if not sqlite:
+        for table, column, referred, on_delete, name in changes:
+            op.drop_constraint(name, table, type_="foreignkey")
+            op.create_foreign_key(name, table, referred, [column], ["id"], ondelete=on_delete)
+        return
+
+    # PRAGMA foreign_keys only takes effect outside a transaction
+    with context.autocommit_block():
+        op.execute("PRAGMA foreign_keys=OFF")
+    try:
+        for table in dict.fromkeys(change[0] for change in changes):
+            with op.batch_alter_table(table, recreate="always", naming_convention=SQLITE_NAMING) as batch:
+                for _, column, referred, on_delete, _ in (c for c in changes if c[0] == table):
+                    name = SQLITE_NAMING["fk"] % {
+                        "table_name": table, "column_0_name": column, "referred_table_name": referred
+                    }
+                    batch.drop_constraint(name, type_="foreignkey")
+                    batch.create_foreign_key(name, referred, [column], ["id"], ondelete=on_delete)
+    finally:
+        with context.autocommit_block():
+            op.execute("PRAGMA foreign_keys=ON")
+
+def upgrade():
+    _set_on_delete(FOREIGN_KEYS)
+
+    existing = set()
+    if not op.get_context().as_sql:
+        existing = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("conversations")}
+    if "deleted_at" not in existing:
+        op.add_column("conversations", sa.Column("deleted_at", sa.DateTime(timezone=True)))
+    op.create_index(
+        "ix_conversations_deleted_at", "conversations", ["deleted_at"],
+        postgresql_where=sa.text("deleted_at IS NOT NULL"),
+        sqlite_where=sa.text("deleted_at IS NOT NULL"),
+        if_not_exists=True
+    )
+
+def downgrade():
+    op.drop_index("ix_conversations_deleted_at", table_name="conversations")
+    op.drop_column("conversations", "deleted_at")
+    _set_on_delete([(table, column, referred, None) for table, column, referred, _ in FOREIGN_KEYS])
@@ -0,0 +1,40 @@
+"""Indexes for the hot queries and foreign keys
+
+Revision ID: 0002
+Revises: 0001d
+Create Date: 2026-10-17
+
+- messages (conversation_id, id): message pages, the history and
+  summarization loads, and the purger's batches are range scans on it
+- conversations (user_id, id): bulk deletes and ownership checks by user
+- generation_jobs (conversation_id, id), user_message_id, ai_message_id:
+  the purger's job delete, and the ON DELETE actions that run for every
+  deleted message
+
+On PostgreSQL the indexes are built CONCURRENTLY, so writes continue while
+a large table is indexed.
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001d"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_messages_conversation_id_id", "messages", ["conversation_id", "id"]),
+    ("ix_conversations_user_id_id", "conversations", ["user_id", "id"]),
+    ("ix_generation_jobs_conversation_id_id", "generation_jobs", ["conversation_id", "id"]),
+    ("ix_generation_jobs_user_message_id", "generation_jobs", ["user_message_id"]),
+    ("ix_generation_jobs_ai_message_id", "generation_jobs", ["ai_message_id"]),
+]
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True, postgresql_concurrently=True)
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,29 @@
+"""created_at on conversations and messages
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+Rows that existed before this migration keep a NULL created_at rather
+than the migration's time. The server default is set after the column is
+added for that reason; SQLite cannot alter one, so there the app's
+insert-time default is all that fills it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    sqlite = op.get_bind().dialect.name == "sqlite"
+    for table in ("conversations", "messages"):
+        op.add_column(table, sa.Column("created_at", sa.DateTime(timezone=True)))
+        if not sqlite:
+            op.alter_column(table, "created_at", server_default=sa.func.now())
+
+def downgrade():
+    for table in ("messages", "conversations"):
+        op.drop_column(table, "created_at")
@@ -0,0 +1,58 @@
+"""conversation_archives cold tier
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+Inactive conversations move their messages into one compressed
+conversation_archives row each (services.archive). The partial index is
+the archiver's queue and only covers conversations still hot.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+CANDIDATES = "archived_at IS NULL AND deleted_at IS NULL"
+
+def upgrade():
+    op.add_column("conversations", sa.Column("archived_at", sa.DateTime(timezone=True)))
+    op.add_column("conversations", sa.Column("rehydrated_at", sa.DateTime(timezone=True)))
+    op.create_table(
+        "conversation_archives",
+        sa.Column(
+            "conversation_id", sa.Integer(),
+            sa.ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True
+        ),
+        sa.Column("codec", sa.String(16), nullable=False),
+        sa.Column("payload", sa.LargeBinary(), nullable=False),
+        sa.Column("message_count", sa.Integer(), nullable=False),
+        sa.Column("raw_bytes", sa.Integer(), nullable=False),
+        sa.Column("compressed_bytes", sa.Integer(), nullable=False),
+        sa.Column("archived_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_conversations_archive_candidates", "conversations", ["updated_at"],
+            postgresql_where=sa.text(CANDIDATES), sqlite_where=sa.text(CANDIDATES),
+            postgresql_concurrently=True, if_not_exists=True
+        )
+
+def downgrade():
+    # Archived conversations are restored first, or their messages would be lost
+    archived = None if op.get_context().as_sql else op.get_bind().execute(
+        sa.text("SELECT 1 FROM conversation_archives LIMIT 1")
+    ).first()
+    if archived is not None:
+        raise RuntimeError(
+            "conversation_archives is not empty; rehydrate archived conversations before downgrading"
+        )
+    op.drop_index("ix_conversations_archive_candidates", table_name="conversations")
+    op.drop_table("conversation_archives")
+    # Dropped in place: rebuilding conversations (batch mode on SQLite) would
+    # cascade into its messages
+    for column in ("rehydrated_at", "archived_at"):
+        op.drop_column("conversations", column)
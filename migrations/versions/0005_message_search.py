@@ -0,0 +1,119 @@
+"""full-text search over messages
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+PostgreSQL: text search configuration chat_search, a copy of english in
+which words with non-ASCII letters (Bengali) skip English stemming and
+stop words, and a GIN index on to_tsvector('chat_search', content) built
+concurrently. SQLite: FTS5 table messages_fts over messages, with triggers
+keeping it in step, filled from the existing rows.
+
+conversation_archive_search holds one search document per archived
+conversation; its rows go with their conversation_archives row. Archives
+written before this migration are indexed here.
+"""
+from alembic import op
+from sqlalchemy.dialects import postgresql
+import sqlalchemy as sa
+import json
+import zlib
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+# unicode61 counts combining marks (M*) as part of a word, or Bengali vowel
+# signs would split words; porter stems English words only
+FTS5_TOKENIZE = "tokenize=\"porter unicode61 remove_diacritics 2 categories 'L* N* Co M*'\""
+
+def upgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("""
+            DO $$ BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'chat_search') THEN
+                    CREATE TEXT SEARCH CONFIGURATION chat_search (COPY = pg_catalog.english);
+                    ALTER TEXT SEARCH CONFIGURATION chat_search
+                        ALTER MAPPING FOR word, hword, hword_part WITH simple;
+                END IF;
+            END $$
+        """)
+        op.create_table(
+            "conversation_archive_search",
+            sa.Column(
+                "conversation_id", sa.Integer(),
+                sa.ForeignKey("conversation_archives.conversation_id", ondelete="CASCADE"), primary_key=True
+            ),
+            sa.Column("document", postgresql.TSVECTOR(), nullable=False),
+        )
+        op.create_index(
+            "ix_conversation_archive_search", "conversation_archive_search", ["document"], postgresql_using="gin"
+        )
+        _index_archives(
+            "INSERT INTO conversation_archive_search (conversation_id, document) "
+            "VALUES (:conv_id, strip(to_tsvector('chat_search'::regconfig, :content)))"
+        )
+        with op.get_context().autocommit_block():
+            op.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_search "
+                "ON messages USING gin (to_tsvector('chat_search'::regconfig, content))"
+            )
+    else:
+        op.execute(
+            "CREATE VIRTUAL TABLE messages_fts USING fts5("
+            f"content, content='messages', content_rowid='id', {FTS5_TOKENIZE})"
+        )
+        op.execute("""
+            CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+        op.execute("""
+            CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END
+        """)
+        op.execute("""
+            CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+        op.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        op.execute(f"CREATE VIRTUAL TABLE conversation_archive_search USING fts5(content, {FTS5_TOKENIZE})")
+        # Also fires for archives removed by ON DELETE CASCADE
+        op.execute("""
+            CREATE TRIGGER conversation_archive_search_delete AFTER DELETE ON conversation_archives BEGIN
+                DELETE FROM conversation_archive_search WHERE rowid = old.conversation_id;
+            END
+        """)
+        _index_archives("INSERT INTO conversation_archive_search (rowid, content) VALUES (:conv_id, :content)")
+
+def _index_archives(insert: str):
+    """Search documents for archives that already exist (codec zlib-json, see services.archive)"""
+    if op.get_context().as_sql:
+        return
+    bind = op.get_bind()
+    insert = sa.text(insert)
+    archives = bind.execute(sa.text("SELECT conversation_id, payload FROM conversation_archives")).all()
+    for conv_id, payload in archives:
+        archive = json.loads(zlib.decompress(payload))
+        content = archive["columns"].index("content")
+        bind.execute(insert, {
+            "conv_id": conv_id,
+            "content": "\n".join(row[content] or "" for row in archive["rows"])
+        })
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP INDEX IF EXISTS ix_messages_search")
+        op.drop_table("conversation_archive_search")
+        op.execute("DROP TEXT SEARCH CONFIGURATION IF EXISTS chat_search")
+    else:
+        op.execute("DROP TRIGGER IF EXISTS conversation_archive_search_delete")
+        op.execute("DROP TABLE conversation_archive_search")
+        for trigger in ("messages_fts_insert", "messages_fts_delete", "messages_fts_update"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE messages_fts")
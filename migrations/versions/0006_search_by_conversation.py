@@ -0,0 +1,59 @@
+"""index conversation_id in messages_fts
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+
+SQLite: messages_fts also indexes each message's conversation_id, so a
+search restricts the match to the user's conversations inside FTS5 before
+anything is ranked (services.search). Rebuilt from messages. Nothing
+changes on PostgreSQL, where the search query narrows to the user's
+conversations through ix_messages_conversation_id_id.
+"""
+from alembic import op
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+# As in 0005
+FTS5_TOKENIZE = "tokenize=\"porter unicode61 remove_diacritics 2 categories 'L* N* Co M*'\""
+
+def _create(columns: list):
+    """messages_fts over `columns` of messages, its triggers, and its rows"""
+    for trigger in ("messages_fts_insert", "messages_fts_delete", "messages_fts_update"):
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    op.execute("DROP TABLE IF EXISTS messages_fts")
+
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    op.execute(
+        f"CREATE VIRTUAL TABLE messages_fts USING fts5({names}, content='messages', content_rowid='id', {FTS5_TOKENIZE})"
+    )
+    op.execute(f"""
+        CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, {names}) VALUES (new.id, {new});
+        END
+    """)
+    op.execute(f"""
+        CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, {names}) VALUES ('delete', old.id, {old});
+        END
+    """)
+    op.execute(f"""
+        CREATE TRIGGER messages_fts_update AFTER UPDATE OF {names} ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, {names}) VALUES ('delete', old.id, {old});
+            INSERT INTO messages_fts (rowid, {names}) VALUES (new.id, {new});
+        END
+    """)
+    op.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+def upgrade():
+    if op.get_bind().dialect.name == "sqlite":
+        _create(["content", "conversation_id"])
+
+def downgrade():
+    if op.get_bind().dialect.name == "sqlite":
+        _create(["content"])
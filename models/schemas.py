@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
 class UserCreate(BaseModel):
     """Schema for user registration"""
@@ -28,13 +29,75 @@ class MessageDetail(BaseModel):
     id: int
     sender: str
     content: str
+    created_at: Optional[datetime] = None
+
+class JobResponse(BaseModel):
+    """Schema for an async reply job; `message` is the AI reply once status is "done" """
+    id: int
+    conversation_id: int
+    status: str  # "queued", "running", "done" or "failed"
+    user_message_id: int
+    message: Optional[MessageDetail] = None
+    error: Optional[str] = None
+
+class MessagePage(BaseModel):
+    """One page of messages, oldest first.
+
+    next_cursor continues towards older messages (pass it as `before`),
+    prev_cursor towards newer ones (pass it as `after`).
+    """
+    messages: List[MessageDetail]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+class ConversationExport(BaseModel):
+    """A whole conversation, oldest message first; sent as a stream"""
+    conversation_id: int
+    title: str
+    messages: List[MessageDetail]
 
 class ConversationResponse(BaseModel):
     """Schema for conversation in list"""
     id: int
     title: str
     message_count: int = 0
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
+    updated_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+
+class ConversationBulkDelete(BaseModel):
+    """Schema for deleting several conversations: either `ids` or `all`"""
+    ids: Optional[List[int]] = Field(None, min_length=1, max_length=1000)
+    all: bool = False
+
+class ConversationBulkDeleteResult(BaseModel):
+    """Conversations actually deleted; ids not owned or already deleted are left out"""
+    deleted: List[int]
 
 class ConversationList(BaseModel):
-    """Schema for list of conversations"""
-    conversations: List[ConversationResponse]
\ No newline at end of file
+    """Schema for list of conversations, most recently active first.
+
+    next_cursor continues towards less recent conversations (pass it as
+    `before`), prev_cursor towards more recent ones (pass it as `after`).
+    """
+    conversations: List[ConversationResponse]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+class SearchHit(BaseModel):
+    """A message matching a search; `snippet` is HTML-escaped text with matched words wrapped in <mark></mark>"""
+    message_id: int
+    conversation_id: int
+    conversation_title: str
+    sender: str
+    snippet: str
+    created_at: Optional[datetime] = None
+
+class SearchResults(BaseModel):
+    """Schema for one page of search hits, best match first.
+
+    next_cursor continues with weaker matches (pass it as `cursor`).
+    """
+    results: List[SearchHit]
+    next_cursor: Optional[str] = None
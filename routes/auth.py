@@ -1,27 +1,40 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db, User
 from models.schemas import UserCreate, Token
-from utils.security import get_password_hash, create_access_token, verify_password
+from utils.security import create_access_token, hash_password_async, verify_password_async
 from fastapi.security import OAuth2PasswordRequestForm
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 @router.post("/register")
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.username == user.username).first()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(User).where(User.username == user.username))
+    db_user = result.scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    hashed = get_password_hash(user.password)
+    # bcrypt is CPU-bound; it runs on the dedicated bounded pool
+    hashed = await hash_password_async(user.password)
     new_user = User(username=user.username, hashed_password=hashed)
     db.add(new_user)
-    db.commit()
+    await db.commit()
     return {"msg": "User created successfully"}
 
 @router.post("/token", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(User).where(User.username == form_data.username))
+    user = result.scalars().first()
+    if not user:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
-    token = create_access_token(data={"sub": user.username})
+    # Return the connection to the pool while bcrypt runs
+    await db.commit()
+    valid, new_hash = await verify_password_async(form_data.password, user.hashed_password)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    if new_hash:
+        # Cost factor changed since this hash was made; upgrade it transparently
+        user.hashed_password = new_hash
+        await db.commit()
+    token = create_access_token(data={"sub": user.username, "uid": user.id})
     return {"access_token": token, "token_type": "bearer"}
\ No newline at end of file
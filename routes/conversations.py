@@ -1,17 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from database import get_db, Conversation, Message, User
-from models.schemas import ConversationList
-from dependencies import get_current_user, get_current_user_id
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, Conversation
+from models.schemas import ConversationBulkDelete, ConversationBulkDeleteResult, ConversationList, SearchResults
+from dependencies import CurrentUser, get_current_user, get_current_user_id
+from services.archive import rehydrate_matching
+from services.purge import soft_delete_conversations
+from services.search import (
+    DEFAULT_SEARCH_PAGE_SIZE, MAX_SEARCH_OFFSET, MAX_SEARCH_PAGE_SIZE, SEARCH_REHYDRATE_LIMIT, highlight,
+    search_messages
+)
+from utils.pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, check_single_cursor, decode_cursor, encode_cursor
+)
+from utils.responses import FastJSONResponse
+from datetime import datetime
+from typing import Optional
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/conversations", tags=["conversations"])
 
 @router.post("/", response_model=int)
-def create_conversation(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def create_conversation(
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new conversation for the authenticated user"""
     try:
@@ -20,42 +33,84 @@ def create_conversation(
             title="New Conversation"
         )
         db.add(conv)
-        db.commit()
-        db.refresh(conv)
+        await db.commit()
         logger.info(f"Conversation created: {conv.id} for user: {current_user.id}")
         return conv.id
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error creating conversation: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create conversation"
         )
 
+def _activity_cursor(conv) -> str:
+    return encode_cursor({"t": conv.updated_at.isoformat(), "id": conv.id})
+
+def _decode_activity_cursor(cursor: str) -> tuple:
+    values = decode_cursor(cursor, "t", "id")
+    try:
+        return datetime.fromisoformat(values["t"]), int(values["id"])
+    except (TypeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+
 @router.get("/", response_model=ConversationList)
-def list_conversations(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def list_conversations(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all conversations for the authenticated user"""
+    """
+    Get one page of the authenticated user's conversations, most recently
+    active first.
+    
+    `before` pages towards less recent conversations and `after` towards more
+    recent ones, keyed on (updated_at, id).
+    """
+    check_single_cursor(before, after)
     try:
-        convs = db.query(Conversation).filter(
-            Conversation.user_id == current_user.id
-        ).all()
+        # One indexed range scan; counts and activity are kept on the row itself
+        activity = tuple_(Conversation.updated_at, Conversation.id)
+        query = select(
+            Conversation.id, Conversation.title, Conversation.message_count, Conversation.last_message_at,
+            Conversation.last_message_preview, Conversation.updated_at, Conversation.created_at
+        ).where(
+            Conversation.user_id == current_user.id,
+            Conversation.deleted_at.is_(None)
+        )
+        if after:
+            query = query.where(activity > _decode_activity_cursor(after)).order_by(
+                Conversation.updated_at, Conversation.id
+            )
+        else:
+            if before:
+                query = query.where(activity < _decode_activity_cursor(before))
+            query = query.order_by(Conversation.updated_at.desc(), Conversation.id.desc())
         
-        conversations_with_count = []
-        for c in convs:
-            msg_count = db.query(Message).filter(
-                Message.conversation_id == c.id
-            ).count()
-            conversations_with_count.append({
-                "id": c.id, 
-                "title": c.title,
-                "message_count": msg_count
-            })
+        # Fetch one extra row to learn whether another page exists
+        result = await db.execute(query.limit(limit + 1))
+        convs = result.all()
+        has_more = len(convs) > limit
+        convs = convs[:limit]
+        if after:
+            convs.reverse()
         
-        logger.debug(f"Retrieved {len(conversations_with_count)} conversations for user: {current_user.id}")
-        return {"conversations": conversations_with_count}
+        less_recent = has_more if not after else True
+        more_recent = has_more if after else bool(before)
+        
+        logger.debug(f"Retrieved {len(convs)} conversations for user: {current_user.id}")
+        return FastJSONResponse({
+            "conversations": [c._asdict() for c in convs],
+            "next_cursor": _activity_cursor(convs[-1]) if convs and less_recent else None,
+            "prev_cursor": _activity_cursor(convs[0]) if convs and more_recent else None
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error listing conversations: {str(e)}")
         raise HTTPException(
@@ -63,38 +118,118 @@ def list_conversations(
             detail="Failed to retrieve conversations"
         )
 
+def _decode_offset_cursor(cursor: str) -> int:
+    value = decode_cursor(cursor, "offset")["offset"]
+    if not isinstance(value, int) or not 0 <= value <= MAX_SEARCH_OFFSET:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+    return value
+
+@router.get("/search", response_model=SearchResults)
+async def search_conversations(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(DEFAULT_SEARCH_PAGE_SIZE, ge=1, le=MAX_SEARCH_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Full-text search over the messages of the user's conversations, best
+    match first, with highlighted snippets.
+    
+    On Postgres `q` takes web search syntax ("quoted phrase", or, -word);
+    on SQLite every word must occur. The first page also restores matching
+    archived conversations, so their messages are included.
+    """
+    offset = _decode_offset_cursor(cursor) if cursor else 0
+    try:
+        if offset == 0:
+            await rehydrate_matching(db, current_user.id, q, SEARCH_REHYDRATE_LIMIT)
+        
+        # Fetch one extra row to learn whether another page exists
+        rows = await search_messages(db, current_user.id, q, limit + 1, offset)
+        has_more = len(rows) > limit and offset + limit < MAX_SEARCH_OFFSET
+        rows = rows[:limit]
+        
+        logger.debug(f"Search returned {len(rows)} hits for user: {current_user.id}")
+        return FastJSONResponse({
+            "results": [
+                {
+                    "message_id": r.id,
+                    "conversation_id": r.conversation_id,
+                    "conversation_title": r.title,
+                    "sender": r.sender,
+                    "snippet": highlight(r.snippet),
+                    "created_at": r.created_at
+                }
+                for r in rows
+            ],
+            "next_cursor": encode_cursor({"offset": offset + limit}) if has_more else None
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error searching conversations for user {current_user.id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to search conversations"
+        )
+
 @router.delete("/{conv_id}")
-def delete_conversation(
+async def delete_conversation(
     conv_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Delete a conversation (only if owned by current user)"""
+    """
+    Delete a conversation (only if owned by current user).
+    
+    It disappears at once; its messages are removed in the background.
+    """
     try:
-        conv = db.query(Conversation).filter(
-            Conversation.id == conv_id,
-            Conversation.user_id == current_user.id
-        ).first()
-        
-        if not conv:
+        if not await soft_delete_conversations(db, current_user.id, [conv_id]):
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Conversation not found"
             )
         
-        # Delete all messages in the conversation
-        db.query(Message).filter(Message.conversation_id == conv_id).delete()
-        db.delete(conv)
-        db.commit()
-        
         logger.info(f"Conversation deleted: {conv_id} by user: {current_user.id}")
         return {"msg": "Conversation deleted successfully"}
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
         logger.error(f"Error deleting conversation {conv_id}: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to delete conversation"
-        )
\ No newline at end of file
+        )
+
+@router.post("/delete", response_model=ConversationBulkDeleteResult)
+async def delete_conversations(
+    body: ConversationBulkDelete,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Delete many of the user's conversations (`ids`), or all of them
+    (`"all": true`), in one request.
+    
+    They disappear at once; their messages are removed in the background.
+    """
+    if (body.ids is None) == (not body.all):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Give either ids or all=true"
+        )
+    try:
+        deleted = await soft_delete_conversations(db, current_user.id, None if body.all else body.ids)
+        logger.info(f"{len(deleted)} conversations deleted by user: {current_user.id}")
+        return {"deleted": deleted}
+    except Exception as e:
+        logger.error(f"Error deleting conversations for user {current_user.id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to delete conversations"
+        )
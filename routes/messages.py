@@ -1,114 +1,473 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from database import get_db, Conversation, Message, User
-from models.schemas import MessageCreate, MessageResponse
-from dependencies import get_current_user
-from services.ai_services import get_ai_response
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, SessionLocal, Message
+from models.schemas import ConversationExport, JobResponse, MessageCreate, MessagePage, MessageResponse
+from dependencies import CurrentUser, get_current_user, get_websocket_user
+from services.ai_services import (
+    AIBusyError, AIServiceError, QueuePosition, get_ai_response, stream_ai_response
+)
+from services.archive import ensure_hot
+from services.chat import Exchange, finish_exchange, get_owned_conversation, start_exchange
+from services.hub import get_conversation_hub, publish_messages
+from services.jobs import JOB_MAX_WAIT, enqueue_reply, wait_for_job
+from utils.pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, check_single_cursor, decode_id_cursor, encode_cursor
+)
+from utils.metrics import WEBSOCKET_CONNECTIONS
+from utils.responses import EXPORT_BATCH_SIZE, FastJSONResponse, stream_json_document
+from contextlib import aclosing
+from pydantic import ValidationError
+from typing import AsyncIterator, Literal, Optional
+from uuid import uuid4
+import asyncio
+import json
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/conversations", tags=["messages"])
 
-@router.post("/{conv_id}/messages", response_model=MessageResponse)
-def send_message(
+# Strong references to fire-and-forget saves so they are not garbage collected
+_background_tasks = set()
+
+# WebSocket close codes, after the matching HTTP statuses
+WS_UNAUTHORIZED = 4401
+WS_NOT_FOUND = 4404
+
+# MessageDetail fields, selected as plain columns for history reads
+_DETAIL_COLUMNS = (Message.id, Message.sender, Message.content, Message.created_at)
+
+def _validated_content(msg: MessageCreate) -> str:
+    """Stripped message content, rejecting whitespace-only messages"""
+    if not msg.content or not msg.content.strip():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Message content cannot be empty"
+        )
+    return msg.content.strip()
+
+def _job_body(job, ai_msg=None) -> dict:
+    """JobResponse fields for a job and, once done, its AI message"""
+    return {
+        "id": job.id,
+        "conversation_id": job.conversation_id,
+        "status": job.status,
+        "user_message_id": job.user_message_id,
+        "message": {
+            "id": ai_msg.id,
+            "sender": ai_msg.sender,
+            "content": ai_msg.content,
+            "created_at": ai_msg.created_at
+        } if ai_msg else None,
+        "error": job.error if job.status == "failed" else None
+    }
+
+@router.post(
+    "/{conv_id}/messages",
+    response_model=MessageResponse,
+    responses={202: {"model": JobResponse, "description": "Reply queued (mode=async)"}}
+)
+async def send_message(
     conv_id: int,
     msg: MessageCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    mode: Literal["sync", "async"] = "sync",
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Send a message in a conversation and get AI response"""
+    """
+    Send a message in a conversation and get AI response.
+    
+    The exchange is all-or-nothing: the user message and AI reply are saved
+    together after the reply arrives. If the AI service fails nothing is
+    saved and a 503 carrying a user-facing message is returned, so the
+    client can simply resend. A conversation deleted or archived before the
+    reply arrives gets nothing saved and a 404.
+    
+    With `mode=async` the user message is saved straight away and a 202 is
+    returned with a job to poll at its Location; a generation worker saves
+    the reply, retrying AI failures, and the job carries it once done.
+    """
+    content = _validated_content(msg)
     try:
-        # Verify conversation exists and belongs to current user
-        conv = db.query(Conversation).filter(
-            Conversation.id == conv_id,
-            Conversation.user_id == current_user.id
-        ).first()
-        
-        if not conv:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Conversation not found"
+        if mode == "async":
+            conv = await get_owned_conversation(db, conv_id, current_user.id)
+            job = await enqueue_reply(db, conv, current_user.id, content)
+            logger.info(f"Reply job {job.id} queued in conversation {conv_id} by user {current_user.id}")
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content=_job_body(job),
+                headers={"Location": f"{router.prefix}/{conv_id}/jobs/{job.id}"}
             )
         
-        # Validate message content
-        if not msg.content or not msg.content.strip():
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Message content cannot be empty"
-            )
-        
-        # Save user message
-        user_msg = Message(
-            conversation_id=conv_id,
-            sender="user",
-            content=msg.content.strip()
-        )
-        db.add(user_msg)
-        db.commit()
-        
-        # Update conversation title if it's the first message
-        if conv.title == "New Conversation":
-            conv.title = msg.content[:50] + ("..." if len(msg.content) > 50 else "")
-            db.commit()
-        
-        # Get conversation history and get AI response
-        history = db.query(Message).filter(
-            Message.conversation_id == conv_id
-        ).order_by(Message.id).all()
-        
-        ai_reply = get_ai_response(history)
-        
-        # Save AI response
-        ai_msg = Message(
-            conversation_id=conv_id,
-            sender="ai",
-            content=ai_reply
-        )
-        db.add(ai_msg)
-        db.commit()
+        exchange = await start_exchange(db, conv_id, current_user.id, content)
+        ai_reply = await get_ai_response(exchange.context.messages, exchange.context.summary)
+        ai_msg = await finish_exchange(db, exchange, ai_reply)
+        await publish_messages(conv_id, exchange.user_msg, ai_msg)
         
         logger.info(f"Message exchanged in conversation {conv_id} by user {current_user.id}")
         return {"sender": "ai", "content": ai_reply}
     
     except HTTPException:
         raise
+    except AIServiceError as e:
+        logger.warning(f"AI service unavailable for conversation {conv_id}: {str(e)}")
+        raise _unavailable(e)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error sending message in conversation {conv_id}: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to process message"
         )
 
-@router.get("/{conv_id}/messages")
-def get_messages(
+def _unavailable(e: AIServiceError) -> HTTPException:
+    """503 for an AI failure; a full LLM queue also says when to retry and the caller's place"""
+    headers = None
+    if isinstance(e, AIBusyError):
+        headers = {"Retry-After": str(e.retry_after), "X-Queue-Position": str(e.position)}
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=e.user_message,
+        headers=headers
+    )
+
+def _error_data(e: AIServiceError) -> dict:
+    """Error event payload; a full LLM queue also says when to retry"""
+    data = {"detail": e.user_message}
+    if isinstance(e, AIBusyError):
+        data["retry_after"] = e.retry_after
+    return data
+
+def _sse_event(event: str, data: dict) -> str:
+    """Format a single Server-Sent Event frame"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _save_streamed_exchange(exchange: Exchange, reply: str, origin: str | None = None) -> int:
+    """Persist a streamed exchange in its own session, announce it and return the AI message id"""
+    async with SessionLocal() as db:
+        ai_msg = await finish_exchange(db, exchange, reply)
+    await publish_messages(exchange.conv.id, exchange.user_msg, ai_msg, origin=origin)
+    return ai_msg.id
+
+async def _reply_events(
+    exchange: Exchange, deltas: AsyncIterator, first_item, origin: str | None = None
+) -> AsyncIterator[tuple[str, dict]]:
+    """
+    A started reply stream as (event, data) pairs, shared by SSE and WebSocket.
+    
+    `queued` and `delta` events, then `done` with the saved AI message id, or
+    `error`. If the consumer stops early, whatever it was already sent is
+    saved. Close it with aclosing() so that happens right away.
+    """
+    conv_id = exchange.conv.id
+    parts = []
+    completed = False
+    
+    def event(item) -> tuple[str, dict]:
+        if isinstance(item, QueuePosition):
+            return "queued", {"position": item.position}
+        parts.append(item)
+        return "delta", {"content": item}
+    
+    try:
+        yield event(first_item)
+        async for item in deltas:
+            yield event(item)
+        completed = True
+    except AIServiceError as e:
+        # Only raised before the first delta, i.e. while queued: nothing to save
+        completed = True
+        logger.warning(f"AI service unavailable for conversation {conv_id}: {str(e)}")
+        yield "error", _error_data(e)
+        return
+    finally:
+        if not completed:
+            logger.info(f"Stream aborted by client in conversation {conv_id}")
+            if parts:
+                # Client went away: keep what they already saw. The save
+                # runs as its own task because this one is being cancelled.
+                save = asyncio.ensure_future(
+                    _save_streamed_exchange(exchange, "".join(parts).strip(), origin)
+                )
+                _background_tasks.add(save)
+                save.add_done_callback(_background_tasks.discard)
+            # Stops generation upstream, or leaves the LLM queue
+            await deltas.aclose()
+    
+    try:
+        ai_msg_id = await _save_streamed_exchange(exchange, "".join(parts).strip(), origin)
+    except HTTPException as e:
+        yield "error", {"detail": e.detail}
+        return
+    except Exception as e:
+        logger.error(f"Error saving streamed reply in conversation {conv_id}: {str(e)}")
+        yield "error", {"detail": "Failed to save response"}
+        return
+    
+    logger.info(f"Message streamed in conversation {conv_id} by user {exchange.conv.user_id}")
+    yield "done", {"id": ai_msg_id}
+
+@router.post("/{conv_id}/messages/stream")
+async def stream_message(
     conv_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    msg: MessageCreate,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all messages in a conversation"""
+    """
+    Send a message and stream the AI response as Server-Sent Events.
+    
+    Emits `queued` events with the request's place in line while it waits
+    for an LLM slot, `delta` events with content fragments, then a single
+    `done` event carrying the saved AI message id. The exchange is saved in
+    one transaction when the stream ends; if the client disconnects
+    mid-stream the Groq stream is closed and whatever was already sent is
+    saved. If the AI service fails before the first event a 503 is returned;
+    if it fails while queued an `error` event is sent. Either way nothing is
+    saved.
+    """
+    content = _validated_content(msg)
+    try:
+        exchange = await start_exchange(db, conv_id, current_user.id, content)
+        deltas = stream_ai_response(exchange.context.messages, exchange.context.summary)
+        # Wait for the first event so a failed stream is still a plain 503
+        first_item = await deltas.__anext__()
+    
+    except HTTPException:
+        raise
+    except AIServiceError as e:
+        logger.warning(f"AI service unavailable for conversation {conv_id}: {str(e)}")
+        raise _unavailable(e)
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error starting stream in conversation {conv_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to process message"
+        )
+    
+    async def event_stream():
+        async with aclosing(_reply_events(exchange, deltas, first_item)) as events:
+            async for event, data in events:
+                yield _sse_event(event, data)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/{conv_id}/ws")
+async def conversation_socket(websocket: WebSocket, conv_id: int):
+    """
+    Chat in a conversation over one long-lived WebSocket.
+    
+    The token (Authorization header or `token` query parameter) and the
+    conversation's ownership are checked once, at connect, and hold until
+    the token expires (close code 4401) or the conversation is deleted
+    (4404). The client sends `{"type": "message", "content": ...}`, one at a
+    time, and `{"type": "ping"}`. The server sends `ready`, then for each
+    message the same `queued`/`delta`/`done`/`error` events as the SSE
+    endpoint, each as `{"type": <event>, ...data}`. It also sends `message`
+    events for messages saved elsewhere (other devices, HTTP, generation
+    workers), `resync` if some of those were dropped for a slow client,
+    and `pong`.
+    """
+    await websocket.accept()
+    try:
+        current_user, expires_at = await get_websocket_user(websocket)
+        async with SessionLocal() as db:
+            await get_owned_conversation(db, conv_id, current_user.id)
+    except HTTPException as e:
+        code = WS_UNAUTHORIZED if e.status_code == status.HTTP_401_UNAUTHORIZED else WS_NOT_FOUND
+        await websocket.close(code=code, reason=e.detail)
+        return
+    
+    # Identifies this connection's own messages in the conversation's events
+    origin = uuid4().hex
+    hub = get_conversation_hub()
+    subscription = hub.subscribe(conv_id)
+    send_lock = asyncio.Lock()
+    reply_task: asyncio.Task | None = None
+    
+    async def send(data: dict):
+        async with send_lock:
+            await websocket.send_json(data)
+    
+    async def reply(content: str):
+        try:
+            try:
+                async with SessionLocal() as db:
+                    exchange = await start_exchange(db, conv_id, current_user.id, content)
+                deltas = stream_ai_response(exchange.context.messages, exchange.context.summary)
+                first_item = await deltas.__anext__()
+            except HTTPException as e:
+                await send({"type": "error", "detail": e.detail})
+                return
+            except AIServiceError as e:
+                logger.warning(f"AI service unavailable for conversation {conv_id}: {str(e)}")
+                await send({"type": "error", **_error_data(e)})
+                return
+            except Exception as e:
+                logger.error(f"Error starting reply in conversation {conv_id}: {str(e)}")
+                await send({"type": "error", "detail": "Failed to process message"})
+                return
+            
+            async with aclosing(_reply_events(exchange, deltas, first_item, origin)) as events:
+                async for event, data in events:
+                    await send({"type": event, **data})
+        except Exception as e:
+            # The socket went away mid-reply; what was sent is saved
+            logger.info(f"WebSocket reply in conversation {conv_id} cut short: {str(e)}")
+    
+    async def receive_frames():
+        """Handle client frames until it disconnects"""
+        nonlocal reply_task
+        while True:
+            try:
+                frame = await websocket.receive_json()
+            except WebSocketDisconnect:
+                return None
+            except (ValueError, KeyError):
+                await send({"type": "error", "detail": "Frames must be JSON text"})
+                continue
+            
+            kind = frame.get("type") if isinstance(frame, dict) else None
+            if kind == "ping":
+                await send({"type": "pong"})
+            elif kind != "message":
+                await send({"type": "error", "detail": "Unknown frame type"})
+            elif reply_task is not None and not reply_task.done():
+                await send({"type": "error", "detail": "Wait for the current reply to finish"})
+            else:
+                try:
+                    content = _validated_content(MessageCreate(content=frame.get("content")))
+                except (ValidationError, HTTPException):
+                    await send({"type": "error", "detail": "Message content must be 1 to 5000 characters"})
+                    continue
+                reply_task = asyncio.create_task(reply(content))
+    
+    async def forward_events():
+        """Push the conversation's events until it is deleted"""
+        while True:
+            event = await subscription.get()
+            if event["type"] == "deleted":
+                return WS_NOT_FOUND, "Conversation deleted"
+            if event.get("origin") != origin:
+                await send({k: v for k, v in event.items() if k != "origin"})
+            if subscription.lagged:
+                subscription.lagged = False
+                await send({"type": "resync"})
+    
+    WEBSOCKET_CONNECTIONS.inc()
+    logger.info(f"WebSocket opened for conversation {conv_id} by user {current_user.id}")
+    tasks = [asyncio.create_task(receive_frames()), asyncio.create_task(forward_events())]
+    close = None
+    try:
+        await send({"type": "ready", "conversation_id": conv_id})
+        timeout = max(expires_at - time.time(), 0) if expires_at else None
+        done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            close = WS_UNAUTHORIZED, "Token expired"
+        else:
+            # A failed send means the client is gone too
+            task = done.pop()
+            close = None if task.exception() else task.result()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # An unfinished reply is cut short and what was sent is saved, as with SSE
+        for task in tasks + ([reply_task] if reply_task else []):
+            task.cancel()
+        await asyncio.gather(*tasks, *([reply_task] if reply_task else []), return_exceptions=True)
+        hub.unsubscribe(subscription)
+        WEBSOCKET_CONNECTIONS.dec()
+        logger.info(f"WebSocket closed for conversation {conv_id} by user {current_user.id}")
+    
+    if close is not None:
+        try:
+            await websocket.close(code=close[0], reason=close[1])
+        except RuntimeError:
+            # Client closed first
+            pass
+
+@router.get("/{conv_id}/jobs/{job_id}", response_model=JobResponse)
+async def get_job(
+    conv_id: int,
+    job_id: int,
+    wait: float = Query(0, ge=0, le=JOB_MAX_WAIT),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get an async reply job, with the AI message once it is done.
+    
+    With `wait` (seconds) this long-polls: it answers as soon as the job is
+    done or failed, or with its current status when `wait` runs out.
+    """
+    try:
+        job, ai_msg = await wait_for_job(db, conv_id, job_id, current_user.id, wait)
+        return _job_body(job, ai_msg)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving job {job_id} in conversation {conv_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve job"
+        )
+
+@router.get("/{conv_id}/messages", response_model=MessagePage)
+async def get_messages(
+    conv_id: int,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get one page of messages in a conversation, oldest first.
+    
+    Without a cursor the latest page is returned. `before` pages back to
+    older messages and `after` forward to newer ones; both are keyset range
+    scans on Message.id.
+    """
+    check_single_cursor(before, after)
     try:
         # Verify conversation exists and belongs to current user
-        conv = db.query(Conversation).filter(
-            Conversation.id == conv_id,
-            Conversation.user_id == current_user.id
-        ).first()
+        conv = await get_owned_conversation(db, conv_id, current_user.id)
+        # An archived conversation is brought back before its first page
+        await ensure_hot(db, conv)
         
-        if not conv:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Conversation not found"
-            )
+        # Plain columns: no ORM objects, identity map or response re-validation
+        query = select(*_DETAIL_COLUMNS).where(Message.conversation_id == conv_id)
+        if after:
+            query = query.where(Message.id > decode_id_cursor(after)).order_by(Message.id)
+        else:
+            if before:
+                query = query.where(Message.id < decode_id_cursor(before))
+            query = query.order_by(Message.id.desc())
+        
+        # Fetch one extra row to learn whether another page exists
+        result = await db.execute(query.limit(limit + 1))
+        msgs = result.all()
+        has_more = len(msgs) > limit
+        msgs = msgs[:limit]
+        if not after:
+            msgs.reverse()
         
-        msgs = db.query(Message).filter(
-            Message.conversation_id == conv_id
-        ).order_by(Message.id).all()
+        older = has_more if not after else True
+        newer = has_more if after else bool(before)
         
         logger.debug(f"Retrieved {len(msgs)} messages from conversation {conv_id}")
-        return [
-            {"sender": m.sender, "content": m.content, "id": m.id}
-            for m in msgs
-        ]
+        return FastJSONResponse({
+            "messages": [m._asdict() for m in msgs],
+            "next_cursor": encode_cursor({"id": msgs[0].id}) if msgs and older else None,
+            "prev_cursor": encode_cursor({"id": msgs[-1].id}) if msgs and newer else None
+        })
     except HTTPException:
         raise
     except Exception as e:
@@ -116,4 +475,60 @@ def get_messages(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to retrieve messages"
-        )
\ No newline at end of file
+        )
+
+async def _message_batches(conv_id: int) -> AsyncIterator[list]:
+    """
+    All of a conversation's messages, oldest first, EXPORT_BATCH_SIZE at a
+    time from a server-side cursor, on a session of their own that lives as
+    long as the response stream
+    """
+    async with SessionLocal() as db:
+        result = await db.stream(
+            select(*_DETAIL_COLUMNS)
+            .where(Message.conversation_id == conv_id)
+            .order_by(Message.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        async for rows in result.partitions():
+            yield [m._asdict() for m in rows]
+
+@router.get("/{conv_id}/messages/export", response_model=ConversationExport)
+async def export_messages(
+    conv_id: int,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get a whole conversation in one response, oldest message first.
+    
+    The body is streamed as it is read, so a thread of any length is never
+    held in memory; a response cut short is not valid JSON. Pages from GET
+    .../messages suit a client that shows history as it scrolls.
+    """
+    try:
+        conv = await get_owned_conversation(db, conv_id, current_user.id)
+        await ensure_hot(db, conv)
+        # Frees this session's connection; the stream reads on its own
+        await db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error exporting conversation {conv_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to export conversation"
+        )
+    
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in stream_json_document(
+                {"conversation_id": conv.id, "title": conv.title}, "messages", _message_batches(conv_id)
+            ):
+                yield chunk
+        except Exception as e:
+            # Headers are already sent; the client sees the body end early
+            logger.error(f"Error streaming export of conversation {conv_id}: {str(e)}")
+            raise
+    
+    return StreamingResponse(body(), media_type="application/json")
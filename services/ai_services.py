@@ -1,10 +1,26 @@
-from groq import Groq
 from dotenv import load_dotenv
-import os
+from dataclasses import dataclass
+from services.answer_cache import AnswerCache, get_answer_cache
+from services.knowledge_base import knowledge_base
+from services.llm_gate import LLM_QUEUE_TIMEOUT, LLMBusyError, Priority, get_llm_gate
+from services.llm_providers import Completion, get_provider
+from services.model_router import (
+    LLM_MODEL_LARGE, Route, choose_model, cost_usd, routing_fingerprint, unsure_signal
+)
+from utils.metrics import (
+    GROQ_FALLBACKS, GROQ_LATENCY, GROQ_RETRIES, LLM_ROUTES, LLM_UNSURE, observe_groq, record_groq_usage
+)
+from utils.singleflight import LeaderGone, SingleFlight
+from typing import AsyncIterator
+import asyncio
+import hashlib
+import json
+import logging
+import time
 
 load_dotenv()
 
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# Retries are done here (tenacity) under the LLM gate, not by the provider
 
 # APP-SPECIFIC PROMPT - added details about the mobile app and its features
 APP_INFO = """
@@ -24,7 +40,10 @@ App features:
 For contact: nikoo@app.com
 """
 
-SYSTEM_PROMPT = f"""You are a friendly and helpful assistant for our mobile app.
+# Core rules sent on every call. Topic guides (wallet, CAP, marketplace,
+# profile, streaming, safety, Guardian, troubleshooting) live in
+# knowledge_base/ and only the ones relevant to the question are appended.
+CORE_PROMPT = f"""You are a friendly and helpful assistant for our mobile app.
 
 {APP_INFO}
 
@@ -32,238 +51,422 @@ Rules:
 1. Always respond in the language the user is using (e.g., Bengali if the user asks in Bengali, English if in English).
 2. If the question is not related to the app, reply: "I can only help with questions about this app."
 3. Keep answers short, clear, and step-by-step when explaining features.
-4. When users ask about payments, adding money, sending tips, or withdrawing/payout give answer step-by-step:
-   To add money:
-   - Go to Wallet → + Add Credits
-   - Choose amount ($10, $25, $50, $100, $250, $500 or custom)
-   - Pay with card → Balance added instantly.
-
-   To send a tip/money:
-   - In chat or profile → Send Money/Tip
-   - Enter username
-   - Choose amount → Add optional message → Send
-   - You'll see "Send Money Successful".
-
-   To withdraw (payout):
-   - Make sure KYC is verified
-   - Wallet → Request Payout
-   - Enter amount (minimum $10)
-   - Choose Bank Transfer (free, 3-5 days) or Instant (1.5% fee)
-   - Submit → Money arrives in 3-5 business days.
-=
-5. Provide support team contact (nikoo@app.com) when the issue cannot be resolved or user needs further help.
-6. Do not share personal opinions or unrelated information.
-7. Never mention that you are an AI or model — just be a helpful assistant.
-8. Only answer questions related to the app.
-9. When users ask about CAP, Capture, Evidence, Camera, recording, or uploading photos/videos:
-   📸 How to use CAP (Capture Evidence) - Step by step:
-   1. App opens → Shows loading animation (2-3 screens).
-   2. Pre-Capture Checklist:
-      - Wait for GPS Signal, Network Connection, IMU Sensors, Dual Camera to show green ticks.
-      - "All systems ready" appears.
-   3. Tap "All systems ready" → "Start Capture" button shows → Tap it.
-   4. Camera opens (starts in single mode).
-   5. Switch to Dual Camera if needed (PIP or Split view).
-   6. (Optional) Open Camera Settings → Adjust grid overlay, resolution, evidence metadata (timestamp, GPS, etc.).
-   7. Tap the red button to start recording photo/video.
-   8. Record using front + back cameras → Stop when done.
-   9. Preview the captured media → Retake if needed → Check metadata (GPS, timestamp, camera mode, device info).
-   10. Tap "Confirm & Continue".
-   11. Compose post:
-       - Add caption
-       - Add hashtags (#)
-       - Add mentions (@username)
-       - Add or confirm location
-       - Choose audience: Public / Followers only / Private
-       - Optional: Add to Story
-   12. Tap "Continue & Upload".
-   13. Wait for upload progress → See "Upload Complete" with green check.
-   14. You can now "Capture New Evidence" to start again.
-
-10.When users ask about Marketplace, buying, selling, escrow, delivery proof, or order process:
-   🛒 How to buy safely on Marketplace (with Escrow):
-   1. Go to Marketplace → Browse listings or search.
-   2. Tap a product → View details, seller info, reviews.
-   3. Tap "Buy Now" → Go to Checkout.
-   4. Enter card details → Pay (money held in Escrow).
-   5. Order placed → Seller ships item.
-   6. When item arrives → Go to Order → "Delivery Proof".
-   7. Take photos of package at delivery (unopened), tracking label, etc.
-   8. Add delivery notes → Submit Delivery Proof.
-   9. You have 48 hours to confirm receipt or open dispute.
-   10. If everything is okay → Tap "Confirm Receipt & Release Funds" → Seller gets paid.
-   11. Leave a review and rating for the item & seller.
-
-   🔴 How to sell on Marketplace:
-   - List your item in Marketplace.
-   - When buyer pays → Money held in Escrow.
-   - Ship the item.
-   - Buyer submits delivery proof & confirms receipt → Funds released to your wallet after 48 hours (or instantly if no issue).
-   - You can then request payout to bank.
-
-   ⚠️ Escrow protection: Funds only released after buyer confirms good condition. If dispute → support reviews evidence.   
-
-11.When users ask about profile, edit profile, settings, privacy, security, biometrics, language, or bio:
-   👤 Profile & Settings Guide:
-   - View your profile: See avatar, bio, stats (Followers, Following, Posts, Streams, Saved).
-   - Edit Profile:
-     - Tap avatar → Change Profile Avatar
-     - Edit Name, Username, Bio → Save
-   - Settings (bottom tab → Profile → Settings):
-     - General: Language (English, Italian), Theme (dark/light), App Version
-     - Privacy Matrix: Choose preset (Public, Friends Only, Private) or customize who can see profile, content, streams, comments, etc.
-     - Security:
-       - Two-Factor Authentication (on/off)
-       - Active Sessions: See logged-in devices → Logout from others
-       - Manage Biometrics: Add/Edit Face ID / Touch ID templates → Rotate or Delete
-     - Data & Security: Data Export, Help & Tutorial, About & Legal   
-12.When users ask about live streaming, going live, stream, or live broadcast:
-   📡 How to Start a Live Stream :
-   1. Tap the **Stream button** in the bottom navigation bar.
-   2. Allow camera and microphone permissions when prompted.
-   3. (Optional) Add a stream title and tags/hashtags.
-   4. Choose privacy settings (controlled by Privacy Matrix → "Who can view your streams").
-   5. Tap **Go Live** or **Start Live Stream**.
-   6. You're now live! Viewers can watch, chat, like, comment, and send tips in real-time.
-   7. Live viewer count and tipping activity shown on screen.
-   8. To end: Tap "End" → Confirm → Stream ends and saved in your "Streams" tab.
-
-   How to Watch a Live Stream:
-   - Go to a user's profile → Tap the **Streams** tab.
-   - Or find live streams on Home feed.
-   - Tap any thumbnail with red "LIVE" badge → Join and interact (chat + tip).
-
-   All past and live streams appear in the **Streams** tab on profiles.
-   Tips received during streams go directly to your wallet.
-
-13. When users ask about reporting issues, safety, report, SOS, or support tickets:
-   ⚠️ Safety Center & Reporting Guide:
-   - To report an issue (harassment, scam, payment problem, etc.):
-     1. Go to "Report Issue" (usually in profile, post, or chat menu).
-     2. Choose one reason (e.g., Scam/Fraud, Withdrawal failing, Harassment).
-     3. Write a detailed description of what happened.
-     4. (Optional) Attach photos, screenshots, or recordings as evidence.
-     5. Tap "Submit Report" → Get a Ticket ID (e.g., TKT-XXXXX) for tracking.
-
-   - For emergency / immediate help:
-     1. Tap "Send SOS" (red button at top of Report screen).
-     2. Confirm → App shares essential info (session ID + location) with safety team.
-     3. Use only when you need urgent assistance.
-
-   After submission: You'll see "Report Submitted" with Ticket ID. Our team will review it.
-    Key Safety Tips:
-   • Trust posts with high integrity badges and evidence.
-   • Be cautious in live streams — don't share personal info.
-   • Never meet strangers from the app.
-   • Protect your account with strong auth and session checks.
-   • Always use in-app payments (escrow protected).
-   • Report suspicious behavior immediately.
-   For follow-up, contact support at nikoo@app.com with your Ticket ID.  
-14. When users ask about Guardian, parental control, child safety, monitoring, schedules, app blocking, or child account:
-   👪 Guardian (Parental Control) Guide:
-   - To set up Guardian:
-     1. Go to Settings/Profile → Start Guardian Setup.
-     2. Complete Guardian KYC (name, email, phone, government ID).
-     3. Create child profile (name, age).
-     4. Enter Device ID/Link Code from child's device.
-     5. Setup complete → Access Guardian Dashboard.
-
-   - In Guardian Dashboard (parent view):
-     • Overview: See alerts, approvals, activity summary.
-     • Apps: Allow/Block app installs.
-     • Browser: Force SafeSearch, block/allow websites.
-     • Keywords: Add words/phrases to monitor (e.g., "bullying") → Get real-time alerts.
-     • Schedules: Set time rules (school, homework, bedtime) with app/website restrictions.
-     • Approvals: Review child's requests for extra time or apps → Approve/Deny.
-     • Logs: View real-time activity (apps used, sites visited, blocks).
-     • Export: Download reports as CSV (screen time, alerts, approvals).
-
-   - On child's device:
-     • Shows current schedule and remaining time.
-     • Child can request extra time or temporary unlock → Parent approves in queue.
-
-   Guardian helps parents monitor and protect child's digital safety.
-   For issues: Contact nikoo@app.com.   
-15.When users ask about errors, empty feed, offline, permissions, update required, device not supported, or feature not available:
-   ⚙️ Common Issues & Fixes:
-   - Feed empty? → "Your feed is empty. Tap 'Discover Content' to explore and follow creators/topics."
-   - No internet? → "Check your connection. The app auto-retries. Tap 'Discover Content' to retry manually."
-   - Permission denied (Camera/Mic/Location)? → "Go to device Settings > Privacy > [Permission] > Enable for the app."
-   - Update required? → "A new version is available. Tap the button to update in App Store/Play Store."
-   - Scheduled maintenance? → "We're performing maintenance (estimated completion shown). Check back soon."
-   - Device not supported? → "Your device/OS is below requirements. You can continue in Legacy Mode (limited features)."
-   - Feature not available? → "This feature is currently disabled. It may be in testing or coming soon."
-
-   If the issue persists, contact support at nikoo@app.com with details/screenshot.           
-   
+4. Provide support team contact (nikoo@app.com) when the issue cannot be resolved or user needs further help.
+5. Do not share personal opinions or unrelated information.
+6. Never mention that you are an AI or model — just be a helpful assistant.
+7. Only answer questions related to the app.
+8. When a guide below covers the question, follow its steps exactly.
 """
 
-def get_ai_response(messages_history: list) -> str:
+def build_system_prompt(query: str) -> str:
+    """Core rules plus the knowledge base guides most relevant to the query"""
+    sections = knowledge_base.search(query)
+    if not sections:
+        return CORE_PROMPT
+    guides = "\n\n".join(f"## {s.title}\n{s.body}" for s in sections)
+    return f"{CORE_PROMPT}\nGuides:\n\n{guides}\n"
+
+def _retrieval_query(messages_history: list) -> str:
+    """The latest two user turns, so short follow-ups keep their topic"""
+    user_turns = [m.content for m in messages_history if m.sender == "user"]
+    return " ".join(user_turns[-2:])
+
+SUMMARY_PROMPT = """You maintain a running summary of a support chat between a user and the app's assistant.
+Merge the previous summary with the new messages into one updated summary.
+Keep the user's goals, account or device details they mentioned, steps already tried and open questions.
+Write in the language the user is using. Keep it under 150 words. Reply with the summary only."""
+
+COMPLETION_PARAMS = {"temperature": 0.5, "max_tokens": 500, "top_p": 0.95}
+
+EMPTY_RESPONSE_MESSAGE = "I'm having trouble responding right now. Please try again."
+
+# Identical completions in flight at the same time are made only once
+completions_in_flight = SingleFlight("completion")
+
+# Summaries are optional (the old one is kept on failure), so they give up fast
+SUMMARY_QUEUE_TIMEOUT = 5.0
+# How often a queued stream reports its position
+QUEUE_POSITION_INTERVAL = 2.0
+
+class AIServiceError(Exception):
+    """Groq could not produce a reply; `user_message` is safe to show the user"""
+
+    def __init__(self, user_message: str):
+        super().__init__(user_message)
+        self.user_message = user_message
+
+class AIBusyError(AIServiceError):
+    """The LLM queue could not take the request in time"""
+
+    def __init__(self, position: int, retry_after: int):
+        super().__init__(
+            f"I'm busy helping other users. You're number {position} in line, "
+            f"please try again in about {retry_after} seconds."
+        )
+        self.position = position
+        self.retry_after = retry_after
+
+@dataclass(frozen=True)
+class QueuePosition:
+    """Yielded by stream_ai_response while the request waits for an LLM slot"""
+    position: int
+
+def _build_messages(messages_history: list, summary: str | None = None) -> list:
+    """Build the Groq chat payload from stored Message objects"""
+    system_prompt = build_system_prompt(_retrieval_query(messages_history))
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary:
+        messages.append({
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{summary}"
+        })
+    for msg in messages_history:
+        role = "user" if msg.sender == "user" else "assistant"
+        messages.append({"role": role, "content": msg.content})
+    return messages
+
+def _estimate_tokens(messages: list, max_tokens: int) -> int:
+    """Prompt estimate plus the completion limit, reserved against the TPM quota"""
+    from services.context import count_tokens
+    return sum(count_tokens(m["content"]) for m in messages) + max_tokens
+
+def _usage_tokens(usage) -> int | None:
+    return getattr(usage, "total_tokens", None)
+
+def _record_usage(operation: str, model: str, usage):
+    record_groq_usage(operation, model, usage, cost_usd(model, usage))
+
+async def _on_groq_error(error: Exception):
+    """Make every worker back off when the provider says we are over quota"""
+    retry_after = get_provider().retry_after(error)
+    if retry_after is not None:
+        await get_llm_gate().pause(retry_after)
+
+def _prompt_fingerprint() -> str:
+    """Changes whenever the prompt, guides or sampling parameters do, retiring cached answers"""
+    knowledge_base.maybe_reload()
+    return hashlib.sha256(
+        json.dumps([CORE_PROMPT, knowledge_base.version, routing_fingerprint(), COMPLETION_PARAMS], sort_keys=True).encode()
+    ).hexdigest()[:16]
+
+def _is_first_question(messages_history: list, summary: str | None) -> bool:
+    """A lone user message with no earlier context"""
+    return not summary and len(messages_history) == 1 and messages_history[0].sender == "user"
+
+def _answer_cache_key(messages_history: list, summary: str | None) -> str | None:
+    """Cache key for a context-free first question, None for anything else"""
+    if get_answer_cache() is None or not _is_first_question(messages_history, summary):
+        return None
+    return AnswerCache.make_key(messages_history[0].content, _prompt_fingerprint())
+
+def _flight_key(messages_history: list, summary: str | None, messages: list, model: str) -> str:
     """
-    Get AI response from Groq API with proper error handling.
+    Requests that would get the same completion.
+
+    First questions match after normalization, like the answer cache;
+    anything with context only matches on the exact payload.
+    """
+    if _is_first_question(messages_history, summary):
+        return "q:" + AnswerCache.make_key(messages_history[0].content, _prompt_fingerprint())
+    payload = json.dumps([model, COMPLETION_PARAMS, messages], ensure_ascii=False)
+    return "p:" + hashlib.sha256(payload.encode()).hexdigest()
+
+def _route(messages_history: list, summary: str | None) -> Route:
+    route = choose_model(messages_history, summary)
+    LLM_ROUTES.labels(route.tier, route.reason).inc()
+    return route
+
+def _fallback_message(error: Exception) -> str:
+    """Map a Groq failure to a user-facing fallback message"""
+    logger = logging.getLogger(__name__)
+    if "rate_limit" in str(error).lower():
+        GROQ_FALLBACKS.labels("rate_limit").inc()
+        return "I'm busy helping other users. Please wait a moment and try again."
+    elif "api_key" in str(error).lower():
+        GROQ_FALLBACKS.labels("api_key").inc()
+        logger.critical("API key configuration error")
+        return "Service configuration error. Please contact support at nikoo@app.com"
+    else:
+        GROQ_FALLBACKS.labels("unavailable").inc()
+        return "I'm temporarily unavailable. Please try again in a moment."
+
+async def get_ai_response(messages_history: list, summary: str | None = None) -> str:
+    """
+    Get AI response from the LLM provider with proper error handling.
+    
+    The model is picked by services.model_router; an unsure answer from the
+    small model is replaced by the large model's. Identical requests
+    arriving while one is in flight wait for it and share its answer
+    instead of making their own call.
     
     Args:
         messages_history: List of Message objects from database
+        summary: Rolling summary of older turns not included in the history
     
     Returns:
         str: AI response text
     
     Raises:
-        Exception: If API call fails after retry
+        AIServiceError: If the API call fails after retry or returns nothing
     """
-    import logging
-    from tenacity import retry, stop_after_attempt, wait_exponential
+    from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_exponential
     
     logger = logging.getLogger(__name__)
+    # Queue waits across both attempts count against one deadline
+    deadline = time.monotonic() + LLM_QUEUE_TIMEOUT
     
     @retry(
         stop=stop_after_attempt(2),
-        wait=wait_exponential(multiplier=1, min=1, max=5)
+        wait=wait_exponential(multiplier=1, min=1, max=5),
+        # A cancelled request (client gone) must not come back as a retry
+        retry=retry_if_not_exception_type((LLMBusyError, asyncio.CancelledError)),
+        reraise=True,  # surface the Groq error itself so the fallback can tell rate limits apart
+        before_sleep=lambda _: GROQ_RETRIES.labels("complete").inc()
     )
-    def _call_groq():
-        """Call Groq API with retry logic"""
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-        
-        # Build message history
-        for msg in messages_history:
-            role = "user" if msg.sender == "user" else "assistant"
-            messages.append({"role": role, "content": msg.content})
-        
+    async def _call_groq(model: str) -> Completion:
+        """Call the provider with retry logic"""
         # Validate message count
         if not messages_history:
             logger.warning("Empty message history provided")
         
-        # Call Groq API
+        # Wait for a slot; retries queue again so a 429 pause applies to them too
+        ticket = await get_llm_gate().acquire(
+            Priority.CHAT,
+            _estimate_tokens(messages, COMPLETION_PARAMS["max_tokens"]),
+            timeout=max(deadline - time.monotonic(), 0.0)
+        )
+        used_tokens = None
+        
         try:
-            chat_completion = client.chat.completions.create(
-                messages=messages,
-                model="llama-3.3-70b-versatile",
-                temperature=0.5,
-                max_tokens=500,
-                top_p=0.95
-            )
+            with observe_groq("complete", model):
+                completion = await get_provider().complete(model, messages, **COMPLETION_PARAMS)
+            _record_usage("complete", model, completion.usage)
+            used_tokens = _usage_tokens(completion.usage)
             
-            response = chat_completion.choices[0].message.content.strip()
-            if not response:
-                logger.warning("Groq returned empty response")
-                return "I'm having trouble responding right now. Please try again."
+            completion.text = completion.text.strip()
+            if not completion.text:
+                logger.warning(f"{model} returned empty response")
+                GROQ_FALLBACKS.labels("empty").inc()
+                raise AIServiceError(EMPTY_RESPONSE_MESSAGE)
             
-            return response
+            return completion
+        
+        except Exception as e:
+            logger.error(f"LLM API error from {model}: {str(e)}", exc_info=True)
+            await _on_groq_error(e)
+            raise
+        finally:
+            await ticket.release(used_tokens)
+    
+    async def _generate() -> str:
+        try:
+            completion = await _call_groq(route.model)
+        
+        except AIServiceError:
+            raise
+        except LLMBusyError as e:
+            logger.warning(f"LLM queue busy, turning request away: {str(e)}")
+            raise AIBusyError(e.position, e.retry_after) from e
+        except Exception as e:
+            logger.error(f"Failed to get AI response after retries: {str(e)}")
+            # Surface a helpful fallback message based on error type
+            raise AIServiceError(_fallback_message(e)) from e
         
+        signal = unsure_signal(completion.text, completion.finish_reason) if route.tier == "small" else None
+        if signal:
+            LLM_UNSURE.labels(signal, "true").inc()
+            logger.info(f"Escalating unsure {route.model} answer ({signal}) to {LLM_MODEL_LARGE}")
+            try:
+                completion = await _call_groq(LLM_MODEL_LARGE)
+            except Exception as e:
+                # The small model's answer is still better than an error
+                logger.warning(f"Escalation to {LLM_MODEL_LARGE} failed, keeping the first answer: {str(e)}")
+        
+        if cache_key:
+            await get_answer_cache().set(cache_key, completion.text)
+        return completion.text
+    
+    # Repeated FAQ-style first questions are answered from the cache
+    cache_key = _answer_cache_key(messages_history, summary)
+    if cache_key:
+        cached = await get_answer_cache().get(cache_key)
+        if cached is not None:
+            logger.debug("Answer cache hit")
+            return cached
+    
+    messages = _build_messages(messages_history, summary)
+    route = _route(messages_history, summary)
+    return await completions_in_flight.do(_flight_key(messages_history, summary, messages, route.model), _generate)
+
+async def stream_ai_response(
+    messages_history: list, summary: str | None = None
+) -> AsyncIterator[str | QueuePosition]:
+    """
+    Stream an AI response from the LLM provider token by token.
+    
+    The model is picked by services.model_router. While the request waits
+    for an LLM slot, QueuePosition items report its place in line. If an
+    identical request is already in flight its answer is shared and yielded
+    whole once ready. Only opening the stream is retried. A failure before the first delta raises AIServiceError; after
+    that it ends the stream with whatever was generated so far.
+    
+    Args:
+        messages_history: List of Message objects from database
+        summary: Rolling summary of older turns not included in the history
+    
+    Yields:
+        QueuePosition: While queued, on entry and every QUEUE_POSITION_INTERVAL
+        str: Content deltas as they arrive from the provider
+    
+    Raises:
+        AIBusyError: If no LLM slot frees up within LLM_QUEUE_TIMEOUT
+        AIServiceError: If no content could be generated
+    """
+    from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_exponential
+    
+    logger = logging.getLogger(__name__)
+    
+    @retry(
+        stop=stop_after_attempt(2),
+        wait=wait_exponential(multiplier=1, min=1, max=5),
+        retry=retry_if_not_exception_type(asyncio.CancelledError),
+        reraise=True,  # surface the Groq error itself so the fallback can tell rate limits apart
+        before_sleep=lambda _: GROQ_RETRIES.labels("stream").inc()
+    )
+    async def _open_stream(messages: list, model: str):
+        """Open a completion stream with retry logic"""
+        try:
+            with observe_groq("stream_open", model):
+                return await get_provider().open_stream(model, messages, **COMPLETION_PARAMS)
         except Exception as e:
-            logger.error(f"Groq API error: {str(e)}", exc_info=True)
+            await _on_groq_error(e)
             raise
     
+    cache_key = _answer_cache_key(messages_history, summary)
+    if cache_key:
+        cached = await get_answer_cache().get(cache_key)
+        if cached is not None:
+            logger.debug("Answer cache hit")
+            yield cached
+            return
+    
+    messages = _build_messages(messages_history, summary)
+    route = _route(messages_history, summary)
+    flight_key = _flight_key(messages_history, summary, messages, route.model)
+    try:
+        shared = await completions_in_flight.join(flight_key)
+    except LeaderGone:
+        # The identical request failed or was cut short; generate our own
+        shared = None
+    if shared is not None:
+        logger.debug("Sharing an identical in-flight completion")
+        yield shared
+        return
+    
+    flight = completions_in_flight.begin(flight_key)
+    answer = None
     try:
-        return _call_groq()
+        try:
+            ticket = await get_llm_gate().enqueue(
+                Priority.CHAT,
+                _estimate_tokens(messages, COMPLETION_PARAMS["max_tokens"]),
+                LLM_QUEUE_TIMEOUT
+            )
+        except LLMBusyError as e:
+            logger.warning(f"LLM queue busy, turning stream away: {str(e)}")
+            raise AIBusyError(e.position, e.retry_after) from e
+        
+        used_tokens = None
+        try:
+            try:
+                while ticket.position:
+                    yield QueuePosition(ticket.position)
+                    await ticket.wait(timeout=QUEUE_POSITION_INTERVAL)
+                await ticket.wait()
+            except LLMBusyError as e:
+                logger.warning(f"Stream gave up waiting for an LLM slot: {str(e)}")
+                raise AIBusyError(e.position, e.retry_after) from e
+            
+            try:
+                stream = await _open_stream(messages, route.model)
+            except Exception as e:
+                logger.error(f"Failed to open {route.model} stream after retries: {str(e)}")
+                raise AIServiceError(_fallback_message(e)) from e
+            
+            parts = []
+            started = time.perf_counter()
+            outcome = "aborted"
+            try:
+                async for delta in stream:
+                    parts.append(delta)
+                    yield delta
+            except Exception as e:
+                outcome = "error"
+                logger.error(f"{route.model} stream interrupted: {str(e)}", exc_info=True)
+                if not parts:
+                    raise AIServiceError(_fallback_message(e)) from e
+            else:
+                outcome = "ok"
+                answer = "".join(parts).strip()
+                # Already shown to the user, so only counted to tune the routing
+                signal = unsure_signal(answer, stream.finish_reason) if route.tier == "small" else None
+                if signal:
+                    LLM_UNSURE.labels(signal, "false").inc()
+                if cache_key and answer:
+                    await get_answer_cache().set(cache_key, answer)
+            finally:
+                GROQ_LATENCY.labels("stream", route.model, outcome).observe(time.perf_counter() - started)
+                # Usage arrives with the last chunk, so an aborted stream has none
+                _record_usage("stream", route.model, stream.usage)
+                used_tokens = _usage_tokens(stream.usage)
+                await stream.close()
+        finally:
+            await ticket.release(used_tokens)
+    finally:
+        # Followers only get a complete answer; otherwise they generate their own
+        completions_in_flight.finish(flight, answer or None)
+
+async def summarize_messages(previous_summary: str | None, new_messages: list) -> str:
+    """
+    Fold messages that no longer fit the context budget into the summary.
+    
+    Args:
+        previous_summary: Current rolling summary, if any
+        new_messages: Message objects to fold in, oldest first
+    
+    Returns:
+        str: Updated summary
     
+    Raises:
+        Exception: If the LLM call fails or no LLM slot frees up in time;
+            callers keep the old summary
+    """
+    transcript = "\n".join(
+        f"{'User' if m.sender == 'user' else 'Assistant'}: {m.content}"
+        for m in new_messages
+    )
+    messages = [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {
+            "role": "user",
+            "content": f"Previous summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"
+        }
+    ]
+    # Lower priority than replies; under load the old summary is simply kept
+    ticket = await get_llm_gate().acquire(
+        Priority.SUMMARY, _estimate_tokens(messages, 250), timeout=SUMMARY_QUEUE_TIMEOUT
+    )
+    completion = None
+    try:
+        with observe_groq("summary", LLM_MODEL_LARGE):
+            completion = await get_provider().complete(LLM_MODEL_LARGE, messages, temperature=0.2, max_tokens=250)
+        _record_usage("summary", LLM_MODEL_LARGE, completion.usage)
     except Exception as e:
-        logger.error(f"Failed to get AI response after retries: {str(e)}")
-        # Return helpful fallback messages based on error type
-        if "rate_limit" in str(e).lower():
-            return "I'm busy helping other users. Please wait a moment and try again."
-        elif "api_key" in str(e).lower():
-            logger.critical("API key configuration error")
-            return "Service configuration error. Please contact support at nikoo@app.com"
-        else:
-            return "I'm temporarily unavailable. Please try again in a moment."
\ No newline at end of file
+        await _on_groq_error(e)
+        raise
+    finally:
+        await ticket.release(_usage_tokens(completion.usage) if completion else None)
+    summary = completion.text.strip()
+    if not summary:
+        raise ValueError(f"{LLM_MODEL_LARGE} returned an empty summary")
+    return summary
@@ -0,0 +1,119 @@
+from dotenv import load_dotenv
+from utils.cache import TTLCache
+from utils.metrics import ANSWER_CACHE_LOOKUPS
+from utils.text import detect_language, normalize_question
+import hashlib
+import logging
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "memory" (per process), "redis" (shared by all workers) or "off"
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "memory")
+ANSWER_CACHE_URL = os.getenv("ANSWER_CACHE_URL", "redis://localhost:6379/0")
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+class MemoryAnswerBackend:
+    """In-process LRU + TTL store; each gunicorn worker has its own"""
+
+    def __init__(self, maxsize: int, ttl: int):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> str | None:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: str):
+        self._cache.set(key, value)
+
+    def size(self) -> int:
+        return len(self._cache)
+
+class RedisAnswerBackend:
+    """Shared store for multiple workers; Redis evicts by TTL and maxmemory-policy"""
+
+    def __init__(self, url: str, ttl: int):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("ANSWER_CACHE_BACKEND=redis requires the 'redis' package")
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._ttl = ttl
+
+    async def get(self, key: str) -> str | None:
+        return await self._redis.get(f"answer:{key}")
+
+    async def set(self, key: str, value: str):
+        await self._redis.set(f"answer:{key}", value, ex=self._ttl)
+
+    def size(self) -> int | None:
+        return None
+
+class AnswerCache:
+    """
+    Cache of complete answers to context-free questions.
+    
+    Keys combine the normalized question, its detected language and a
+    fingerprint of the prompt and model parameters, so changing either one
+    naturally invalidates old answers. Backend errors are logged and treated
+    as misses; the cache must never fail a chat request.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(question: str, fingerprint: str) -> str:
+        normalized = normalize_question(question)
+        raw = f"{detect_language(question)}\x00{fingerprint}\x00{normalized}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def get(self, key: str) -> str | None:
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Answer cache read failed: {str(e)}")
+            value = None
+        if value is None:
+            self.misses += 1
+            ANSWER_CACHE_LOOKUPS.labels("miss").inc()
+        else:
+            self.hits += 1
+            ANSWER_CACHE_LOOKUPS.labels("hit").inc()
+        return value
+
+    async def set(self, key: str, value: str):
+        try:
+            await self.backend.set(key, value)
+        except Exception as e:
+            logger.warning(f"Answer cache write failed: {str(e)}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": ANSWER_CACHE_BACKEND,
+            "size": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+def _create_answer_cache() -> AnswerCache | None:
+    if ANSWER_CACHE_BACKEND == "off":
+        return None
+    if ANSWER_CACHE_BACKEND == "redis":
+        return AnswerCache(RedisAnswerBackend(ANSWER_CACHE_URL, ANSWER_CACHE_TTL))
+    return AnswerCache(MemoryAnswerBackend(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL))
+
+_answer_cache = None
+
+def get_answer_cache() -> AnswerCache | None:
+    """The process's answer cache, None when disabled; created on first use rather than at import"""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = _create_answer_cache()
+    return _answer_cache
@@ -0,0 +1,297 @@
+"""
+Hot/cold tiering: inactive conversations are archived as one compressed record.
+
+A conversation untouched for ARCHIVE_AFTER_DAYS has its messages moved out
+of the messages table into a single conversation_archives row, a zlib
+compressed JSON document, and is stamped archived_at. The messages table,
+its indexes and vacuum work then only cover conversations still in use.
+
+Reading an archived conversation's history rehydrates it. The messages go
+back into the messages table with their original ids, so cursors, the
+rolling summary and ordering stay valid, and the archive row is dropped.
+A message written while its conversation was being archived stays in the
+messages table, and rehydration merges it back in. A rehydrated
+conversation counts as active from then on, so reading it is not undone
+by the next pass. Each archive also gets a search document, so a search
+can find and rehydrate it (services.search). Finished reply jobs of an
+archived conversation go with its messages.
+"""
+from dotenv import load_dotenv
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import Conversation, ConversationArchive, Message, SessionLocal, utcnow
+from services.search import find_archived, index_archived
+from utils.metrics import ARCHIVE_BYTES, ARCHIVE_OPERATIONS, TIER_CONVERSATIONS, TIER_MESSAGES
+import asyncio
+import json
+import logging
+import os
+import time
+import zlib
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Days without activity before a conversation is archived (0 = never)
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+# Seconds between archive passes in each API process (0 = never archive here)
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+# Conversations archived per pass, one transaction each
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "50"))
+# Pause between conversations, so a pass yields to live traffic
+ARCHIVE_PAUSE = float(os.getenv("ARCHIVE_PAUSE", "0.05"))
+# Longer threads stay hot; each one is archived in a single transaction
+ARCHIVE_MAX_MESSAGES = int(os.getenv("ARCHIVE_MAX_MESSAGES", "10000"))
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "6"))
+
+CODEC = "zlib-json"
+_COLUMNS = ["id", "sender", "content", "token_count", "created_at"]
+_INSERT_BATCH = 1000
+
+def encode_messages(messages: list) -> tuple[bytes, int]:
+    """(compressed payload, uncompressed size) for rows of _COLUMNS"""
+    rows = [
+        [m.id, m.sender, m.content, m.token_count, m.created_at.isoformat() if m.created_at else None]
+        for m in messages
+    ]
+    raw = json.dumps({"columns": _COLUMNS, "rows": rows}, ensure_ascii=False, separators=(",", ":")).encode()
+    return zlib.compress(raw, ARCHIVE_COMPRESSION_LEVEL), len(raw)
+
+def decode_messages(codec: str, payload: bytes, conv_id: int) -> list:
+    """Message insert parameters from an archive payload"""
+    if codec != CODEC:
+        raise ValueError(f"Unknown archive codec: {codec}")
+    document = json.loads(zlib.decompress(payload))
+    columns = document["columns"]
+    messages = []
+    for row in document["rows"]:
+        values = dict(zip(columns, row))
+        if values.get("created_at"):
+            values["created_at"] = datetime.fromisoformat(values["created_at"])
+        messages.append({**values, "conversation_id": conv_id})
+    return messages
+
+def _inactive(cutoff: datetime) -> list:
+    """Conditions for a live, hot conversation with no activity since `cutoff`"""
+    return [
+        Conversation.archived_at.is_(None),
+        Conversation.deleted_at.is_(None),
+        Conversation.updated_at < cutoff,
+        or_(Conversation.rehydrated_at.is_(None), Conversation.rehydrated_at < cutoff)
+    ]
+
+async def archive_conversation(conv_id: int, cutoff: datetime) -> int | None:
+    """
+    Archive one conversation if it is still inactive since `cutoff`;
+    returns the messages archived, or None if it was left hot.
+    """
+    async with SessionLocal() as db:
+        try:
+            # Re-checks the policy and, on Postgres, locks the row until commit,
+            # so a conversation that just got a message or is being archived
+            # by another process is skipped
+            claimed = await db.execute(
+                update(Conversation)
+                .where(Conversation.id == conv_id, *_inactive(cutoff))
+                .values(archived_at=utcnow())
+                .returning(Conversation.id)
+                .execution_options(synchronize_session=False)
+            )
+            if claimed.first() is None:
+                await db.rollback()
+                return None
+
+            result = await db.execute(
+                select(Message).where(Message.conversation_id == conv_id).order_by(Message.id)
+            )
+            messages = result.scalars().all()
+            payload, raw_bytes = encode_messages(messages)
+            db.add(ConversationArchive(
+                conversation_id=conv_id,
+                codec=CODEC,
+                payload=payload,
+                message_count=len(messages),
+                raw_bytes=raw_bytes,
+                compressed_bytes=len(payload),
+                archived_at=utcnow()
+            ))
+            await db.flush()
+            await index_archived(db, conv_id, "\n".join(m.content or "" for m in messages))
+            await db.execute(delete(Message).where(Message.conversation_id == conv_id))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+    ARCHIVE_OPERATIONS.labels("archived").inc()
+    return len(messages)
+
+async def rehydrate(db: AsyncSession, conv: Conversation) -> int:
+    """
+    Move an archived conversation's messages back into the messages table
+    and commit; returns how many. Safe to race: only the caller that
+    deletes the archive row restores it, the others find it gone.
+    """
+    start = time.perf_counter()
+    restored = 0
+    try:
+        result = await db.execute(
+            delete(ConversationArchive)
+            .where(ConversationArchive.conversation_id == conv.id)
+            .returning(ConversationArchive.codec, ConversationArchive.payload)
+        )
+        archive = result.first()
+        if archive is not None:
+            messages = decode_messages(archive.codec, archive.payload, conv.id)
+            for i in range(0, len(messages), _INSERT_BATCH):
+                await db.execute(insert(Message), messages[i:i + _INSERT_BATCH])
+            restored = len(messages)
+        await db.execute(
+            update(Conversation)
+            .where(Conversation.id == conv.id)
+            .values(archived_at=None, rehydrated_at=utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    conv.archived_at = None
+    if archive is not None:
+        ARCHIVE_OPERATIONS.labels("rehydrated").inc()
+        logger.info(
+            f"Rehydrated conversation {conv.id} ({restored} messages) "
+            f"in {1000 * (time.perf_counter() - start):.0f} ms"
+        )
+    return restored
+
+async def ensure_hot(db: AsyncSession, conv: Conversation):
+    """Rehydrate `conv` first if it is archived; call before reading its messages"""
+    if conv.archived_at is not None and conv.deleted_at is None:
+        await rehydrate(db, conv)
+
+async def rehydrate_matching(db: AsyncSession, user_id: int, query: str, limit: int) -> int:
+    """Rehydrate up to `limit` of the user's archived conversations matching a search; returns how many"""
+    conv_ids = await find_archived(db, user_id, query, limit)
+    if not conv_ids:
+        return 0
+    result = await db.execute(select(Conversation).where(Conversation.id.in_(conv_ids)))
+    for conv in result.scalars().all():
+        await rehydrate(db, conv)
+    return len(conv_ids)
+
+async def tier_stats() -> dict:
+    """Conversations, messages and bytes in each tier; deleted conversations excluded"""
+    async with SessionLocal() as db:
+        hot = (await db.execute(
+            select(func.count(), func.coalesce(func.sum(Conversation.message_count), 0))
+            .where(Conversation.archived_at.is_(None), Conversation.deleted_at.is_(None))
+        )).one()
+        cold = (await db.execute(
+            select(
+                func.count(),
+                func.coalesce(func.sum(ConversationArchive.message_count), 0),
+                func.coalesce(func.sum(ConversationArchive.raw_bytes), 0),
+                func.coalesce(func.sum(ConversationArchive.compressed_bytes), 0)
+            )
+        )).one()
+        await db.commit()
+    return {
+        "hot": {"conversations": hot[0], "messages": int(hot[1])},
+        "archived": {
+            "conversations": cold[0],
+            "messages": int(cold[1]),
+            "raw_bytes": int(cold[2]),
+            "compressed_bytes": int(cold[3])
+        }
+    }
+
+def _record_tier_stats(stats: dict):
+    for tier in ("hot", "archived"):
+        TIER_CONVERSATIONS.labels(tier).set(stats[tier]["conversations"])
+        TIER_MESSAGES.labels(tier).set(stats[tier]["messages"])
+    ARCHIVE_BYTES.labels("raw").set(stats["archived"]["raw_bytes"])
+    ARCHIVE_BYTES.labels("compressed").set(stats["archived"]["compressed_bytes"])
+
+async def archive_inactive(stopping=lambda: False) -> int:
+    """
+    One pass over the longest-inactive conversations; returns how many were
+    picked up without an error. A conversation that fails to archive stays
+    hot and is retried next pass, so it cannot hold up the rest.
+    """
+    cutoff = utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    async with SessionLocal() as db:
+        result = await db.execute(
+            select(Conversation.id)
+            .where(*_inactive(cutoff), Conversation.message_count <= ARCHIVE_MAX_MESSAGES)
+            .order_by(Conversation.updated_at)
+            .limit(ARCHIVE_BATCH_SIZE)
+        )
+        conv_ids = result.scalars().all()
+        await db.commit()
+    failed = 0
+    for conv_id in conv_ids:
+        if stopping():
+            return 0
+        try:
+            archived = await archive_conversation(conv_id, cutoff)
+        except Exception as e:
+            failed += 1
+            ARCHIVE_OPERATIONS.labels("failed").inc()
+            logger.error(f"Failed to archive conversation {conv_id}: {str(e)}")
+        else:
+            if archived is not None:
+                logger.info(f"Archived conversation {conv_id} ({archived} messages)")
+        await asyncio.sleep(ARCHIVE_PAUSE)
+    return len(conv_ids) - failed
+
+class ConversationArchiver:
+    """Background task running archive passes until stopped"""
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self.last_stats: dict | None = None
+
+    def start(self, interval: float):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(interval))
+        logger.info(f"Started conversation archiver (every {interval:g}s, after {ARCHIVE_AFTER_DAYS:g} days)")
+
+    async def stop(self, grace: float = 5.0):
+        """Let the conversation being archived finish for up to `grace` seconds, then cancel"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        _, pending = await asyncio.wait([self._task], timeout=grace)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self, interval: float):
+        while not self._stopping:
+            try:
+                # A full pass may have left more behind
+                while await archive_inactive(lambda: self._stopping) == ARCHIVE_BATCH_SIZE:
+                    pass
+                self.last_stats = await tier_stats()
+                _record_tier_stats(self.last_stats)
+            except Exception as e:
+                logger.error(f"Conversation archiving failed: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self._task is not None,
+            "after_days": ARCHIVE_AFTER_DAYS,
+            "tiers": self.last_stats
+        }
+
+conversation_archiver = ConversationArchiver()
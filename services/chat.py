@@ -0,0 +1,120 @@
+from dataclasses import dataclass
+from fastapi import HTTPException, status
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import Conversation, Message, PREVIEW_LENGTH, utcnow
+from services.context import ContextWindow, count_tokens, fit_context, load_unsummarized
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TITLE = "New Conversation"
+
+@dataclass
+class Exchange:
+    """A user message waiting for its AI reply; nothing is persisted yet"""
+    conv: Conversation
+    user_msg: Message
+    context: ContextWindow
+
+async def get_owned_conversation(db: AsyncSession, conv_id: int, user_id: int) -> Conversation:
+    """Load a conversation owned by the user or raise 404"""
+    result = await db.execute(select(Conversation).where(
+        Conversation.id == conv_id,
+        Conversation.user_id == user_id,
+        Conversation.deleted_at.is_(None)
+    ))
+    conv = result.scalars().first()
+    if not conv:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversation not found"
+        )
+    return conv
+
+def activity_values(conv: Conversation, added: int, latest: str, user_content: str | None = None) -> dict:
+    """
+    Conversation column updates for `added` new messages, `latest` being
+    the newest; the title is taken from `user_content` while still default.
+    """
+    now = utcnow()
+    values = {
+        "message_count": Conversation.message_count + added,
+        "last_message_at": now,
+        "last_message_preview": " ".join(latest.split())[:PREVIEW_LENGTH],
+        "updated_at": now
+    }
+    # Update conversation title if it's the first message
+    if user_content is not None and conv.title == DEFAULT_TITLE:
+        values["title"] = user_content[:50] + ("..." if len(user_content) > 50 else "")
+    return values
+
+async def start_exchange(db: AsyncSession, conv_id: int, user_id: int, content: str) -> Exchange:
+    """
+    Read everything needed to answer a new user message.
+    
+    History is loaded once. The read transaction is then ended so the
+    session's connection goes back to the pool for the duration of the LLM
+    calls (summary and reply); the user message itself is only built in
+    memory and written by finish_exchange.
+    """
+    conv = await get_owned_conversation(db, conv_id, user_id)
+    tail = await load_unsummarized(db, conv)
+    await db.commit()
+    
+    user_msg = Message(
+        conversation_id=conv_id,
+        sender="user",
+        content=content,
+        token_count=count_tokens(content)
+    )
+    context = await fit_context(conv, tail + [user_msg])
+    return Exchange(conv, user_msg, context)
+
+async def finish_exchange(db: AsyncSession, exchange: Exchange, reply: str) -> Message:
+    """
+    Persist the user message, AI reply, title, counters and summary in one
+    short transaction, and return the saved AI message.
+    
+    If the conversation was deleted or archived during the LLM calls the
+    exchange is dropped and a 404 raised.
+    """
+    conv = exchange.conv
+    ai_msg = Message(
+        conversation_id=conv.id,
+        sender="ai",
+        content=reply,
+        token_count=count_tokens(reply)
+    )
+    
+    values = activity_values(conv, 2, reply, exchange.user_msg.content)
+    if exchange.context.summary_changed(conv):
+        values["summary"] = exchange.context.summary
+        values["summary_upto_id"] = exchange.context.summary_upto_id
+    
+    try:
+        # Updated before the messages are written: it re-checks that the
+        # conversation is still live and hot and, on Postgres, locks the row
+        # until commit, so the purger and archiver wait for this exchange
+        result = await db.execute(
+            update(Conversation)
+            .where(
+                Conversation.id == conv.id,
+                Conversation.deleted_at.is_(None),
+                Conversation.archived_at.is_(None)
+            )
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            logger.info(f"Conversation {conv.id} was deleted or archived during its reply; exchange dropped")
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Conversation not found"
+            )
+        db.add_all([exchange.user_msg, ai_msg])
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return ai_msg
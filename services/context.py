@@ -0,0 +1,104 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from dataclasses import dataclass
+from database import Conversation, Message
+from services.archive import ensure_hot
+from services.ai_services import summarize_messages
+from dotenv import load_dotenv
+import logging
+import math
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Token budget for the conversation part of the prompt (summary + recent turns)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Per-message overhead for role markers in the chat template
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate the number of Llama 3 tokens in a message.
+    
+    English averages about four characters per token; Bengali and other
+    non-Latin scripts split much finer, so non-ASCII characters are weighted
+    more heavily. The estimate is deliberately a little high so the budget
+    errs on the side of a shorter prompt.
+    """
+    if not text:
+        return MESSAGE_OVERHEAD_TOKENS
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    ascii_chars = len(text) - non_ascii
+    return math.ceil(ascii_chars / 4 + non_ascii / 2) + MESSAGE_OVERHEAD_TOKENS
+
+def message_tokens(msg: Message) -> int:
+    """Stored token count, estimating only for rows written before it existed"""
+    if msg.token_count is None:
+        return count_tokens(msg.content)
+    return msg.token_count
+
+@dataclass
+class ContextWindow:
+    """What to send for the next reply, plus the summary state to persist"""
+    summary: str | None
+    summary_upto_id: int
+    messages: list
+
+    def summary_changed(self, conv: Conversation) -> bool:
+        return self.summary_upto_id != conv.summary_upto_id
+
+async def load_unsummarized(db: AsyncSession, conv: Conversation) -> list:
+    """Messages newer than the conversation's stored summary, oldest first"""
+    await ensure_hot(db, conv)
+    result = await db.execute(select(Message).where(
+        Message.conversation_id == conv.id,
+        Message.id > conv.summary_upto_id
+    ).order_by(Message.id))
+    return list(result.scalars().all())
+
+async def fit_context(conv: Conversation, tail: list) -> ContextWindow:
+    """
+    Keep the newest turns that fit CONTEXT_TOKEN_BUDGET and fold the rest
+    into the rolling summary.
+    
+    Does no database I/O, so it can run after the session's connection has
+    been returned to the pool. `conv` is not modified; the caller persists
+    the returned summary state together with the exchange.
+    
+    Args:
+        conv: Conversation being answered
+        tail: Unsummarized messages oldest first, ending with the new user message
+    
+    Returns:
+        ContextWindow: Summary and recent messages to send
+    """
+    budget = CONTEXT_TOKEN_BUDGET
+    if conv.summary:
+        budget -= count_tokens(conv.summary)
+    
+    # Walk back from the newest message; the latest turn is always kept
+    used = 0
+    keep_from = len(tail)
+    for i in range(len(tail) - 1, -1, -1):
+        cost = message_tokens(tail[i])
+        if keep_from < len(tail) and used + cost > budget:
+            break
+        used += cost
+        keep_from = i
+    
+    overflow, recent = tail[:keep_from], tail[keep_from:]
+    window = ContextWindow(conv.summary, conv.summary_upto_id, recent)
+    if overflow:
+        try:
+            window.summary = await summarize_messages(conv.summary, overflow)
+            window.summary_upto_id = overflow[-1].id
+            logger.info(
+                f"Folded {len(overflow)} messages into summary of conversation {conv.id}"
+            )
+        except Exception as e:
+            # Still answer within budget; the overflow is retried next turn
+            logger.error(f"Failed to update summary for conversation {conv.id}: {str(e)}")
+    
+    return window
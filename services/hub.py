@@ -0,0 +1,181 @@
+"""
+Fan-out of conversation events to WebSocket connections.
+
+Every saved message is published on its conversation's channel and the
+WebSocket endpoint pushes it to the user's other devices. With the memory
+backend events only reach connections in the same process; with
+CHAT_HUB_BACKEND=redis they go through Redis pub/sub, so devices connected
+to different workers, and replies saved by generation workers, see them too.
+"""
+from dotenv import load_dotenv
+from utils.metrics import HUB_EVENTS
+import asyncio
+import json
+import logging
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "memory" (per process) or "redis" (shared by all workers)
+CHAT_HUB_BACKEND = os.getenv("CHAT_HUB_BACKEND", "memory")
+CHAT_HUB_URL = os.getenv("CHAT_HUB_URL", "redis://localhost:6379/0")
+# Events buffered per connection; a slower client is told to resync instead
+CHAT_HUB_BUFFER = int(os.getenv("CHAT_HUB_BUFFER", "100"))
+
+CHANNEL_PREFIX = "conversation:"
+
+class Subscription:
+    """One connection's feed of a conversation's events"""
+
+    def __init__(self, conv_id: int, maxsize: int):
+        self.conv_id = conv_id
+        self.lagged = False
+        self._queue = asyncio.Queue(maxsize)
+
+    def put(self, event: dict):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+    async def get(self) -> dict:
+        return await self._queue.get()
+
+class MemoryHubBackend:
+    """Delivers straight to this process's subscribers"""
+
+    def __init__(self, deliver):
+        self._deliver = deliver
+
+    def start(self):
+        pass
+
+    async def publish(self, conv_id: int, event: dict):
+        self._deliver(conv_id, event)
+
+    async def close(self):
+        pass
+
+class RedisHubBackend:
+    """Redis pub/sub; one pattern subscription per process feeds its local subscribers"""
+
+    def __init__(self, url: str, deliver):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CHAT_HUB_BACKEND=redis requires the 'redis' package")
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._deliver = deliver
+        self._listener: asyncio.Task | None = None
+
+    def start(self):
+        """Listen once the first connection subscribes, so API-less processes never do"""
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def publish(self, conv_id: int, event: dict):
+        await self._redis.publish(f"{CHANNEL_PREFIX}{conv_id}", json.dumps(event, ensure_ascii=False))
+
+    async def _listen(self):
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    conv_id = int(message["channel"][len(CHANNEL_PREFIX):])
+                    self._deliver(conv_id, json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Events published while resubscribing are lost; clients resync on reconnect
+                logger.error(f"Chat hub lost its Redis subscription, retrying: {str(e)}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+        await self._redis.close()
+
+class ConversationHub:
+    """
+    Routes conversation events to subscribed connections.
+
+    Publishing never fails the caller: backend errors are logged and the
+    event is dropped, since every event can be recovered by refetching.
+    """
+
+    def __init__(self, backend: str, url: str, buffer: int):
+        self._subscriptions: dict[int, set[Subscription]] = {}
+        self._buffer = buffer
+        if backend == "redis":
+            self._backend = RedisHubBackend(url, self._deliver)
+        else:
+            self._backend = MemoryHubBackend(self._deliver)
+
+    def subscribe(self, conv_id: int) -> Subscription:
+        self._backend.start()
+        subscription = Subscription(conv_id, self._buffer)
+        self._subscriptions.setdefault(conv_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.conv_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.conv_id]
+
+    async def publish(self, conv_id: int, event: dict):
+        try:
+            await self._backend.publish(conv_id, event)
+            HUB_EVENTS.labels(event["type"]).inc()
+        except Exception as e:
+            logger.error(f"Failed to publish {event['type']} event for conversation {conv_id}: {str(e)}")
+
+    def _deliver(self, conv_id: int, event: dict):
+        for subscription in self._subscriptions.get(conv_id, ()):
+            subscription.put(event)
+
+    async def close(self):
+        await self._backend.close()
+
+    def stats(self) -> dict:
+        return {
+            "backend": CHAT_HUB_BACKEND,
+            "conversations": len(self._subscriptions),
+            "connections": sum(len(s) for s in self._subscriptions.values())
+        }
+
+_hub = None
+
+def get_conversation_hub() -> ConversationHub:
+    """The process's hub, created on first use rather than at import"""
+    global _hub
+    if _hub is None:
+        _hub = ConversationHub(CHAT_HUB_BACKEND, CHAT_HUB_URL, CHAT_HUB_BUFFER)
+    return _hub
+
+async def close_conversation_hub():
+    if _hub is not None:
+        await _hub.close()
+
+async def publish_messages(conv_id: int, *messages, origin: str | None = None):
+    """
+    Announce saved messages to the conversation's connections.
+
+    `origin` identifies the connection that sent them, which already has
+    them and skips the event.
+    """
+    for msg in messages:
+        await get_conversation_hub().publish(conv_id, {
+            "type": "message",
+            "message": {"id": msg.id, "sender": msg.sender, "content": msg.content},
+            "origin": origin
+        })
@@ -0,0 +1,366 @@
+"""
+Asynchronous reply generation backed by a database table queue.
+
+`POST .../messages?mode=async` saves the user message together with a
+GenerationJob and returns straight away. Generation workers, inside the API
+processes or in separate `python worker.py` processes, claim jobs with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of them share the table
+without a broker. Jobs of one conversation run one at a time, oldest first,
+so replies land in order.
+"""
+from dotenv import load_dotenv
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException, status
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from database import Conversation, GenerationJob, Message, SessionLocal, utcnow
+from services.ai_services import AIBusyError, AIServiceError, get_ai_response
+from services.chat import activity_values
+from services.context import count_tokens, fit_context, load_unsummarized
+from services.hub import publish_messages
+from utils.metrics import GENERATION_JOB_WAIT, GENERATION_JOBS
+import asyncio
+import logging
+import os
+import socket
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Workers started inside each API process; outside development run
+# `python worker.py` instead so generation scales apart from the API
+GENERATION_WORKERS = int(os.getenv(
+    "GENERATION_WORKERS",
+    "0" if os.getenv("AUTH_MODE", "development") == "production" else "1"
+))
+# How often idle workers and long-polls recheck the table; jobs finished in
+# the same process wake them immediately
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# A claimed job not finished within this is handed to another worker
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "180"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# Longest long-poll a client may ask for with ?wait=
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))
+
+PENDING = ("queued", "running")
+FAILED_MESSAGE = "Failed to process message"
+
+class _Signal:
+    """Wakes every coroutine in this process waiting on it; other processes rely on polling"""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def current(self) -> asyncio.Event:
+        """Take before checking the table, so a notify in between is not missed"""
+        return self._event
+
+    def notify(self):
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+async def _sleep_until(event: asyncio.Event, timeout: float):
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+_work_available = _Signal()
+_job_finished = _Signal()
+
+@dataclass(frozen=True)
+class Claim:
+    """A job held by a worker; `attempt` must still match the row for the worker to finish it"""
+    job_id: int
+    conversation_id: int
+    user_message_id: int
+    attempt: int
+
+def _aware(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; everything is stored in UTC
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+async def enqueue_reply(db: AsyncSession, conv: Conversation, user_id: int, content: str) -> GenerationJob:
+    """Save the user message and a job to answer it in one transaction"""
+    user_msg = Message(
+        conversation_id=conv.id,
+        sender="user",
+        content=content,
+        token_count=count_tokens(content)
+    )
+    db.add(user_msg)
+    try:
+        await db.flush()
+        job = GenerationJob(conversation_id=conv.id, user_id=user_id, user_message_id=user_msg.id)
+        db.add(job)
+        await db.execute(
+            update(Conversation)
+            .where(Conversation.id == conv.id)
+            .values(**activity_values(conv, 1, content, content))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    _work_available.notify()
+    await publish_messages(conv.id, user_msg)
+    return job
+
+async def claim_job(db: AsyncSession, worker_id: str) -> Claim | None:
+    """
+    Take the next runnable job: queued and due, or running with an expired
+    lease (its worker died). Only the oldest unfinished job of each
+    conversation is eligible.
+    """
+    now = utcnow()
+    other = aliased(GenerationJob)
+    head = (
+        select(func.min(other.id))
+        .where(other.conversation_id == GenerationJob.conversation_id, other.status.in_(PENDING))
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        select(GenerationJob)
+        .where(
+            or_(
+                and_(GenerationJob.status == "queued", GenerationJob.available_at <= now),
+                and_(GenerationJob.status == "running", GenerationJob.locked_until < now)
+            ),
+            GenerationJob.id == head
+        )
+        .order_by(GenerationJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True, of=GenerationJob)
+    )
+    job = result.scalars().first()
+    if job is None:
+        await db.commit()
+        return None
+
+    # Conditional on the attempt count so a concurrent claimer loses even
+    # where row locks are not available (SQLite)
+    claimed = await db.execute(
+        update(GenerationJob)
+        .where(GenerationJob.id == job.id, GenerationJob.attempts == job.attempts)
+        .values(
+            status="running",
+            attempts=job.attempts + 1,
+            locked_by=worker_id,
+            locked_until=now + timedelta(seconds=JOB_LEASE_SECONDS)
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    if claimed.rowcount != 1:
+        return None
+
+    if job.attempts == 0:
+        GENERATION_JOB_WAIT.observe((now - _aware(job.created_at)).total_seconds())
+    elif job.status == "running":
+        logger.warning(f"Reclaimed job {job.id} from {job.locked_by} after its lease expired")
+    return Claim(job.id, job.conversation_id, job.user_message_id, job.attempts + 1)
+
+def _held(claim: Claim):
+    """WHERE clause matching the job only while this claim still owns it"""
+    return and_(
+        GenerationJob.id == claim.job_id,
+        GenerationJob.attempts == claim.attempt,
+        GenerationJob.status == "running"
+    )
+
+async def _update_held(claim: Claim, outcome: str, values: dict) -> str:
+    """Unlock the job with the given values, unless the claim was lost meanwhile"""
+    async with SessionLocal() as db:
+        result = await db.execute(
+            update(GenerationJob)
+            .where(_held(claim))
+            .values(locked_by=None, locked_until=None, **values)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    return outcome if result.rowcount == 1 else "lost"
+
+async def _fail(claim: Claim, error: str) -> str:
+    """Fail the job without retrying"""
+    return await _update_held(claim, "failed", {"status": "failed", "error": error, "finished_at": utcnow()})
+
+async def _release(claim: Claim, error: str, retry_after: float) -> str:
+    """Put the job back in the queue, or fail it once out of attempts"""
+    if claim.attempt >= JOB_MAX_ATTEMPTS:
+        return await _fail(claim, error)
+    available_at = utcnow() + timedelta(seconds=retry_after)
+    return await _update_held(claim, "retried", {"status": "queued", "error": error, "available_at": available_at})
+
+async def _complete(claim: Claim, conv: Conversation, context, reply: str) -> str:
+    """Save the AI reply, conversation activity and summary, and mark the job done, together"""
+    async with SessionLocal() as db:
+        ai_msg = Message(
+            conversation_id=conv.id,
+            sender="ai",
+            content=reply,
+            token_count=count_tokens(reply)
+        )
+        db.add(ai_msg)
+        try:
+            await db.flush()
+            result = await db.execute(
+                update(GenerationJob)
+                .where(_held(claim))
+                .values(
+                    status="done",
+                    ai_message_id=ai_msg.id,
+                    error=None,
+                    finished_at=utcnow(),
+                    locked_by=None,
+                    locked_until=None
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                # Lease lost to another worker, or the conversation was deleted
+                await db.rollback()
+                return "lost"
+
+            values = activity_values(conv, 1, reply)
+            if context.summary_changed(conv):
+                values["summary"] = context.summary
+                values["summary_upto_id"] = context.summary_upto_id
+            await db.execute(
+                update(Conversation)
+                .where(Conversation.id == conv.id)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+    await publish_messages(conv.id, ai_msg)
+    return "done"
+
+async def run_job(claim: Claim) -> str:
+    """Generate and save the reply for a claimed job; returns the outcome"""
+    async with SessionLocal() as db:
+        conv = await db.get(Conversation, claim.conversation_id)
+        user_msg = await db.get(Message, claim.user_message_id)
+        tail = await load_unsummarized(db, conv) if conv else []
+        # No connection is held during the LLM calls
+        await db.commit()
+    if conv is None or conv.deleted_at is not None or user_msg is None:
+        # Retrying cannot bring the conversation back
+        return await _fail(claim, "Conversation not found")
+    # Questions queued behind this one are left out, and it goes last even
+    # though replies to earlier jobs were saved after it
+    tail = [
+        m for m in tail
+        if m.id != user_msg.id and (m.sender != "user" or m.id < user_msg.id)
+    ] + [user_msg]
+
+    try:
+        context = await fit_context(conv, tail)
+        reply = await get_ai_response(context.messages, context.summary)
+    except AIBusyError as e:
+        return await _release(claim, e.user_message, e.retry_after)
+    except AIServiceError as e:
+        return await _release(claim, e.user_message, min(5 * 2 ** (claim.attempt - 1), 60))
+    return await _complete(claim, conv, context, reply)
+
+class GenerationWorkers:
+    """A pool of coroutines claiming and running jobs until stopped"""
+
+    def __init__(self):
+        self._tasks: list[asyncio.Task] = []
+        self._stopping = False
+
+    def start(self, concurrency: int):
+        self._stopping = False
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks = [asyncio.create_task(self._run(f"{prefix}:{n}")) for n in range(concurrency)]
+        logger.info(f"Started {concurrency} generation worker(s)")
+
+    async def stop(self, grace: float = 10.0):
+        """Let running jobs finish for up to `grace` seconds, then hand them back to the queue"""
+        if not self._tasks:
+            return
+        self._stopping = True
+        _work_available.notify()
+        _, pending = await asyncio.wait(self._tasks, timeout=grace)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, worker_id: str):
+        while not self._stopping:
+            wake = _work_available.current()
+            try:
+                async with SessionLocal() as db:
+                    claim = await claim_job(db, worker_id)
+            except Exception as e:
+                logger.error(f"Generation worker {worker_id} failed to claim a job: {str(e)}")
+                claim = None
+            if claim is None:
+                await _sleep_until(wake, JOB_POLL_INTERVAL)
+                continue
+
+            try:
+                outcome = await run_job(claim)
+            except asyncio.CancelledError:
+                # Shutting down: requeue now rather than after the lease expires
+                await asyncio.shield(_release(claim, FAILED_MESSAGE, 0))
+                raise
+            except Exception as e:
+                logger.error(f"Generation job {claim.job_id} failed: {str(e)}", exc_info=True)
+                try:
+                    outcome = await _release(claim, FAILED_MESSAGE, min(5 * 2 ** (claim.attempt - 1), 60))
+                except Exception:
+                    # The lease expires and another worker retries it
+                    outcome = "error"
+            GENERATION_JOBS.labels(outcome).inc()
+            logger.info(f"Generation job {claim.job_id} (attempt {claim.attempt}): {outcome}")
+            _job_finished.notify()
+
+generation_workers = GenerationWorkers()
+
+async def wait_for_job(
+    db: AsyncSession, conv_id: int, job_id: int, user_id: int, wait: float = 0
+) -> tuple[GenerationJob, Message | None]:
+    """
+    Load a job owned by the user, with its AI message once done, or raise 404.
+
+    With `wait`, long-polls until the job is done or failed or `wait`
+    seconds have passed. The session's transaction is ended between checks
+    so no connection is held while waiting.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        finished = _job_finished.current()
+        result = await db.execute(
+            select(GenerationJob)
+            .where(
+                GenerationJob.id == job_id,
+                GenerationJob.conversation_id == conv_id,
+                GenerationJob.user_id == user_id
+            )
+            .execution_options(populate_existing=True)
+        )
+        job = result.scalars().first()
+        if not job:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Job not found"
+            )
+        remaining = deadline - loop.time()
+        if job.status not in PENDING or remaining <= 0:
+            break
+        await db.commit()
+        await _sleep_until(finished, min(JOB_POLL_INTERVAL, remaining))
+
+    ai_msg = await db.get(Message, job.ai_message_id) if job.ai_message_id else None
+    await db.commit()
+    return job, ai_msg
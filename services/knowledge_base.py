@@ -0,0 +1,164 @@
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+from pathlib import Path
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+import time
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+KB_DIR = os.getenv("KB_DIR", str(Path(__file__).resolve().parent.parent / "knowledge_base"))
+KB_TOP_K = int(os.getenv("KB_TOP_K", "2"))
+# How often (seconds) to check the directory for edited guides
+KB_RELOAD_INTERVAL = float(os.getenv("KB_RELOAD_INTERVAL", "5"))
+
+# BM25 parameters
+_K1 = 1.5
+_B = 0.75
+# Keywords line weight: each keyword counts this many times in the section
+_KEYWORD_BOOST = 3
+# Sections scoring below this fraction of the best match are incidental hits
+_MIN_RELATIVE_SCORE = 0.35
+
+_TOKEN = re.compile(r"[\w\u0980-\u09FF]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or "
+    "the to what when where which who why will with you your".split()
+)
+
+def tokenize(text: str) -> list:
+    """Lowercase word tokens with English stopwords and plural -s removed"""
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and token.isascii():
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+@dataclass
+class Section:
+    """One topic guide from the knowledge base directory"""
+    name: str
+    title: str
+    body: str
+    term_freqs: dict = field(default_factory=dict)
+    length: int = 0
+
+def _parse_section(path: Path) -> Section:
+    """
+    Parse a guide file: a '# Title' line, an optional 'keywords:' line, then
+    the text that goes into the prompt.
+    """
+    lines = path.read_text(encoding="utf-8").splitlines()
+    title = path.stem
+    keywords = ""
+    if lines and lines[0].startswith("#"):
+        title = lines.pop(0).lstrip("#").strip()
+    if lines and lines[0].lower().startswith("keywords:"):
+        keywords = lines.pop(0).split(":", 1)[1]
+    body = "\n".join(lines).strip()
+    
+    tokens = tokenize(f"{title} {body}") + tokenize(keywords) * _KEYWORD_BOOST
+    term_freqs = {}
+    for token in tokens:
+        term_freqs[token] = term_freqs.get(token, 0) + 1
+    return Section(path.stem, title, body, term_freqs, len(tokens))
+
+class KnowledgeBase:
+    """
+    BM25 keyword index over the topic guides in KB_DIR.
+    
+    The index is built on first use (or explicitly via load() at startup) and
+    rebuilt when any guide file is added, removed or edited, checked at most
+    every KB_RELOAD_INTERVAL seconds, so guides can be changed without a restart.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.sections = []
+        self.version = ""
+        self._doc_freqs = {}
+        self._avg_length = 0.0
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _dir_signature(self) -> tuple:
+        return tuple(
+            (p.name, p.stat().st_mtime_ns, p.stat().st_size)
+            for p in sorted(self.directory.glob("*.md"))
+        )
+
+    def load(self):
+        """(Re)build the index from the guide files"""
+        with self._lock:
+            signature = self._dir_signature()
+            sections = [_parse_section(p) for p in sorted(self.directory.glob("*.md"))]
+            doc_freqs = {}
+            for section in sections:
+                for token in section.term_freqs:
+                    doc_freqs[token] = doc_freqs.get(token, 0) + 1
+            
+            self.sections = sections
+            self._doc_freqs = doc_freqs
+            self._avg_length = (
+                sum(s.length for s in sections) / len(sections) if sections else 0.0
+            )
+            self.version = hashlib.sha256(
+                "\x00".join(f"{s.name}\x00{s.title}\x00{s.body}" for s in sections).encode()
+            ).hexdigest()[:16]
+            self._signature = signature
+            self._checked_at = time.monotonic()
+        logger.info(f"Knowledge base loaded: {len(sections)} sections from {self.directory}")
+
+    def maybe_reload(self):
+        """Reload if the directory changed since the last check"""
+        now = time.monotonic()
+        if self._signature is not None and now - self._checked_at < KB_RELOAD_INTERVAL:
+            return
+        try:
+            changed = self._dir_signature() != self._signature
+        except OSError as e:
+            logger.error(f"Cannot read knowledge base directory: {str(e)}")
+            return
+        self._checked_at = now
+        if changed:
+            self.load()
+
+    def search(self, query: str, k: int = KB_TOP_K) -> list:
+        """Return up to k sections ranked by BM25 score, skipping non-matches"""
+        self.maybe_reload()
+        terms = set(tokenize(query))
+        if not terms or not self.sections:
+            return []
+        
+        n = len(self.sections)
+        scored = []
+        for section in self.sections:
+            score = 0.0
+            for term in terms:
+                tf = section.term_freqs.get(term)
+                if not tf:
+                    continue
+                df = self._doc_freqs[term]
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                norm = _K1 * (1 - _B + _B * section.length / self._avg_length)
+                score += idf * tf * (_K1 + 1) / (tf + norm)
+            if score > 0:
+                scored.append((score, section))
+        
+        if not scored:
+            return []
+        scored.sort(key=lambda item: item[0], reverse=True)
+        cutoff = scored[0][0] * _MIN_RELATIVE_SCORE
+        return [section for score, section in scored[:k] if score >= cutoff]
+
+knowledge_base = KnowledgeBase(KB_DIR)
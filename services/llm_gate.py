@@ -0,0 +1,457 @@
+from dotenv import load_dotenv
+from enum import IntEnum
+from utils.metrics import LLM_QUEUE_WAIT, LLM_REJECTIONS
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+import uuid
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Groq calls in flight per worker process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Calls allowed to wait for a slot; beyond this callers are turned away at once
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "100"))
+# How long a chat reply may wait in the queue before giving up (seconds)
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))
+# Groq account quotas; 0 disables that limit. With the memory backend each
+# worker enforces them alone, so set them to the per-worker share.
+GROQ_RPM = int(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM = int(os.getenv("GROQ_TPM", "6000"))
+# "memory" (per process) or "redis" (quota and LLM_GLOBAL_CONCURRENCY shared by all workers)
+LLM_GATE_BACKEND = os.getenv("LLM_GATE_BACKEND", "memory")
+LLM_GATE_URL = os.getenv("LLM_GATE_URL", "redis://localhost:6379/0")
+LLM_GLOBAL_CONCURRENCY = int(os.getenv("LLM_GLOBAL_CONCURRENCY", "0"))
+# A crashed worker's global slot is reclaimed after this many seconds
+LLM_LEASE_TTL = 120
+
+class Priority(IntEnum):
+    """Lower runs first: a user waiting on a reply beats background summaries"""
+    CHAT = 0
+    SUMMARY = 1
+
+class LLMBusyError(Exception):
+    """No Groq capacity within the caller's deadline"""
+
+    def __init__(self, position: int, retry_after: int):
+        super().__init__(f"LLM queue busy (position {position}, retry after {retry_after}s)")
+        self.position = position
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Refills `per_minute` units evenly over a minute, holding at most one minute's worth"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available; 0 if it is now"""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+    def give(self, amount: float):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + amount)
+
+class MemoryLimiter:
+    """RPM/TPM quota for this process"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._paused_until = 0.0
+
+    async def acquire(self, tokens: int, lease_id: str) -> float:
+        """Take one request and `tokens` from the quota, or return seconds to wait"""
+        now = time.monotonic()
+        wait = max(
+            self._paused_until - now,
+            self._requests.wait_time(1, now),
+            self._tokens.wait_time(tokens, now)
+        )
+        if wait > 0:
+            return wait
+        self._requests.take(1)
+        self._tokens.take(tokens)
+        return 0.0
+
+    async def release(self, lease_id: str, token_delta: int, refund_request: bool = False):
+        """Settle the token estimate against actual usage (negative = refund), and refund a call never made"""
+        if token_delta > 0:
+            self._tokens.take(token_delta)
+        elif token_delta < 0:
+            self._tokens.give(-token_delta)
+        if refund_request:
+            self._requests.give(1)
+
+    async def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def requests_available(self) -> float | None:
+        """Requests the RPM bucket could admit right now, for wait estimates"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return 0.0
+        self._requests.wait_time(1, now)  # refills
+        return self._requests.level if self._requests.capacity else None
+
+# Two buckets and an optional global semaphore, updated atomically in Redis.
+# Uses Redis TIME so workers on different hosts agree on the clock.
+_REDIS_ACQUIRE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1e6
+local rpm, tpm = tonumber(ARGV[1]), tonumber(ARGV[2])
+local need, conc = tonumber(ARGV[3]), tonumber(ARGV[4])
+local b = redis.call('HMGET', KEYS[1], 'r', 't', 'ts', 'pause')
+local r, tk = tonumber(b[1]) or rpm, tonumber(b[2]) or tpm
+local ts, pause = tonumber(b[3]) or now, tonumber(b[4]) or 0
+local elapsed = math.max(0, now - ts)
+if rpm > 0 then r = math.min(rpm, r + elapsed * rpm / 60) end
+if tpm > 0 then tk = math.min(tpm, tk + elapsed * tpm / 60); need = math.min(need, tpm) end
+local wait = math.max(0, pause - now)
+if rpm > 0 and r < 1 then wait = math.max(wait, (1 - r) * 60 / rpm) end
+if tpm > 0 and tk < need then wait = math.max(wait, (need - tk) * 60 / tpm) end
+if conc > 0 then
+  redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - tonumber(ARGV[6]))
+  if redis.call('ZCARD', KEYS[2]) >= conc then wait = math.max(wait, 0.1) end
+end
+if wait == 0 then
+  if rpm > 0 then r = r - 1 end
+  if tpm > 0 then tk = tk - need end
+  if conc > 0 then redis.call('ZADD', KEYS[2], now, ARGV[5]) end
+end
+redis.call('HSET', KEYS[1], 'r', r, 't', tk, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+return tostring(wait)
+"""
+
+_REDIS_RELEASE = """
+redis.call('ZREM', KEYS[2], ARGV[1])
+local tpm, delta = tonumber(ARGV[2]), tonumber(ARGV[3])
+local rpm, requests = tonumber(ARGV[4]), tonumber(ARGV[5])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+  if tpm > 0 and delta ~= 0 then
+    local tk = tonumber(redis.call('HGET', KEYS[1], 't')) - delta
+    redis.call('HSET', KEYS[1], 't', math.min(tpm, tk))
+  end
+  if rpm > 0 and requests > 0 then
+    local r = tonumber(redis.call('HGET', KEYS[1], 'r')) + requests
+    redis.call('HSET', KEYS[1], 'r', math.min(rpm, r))
+  end
+end
+return 1
+"""
+
+_REDIS_PAUSE = """
+local t = redis.call('TIME')
+local until_ts = tonumber(t[1]) + tonumber(t[2]) / 1e6 + tonumber(ARGV[1])
+local cur = tonumber(redis.call('HGET', KEYS[1], 'pause')) or 0
+if until_ts > cur then redis.call('HSET', KEYS[1], 'pause', until_ts) end
+redis.call('EXPIRE', KEYS[1], 120)
+return 1
+"""
+
+class RedisLimiter:
+    """RPM/TPM quota and optional global concurrency shared by every worker"""
+
+    def __init__(self, url: str, rpm: int, tpm: int, global_concurrency: int):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("LLM_GATE_BACKEND=redis requires the 'redis' package")
+        self._redis = redis.from_url(url)
+        self._keys = ["llm_gate:quota", "llm_gate:active"]
+        self._rpm = rpm
+        self._tpm = tpm
+        self._concurrency = global_concurrency
+        self._acquire = self._redis.register_script(_REDIS_ACQUIRE)
+        self._release = self._redis.register_script(_REDIS_RELEASE)
+        self._pause = self._redis.register_script(_REDIS_PAUSE)
+
+    async def acquire(self, tokens: int, lease_id: str) -> float:
+        try:
+            wait = await self._acquire(
+                keys=self._keys,
+                args=[self._rpm, self._tpm, tokens, self._concurrency, lease_id, LLM_LEASE_TTL]
+            )
+            return float(wait)
+        except Exception as e:
+            # Never block chats on Redis; the local concurrency limit still applies
+            logger.warning(f"LLM gate Redis unavailable, admitting without shared quota: {str(e)}")
+            return 0.0
+
+    async def release(self, lease_id: str, token_delta: int, refund_request: bool = False):
+        try:
+            await self._release(
+                keys=self._keys,
+                args=[lease_id, self._tpm, token_delta, self._rpm, 1 if refund_request else 0]
+            )
+        except Exception as e:
+            logger.warning(f"LLM gate Redis release failed: {str(e)}")
+
+    def requests_available(self) -> float | None:
+        # Shared state lives in Redis; estimate from local concurrency only
+        return None
+
+    async def pause(self, seconds: float):
+        try:
+            await self._pause(keys=self._keys, args=[seconds])
+        except Exception as e:
+            logger.warning(f"LLM gate Redis pause failed: {str(e)}")
+
+class Ticket:
+    """A caller's place in the LLM queue; becomes a lease once granted"""
+
+    def __init__(self, gate: "LLMGate", priority: Priority, tokens: int, deadline: float):
+        self.gate = gate
+        self.priority = priority
+        self.tokens = tokens
+        self.deadline = deadline
+        self.lease_id = uuid.uuid4().hex
+        self.granted = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+        self.started = None
+        self.done = False
+
+    @property
+    def waiting(self) -> bool:
+        return not self.done and not self.granted.done()
+
+    @property
+    def position(self) -> int:
+        """1-based place in line; 0 once granted"""
+        return self.gate._position(self) if self.waiting else 0
+
+    async def wait(self, timeout: float | None = None) -> bool:
+        """
+        Wait up to `timeout` seconds for the slot.
+
+        Returns True once granted and False if still queued, so callers can
+        report the position in between. Raises LLMBusyError at the deadline.
+        """
+        while True:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0 and self.waiting:
+                position = self.position
+                self.gate._abandon(self)
+                raise LLMBusyError(position, self.gate._retry_after(position - 1))
+            step = remaining if timeout is None else min(timeout, remaining)
+            try:
+                await asyncio.wait_for(asyncio.shield(self.granted), max(step, 0))
+                return True
+            except asyncio.TimeoutError:
+                if timeout is not None and time.monotonic() < self.deadline:
+                    return False
+            except asyncio.CancelledError:
+                # Client went away while queued (or just as it was admitted,
+                # before making the call)
+                await self.release(used=False)
+                raise
+
+    async def release(self, actual_tokens: int | None = None, used: bool = True):
+        """
+        Free the slot, settling the token estimate with Groq's reported
+        usage. A slot that was never `used` for a call refunds its request
+        and tokens.
+        """
+        if self.done:
+            return
+        if not self.granted.done():
+            self.gate._abandon(self)
+            return
+        self.done = True
+        if not used:
+            await self.gate._release(self, -self.tokens, refund_request=True)
+            return
+        delta = 0 if actual_tokens is None else actual_tokens - self.tokens
+        await self.gate._release(self, delta)
+
+class LLMGate:
+    """
+    Admission control in front of Groq.
+
+    Callers queue by priority, then arrival. A slot is granted when fewer
+    than `max_concurrency` calls are running here and the RPM/TPM quota has
+    room, so bursts wait their turn instead of turning into rate-limit
+    errors. A caller is rejected up front when the queue is full or its
+    estimated wait exceeds its deadline.
+    """
+
+    def __init__(self, limiter, max_concurrency: int, queue_size: int):
+        self.limiter = limiter
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self._queue = []  # heap of (priority, seq, ticket)
+        self._seq = itertools.count()
+        self._active = 0
+        self._pump_task = None
+        self._wakeup = asyncio.Event()
+        # Smoothed slot hold time, for wait estimates
+        self._service_time = 2.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _waiting(self) -> list:
+        return [t for _, _, t in sorted(self._queue) if t.waiting]
+
+    def _position(self, ticket: Ticket) -> int:
+        for i, t in enumerate(self._waiting(), start=1):
+            if t is ticket:
+                return i
+        return 0
+
+    def _eta(self, ahead: int) -> float:
+        """Rough seconds until a caller with `ahead` calls queued before it gets a slot"""
+        # Full rounds of running calls that must finish first
+        rounds = (self._active + ahead) // self.max_concurrency
+        by_slots = rounds * self._service_time
+        by_quota = 0.0
+        available = self.limiter.requests_available()
+        if GROQ_RPM and available is not None:
+            by_quota = max(0.0, ahead + 1 - available) * 60 / GROQ_RPM
+        return max(by_slots, by_quota)
+
+    def _retry_after(self, ahead: int) -> int:
+        return max(1, math.ceil(self._eta(ahead)))
+
+    async def enqueue(self, priority: Priority, tokens: int, timeout: float) -> Ticket:
+        """Join the queue or raise LLMBusyError if there is no realistic chance in time"""
+        waiting = self._waiting()
+        ahead = sum(1 for t in waiting if t.priority <= priority)
+        # Tickets about to take a free slot are not really queued
+        free_slots = max(self.max_concurrency - self._active, 0)
+        if len(waiting) - free_slots >= self.queue_size:
+            self._reject("full")
+            raise LLMBusyError(ahead + 1, self._retry_after(ahead))
+        if self._eta(ahead) > timeout:
+            self._reject("deadline")
+            raise LLMBusyError(ahead + 1, self._retry_after(ahead))
+        ticket = Ticket(self, priority, tokens, time.monotonic() + timeout)
+        heapq.heappush(self._queue, (priority, next(self._seq), ticket))
+        self._kick()
+        # Give the pump one pass so an idle gate grants immediately
+        await asyncio.sleep(0)
+        return ticket
+
+    async def acquire(self, priority: Priority, tokens: int, timeout: float = LLM_QUEUE_TIMEOUT) -> Ticket:
+        """Queue and wait for a slot; the caller must `release()` the ticket"""
+        ticket = await self.enqueue(priority, tokens, timeout)
+        await ticket.wait()
+        return ticket
+
+    async def pause(self, seconds: float):
+        """Stop granting slots for a while, e.g. when Groq answers 429 with retry-after"""
+        logger.warning(f"Groq rate limit hit, pausing LLM calls for {seconds:.1f}s")
+        await self.limiter.pause(seconds)
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "queued": len(self._waiting()),
+            "max_concurrency": self.max_concurrency,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_service_seconds": round(self._service_time, 2),
+        }
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        LLM_REJECTIONS.labels(reason).inc()
+
+    def _abandon(self, ticket: Ticket):
+        """Take a still-queued ticket out of line"""
+        ticket.done = True
+        ticket.granted.cancel()
+        if time.monotonic() >= ticket.deadline:
+            self.timed_out += 1
+            LLM_REJECTIONS.labels("timeout").inc()
+        self._kick()
+
+    async def _release(self, ticket: Ticket, token_delta: int, refund_request: bool = False):
+        self._active -= 1
+        held = time.monotonic() - ticket.started
+        self._service_time = 0.8 * self._service_time + 0.2 * held
+        self._kick()
+        await self.limiter.release(ticket.lease_id, token_delta, refund_request)
+
+    def _kick(self):
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+
+    async def _pump(self):
+        """Grant slots in queue order while capacity and quota allow"""
+        while True:
+            self._wakeup.clear()
+            # Drop granted tickets and those whose callers gave up
+            while self._queue and not self._queue[0][2].waiting:
+                heapq.heappop(self._queue)
+            if not self._queue:
+                return
+            if self._active >= self.max_concurrency:
+                await self._wakeup.wait()
+                continue
+            ticket = self._queue[0][2]
+            wait = await self.limiter.acquire(ticket.tokens, ticket.lease_id)
+            if wait > 0:
+                # Sleep for the quota, but wake early if the queue changes
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), min(wait, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if ticket.waiting:
+                # Granted even if a higher priority call arrived meanwhile:
+                # the quota is already taken for this one
+                self._active += 1
+                self.admitted += 1
+                ticket.started = time.monotonic()
+                LLM_QUEUE_WAIT.labels(ticket.priority.name.lower()).observe(ticket.started - ticket.queued_at)
+                ticket.granted.set_result(True)
+            else:
+                # Caller gave up while the quota was checked; hand back
+                # both the request and the tokens
+                await self.limiter.release(ticket.lease_id, -ticket.tokens, refund_request=True)
+
+def _create_gate() -> LLMGate:
+    if LLM_GATE_BACKEND == "redis":
+        limiter = RedisLimiter(LLM_GATE_URL, GROQ_RPM, GROQ_TPM, LLM_GLOBAL_CONCURRENCY)
+    else:
+        limiter = MemoryLimiter(GROQ_RPM, GROQ_TPM)
+    logger.info(
+        f"LLM gate: {LLM_GATE_BACKEND}, {LLM_MAX_CONCURRENCY} concurrent, "
+        f"queue {LLM_QUEUE_SIZE}, {GROQ_RPM} RPM / {GROQ_TPM} TPM"
+    )
+    return LLMGate(limiter, LLM_MAX_CONCURRENCY, LLM_QUEUE_SIZE)
+
+_gate = None
+
+def get_llm_gate() -> LLMGate:
+    """The process's gate, created on first use rather than at import"""
+    global _gate
+    if _gate is None:
+        _gate = _create_gate()
+    return _gate
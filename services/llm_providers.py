@@ -0,0 +1,232 @@
+"""
+Chat-completion providers behind one small interface.
+
+GroqProvider talks to Groq, or to anything serving its API at GROQ_BASE_URL
+such as benchmarks/fake_groq.py. StubProvider answers in-process and
+deterministically, so tests and benchmarks need no network or API key.
+LLM_PROVIDER picks one.
+
+A provider has `complete(model, messages, **params) -> Completion`,
+`open_stream(model, messages, **params) -> CompletionStream`,
+`retry_after(error)`, `warmup()` and `close()`. Retries, queueing and
+metrics are the caller's job (services/ai_services.py). The provider is
+created on first use (get_provider), not at import.
+"""
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from services.llm_gate import LLM_MAX_CONCURRENCY
+import asyncio
+import hashlib
+import json
+import os
+from typing import AsyncIterator
+
+load_dotenv()
+
+# "groq" or "stub"
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")
+
+# Keep-alive pool sized to the LLM gate, so admitted calls reuse warm TLS
+# connections instead of handshaking per request
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", str(LLM_MAX_CONCURRENCY + 4)))
+GROQ_KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "60"))
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "60"))
+
+# Seconds a stub reply takes, spread over its words when streamed
+LLM_STUB_LATENCY = float(os.getenv("LLM_STUB_LATENCY", "0"))
+
+@dataclass
+class Usage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+
+@dataclass
+class Completion:
+    text: str
+    finish_reason: str | None = None   # "stop", or "length" when cut off by max_tokens
+    usage: Usage | None = None
+
+class CompletionStream(ABC):
+    """
+    Content deltas of one streamed completion.
+
+    `usage` and `finish_reason` are filled in as the provider reports them,
+    normally with the last chunk. close() stops generation.
+    """
+    usage: Usage | None = None
+    finish_reason: str | None = None
+
+    def __init__(self):
+        self._deltas = None
+
+    def __aiter__(self):
+        if self._deltas is None:
+            self._deltas = self._iterate()
+        return self._deltas
+
+    @abstractmethod
+    def _iterate(self) -> AsyncIterator[str]:
+        """The provider's deltas, as an async generator"""
+
+    async def close(self):
+        if self._deltas is not None:
+            await self._deltas.aclose()
+
+def _usage(usage) -> Usage | None:
+    if usage is None:
+        return None
+    return Usage(usage.prompt_tokens or 0, usage.completion_tokens or 0, usage.total_tokens or 0)
+
+class GroqStream(CompletionStream):
+    def __init__(self, stream):
+        super().__init__()
+        self._stream = stream
+
+    async def _iterate(self):
+        async for chunk in self._stream:
+            # Groq reports usage on the final chunk
+            x_groq = getattr(chunk, "x_groq", None)
+            if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                self.usage = _usage(x_groq.usage)
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                self.finish_reason = choice.finish_reason
+            if choice.delta.content:
+                yield choice.delta.content
+
+    async def close(self):
+        await super().close()
+        # Closing the HTTP response stops generation when the client goes away
+        await self._stream.close()
+
+class GroqProvider:
+    """Groq's chat-completions API; the SDK does no retries of its own"""
+    name = "groq"
+
+    def __init__(self, api_key: str | None):
+        from groq import AsyncGroq
+        import httpx
+
+        self._client = AsyncGroq(
+            api_key=api_key,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=GROQ_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_CONCURRENCY,
+                    keepalive_expiry=GROQ_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(GROQ_TIMEOUT, connect=5.0)
+            )
+        )
+
+    async def complete(self, model: str, messages: list, **params) -> Completion:
+        response = await self._client.chat.completions.create(messages=messages, model=model, **params)
+        choice = response.choices[0]
+        return Completion(choice.message.content or "", choice.finish_reason, _usage(response.usage))
+
+    async def open_stream(self, model: str, messages: list, **params) -> CompletionStream:
+        stream = await self._client.chat.completions.create(
+            messages=messages, model=model, stream=True, **params
+        )
+        return GroqStream(stream)
+
+    async def warmup(self):
+        """
+        Open a keep-alive connection (DNS, TCP, TLS) with a free request, so
+        the first reply does not pay for the handshake.
+        """
+        from groq import APIStatusError
+
+        try:
+            await self._client.models.list()
+        except APIStatusError:
+            # Any HTTP answer means the connection is up
+            pass
+
+    def retry_after(self, error: Exception) -> float | None:
+        """Seconds Groq asked us to back off for, if `error` is a rate limit"""
+        from groq import RateLimitError
+
+        if not isinstance(error, RateLimitError):
+            return None
+        try:
+            return float(error.response.headers.get("retry-after", "2"))
+        except ValueError:
+            return 2.0
+
+    async def close(self):
+        await self._client.close()
+
+class StubStream(CompletionStream):
+    def __init__(self, completion: Completion, latency: float):
+        super().__init__()
+        self._completion = completion
+        self._latency = latency
+
+    async def _iterate(self):
+        words = self._completion.text.split(" ")
+        for i, word in enumerate(words):
+            if self._latency:
+                await asyncio.sleep(self._latency / len(words))
+            yield word if i == 0 else " " + word
+        self.usage = self._completion.usage
+        self.finish_reason = self._completion.finish_reason
+
+class StubProvider:
+    """
+    Local replies that depend only on the model and messages, so the same
+    conversation always gets the same answer. The reply quotes the last
+    user message and names the model, which makes routing visible in tests.
+    """
+    name = "stub"
+
+    def __init__(self, latency: float):
+        self._latency = latency
+
+    def _reply(self, model: str, messages: list) -> Completion:
+        question = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        digest = hashlib.sha256(json.dumps([model, messages], ensure_ascii=False).encode()).hexdigest()[:8]
+        text = f"[{model}] Here is how to do that: {' '.join(question.split())[:200]} (ref {digest})"
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        completion_tokens = len(text) // 4
+        return Completion(text, "stop", Usage(prompt_tokens, completion_tokens, prompt_tokens + completion_tokens))
+
+    async def complete(self, model: str, messages: list, **params) -> Completion:
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        return self._reply(model, messages)
+
+    async def open_stream(self, model: str, messages: list, **params) -> CompletionStream:
+        return StubStream(self._reply(model, messages), self._latency)
+
+    def retry_after(self, error: Exception) -> float | None:
+        return None
+
+    async def warmup(self):
+        pass
+
+    async def close(self):
+        pass
+
+def _create_provider():
+    if LLM_PROVIDER == "stub":
+        return StubProvider(LLM_STUB_LATENCY)
+    return GroqProvider(os.getenv("GROQ_API_KEY"))
+
+_provider = None
+
+def get_provider():
+    """The process's provider; GroqProvider builds its HTTP client on first use"""
+    global _provider
+    if _provider is None:
+        _provider = _create_provider()
+    return _provider
+
+async def close_provider():
+    if _provider is not None:
+        await _provider.close()
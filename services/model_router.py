@@ -0,0 +1,109 @@
+"""
+Model cascade: routine questions go to a small, fast model, hard ones to the large one.
+
+A reply goes to the large model when the question is long, comes after a
+few turns or a summary, reads like a problem report, or matches the guide
+for one of ROUTE_LARGE_TOPICS. Anything else, like "how do I add credits",
+starts on the small model. If a small model's full answer looks unsure,
+the caller asks the large model instead. Unsure means it hedges, hands off
+to support, or was cut off by max_tokens. A streamed answer is already on
+the user's screen, so it is only counted.
+"""
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from services.knowledge_base import knowledge_base
+import json
+import os
+import re
+
+load_dotenv()
+
+# "cascade", or "off" to send everything to LLM_MODEL_LARGE
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "cascade")
+LLM_MODEL_LARGE = os.getenv("LLM_MODEL_LARGE", "llama-3.3-70b-versatile")
+LLM_MODEL_SMALL = os.getenv("LLM_MODEL_SMALL", "llama-3.1-8b-instant")
+# Questions longer than this many tokens go to the large model
+ROUTE_SMALL_MAX_TOKENS = int(os.getenv("ROUTE_SMALL_MAX_TOKENS", "40"))
+# So do questions after this many earlier user turns, or once a summary exists
+ROUTE_SMALL_MAX_TURNS = int(os.getenv("ROUTE_SMALL_MAX_TURNS", "2"))
+# Knowledge base guides (file names) whose questions always get the large model
+ROUTE_LARGE_TOPICS = frozenset(
+    t.strip() for t in os.getenv("ROUTE_LARGE_TOPICS", "troubleshooting,safety").split(",") if t.strip()
+)
+
+# USD per million (input, output) tokens, for the cost metric. LLM_PRICES
+# adds or overrides models as JSON: {"model": [input, output]}
+LLM_PRICES = {
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+    **{model: tuple(prices) for model, prices in json.loads(os.getenv("LLM_PRICES", "{}")).items()}
+}
+
+# Problem reports and account trouble, in English and Bengali
+_PROBLEM = re.compile(
+    r"not work|doesn'?t work|won'?t|can'?t|cannot|error|fail|crash|bug|broken|stuck|"
+    r"hack|stolen|scam|fraud|dispute|refund|charged|missing|lost|blocked|banned|"
+    r"কাজ করছে না|সমস্যা|ত্রুটি|হ্যাক|প্রতারণা|আটকে",
+    re.IGNORECASE
+)
+_HEDGING = re.compile(
+    r"i'?m not sure|i am not sure|i don'?t know|not certain|i can'?t help with that|unable to help|"
+    r"নিশ্চিত নই|জানি না",
+    re.IGNORECASE
+)
+# Only an explicit referral counts: the prompt has the model give the
+# contact address in routine answers too
+_HANDOFF = re.compile(r"contact (our )?support", re.IGNORECASE)
+
+@dataclass(frozen=True)
+class Route:
+    model: str
+    tier: str     # "small" or "large"
+    reason: str   # why, for the routing metric
+
+def choose_model(messages_history: list, summary: str | None = None) -> Route:
+    """Pick the model for the reply to the last user message in `messages_history`"""
+    from services.context import count_tokens
+
+    if MODEL_ROUTING == "off":
+        return Route(LLM_MODEL_LARGE, "large", "routing_off")
+    user_turns = [m.content for m in messages_history if m.sender == "user"]
+    question = user_turns[-1] if user_turns else ""
+    if count_tokens(question) > ROUTE_SMALL_MAX_TOKENS:
+        return Route(LLM_MODEL_LARGE, "large", "length")
+    if summary or len(user_turns) > ROUTE_SMALL_MAX_TURNS + 1:
+        return Route(LLM_MODEL_LARGE, "large", "context")
+    if _PROBLEM.search(question):
+        return Route(LLM_MODEL_LARGE, "large", "intent")
+    sections = knowledge_base.search(question, k=1)
+    if sections and sections[0].name in ROUTE_LARGE_TOPICS:
+        return Route(LLM_MODEL_LARGE, "large", "topic")
+    return Route(LLM_MODEL_SMALL, "small", "routine")
+
+def unsure_signal(text: str, finish_reason: str | None) -> str | None:
+    """Why a small-model answer should not be trusted, or None if it looks fine"""
+    if finish_reason == "length":
+        return "truncated"
+    if _HEDGING.search(text):
+        return "hedging"
+    if _HANDOFF.search(text):
+        return "handoff"
+    return None
+
+def routing_fingerprint() -> list:
+    """Settings that change which model answers a question, for cache keys"""
+    return [MODEL_ROUTING, LLM_MODEL_SMALL, LLM_MODEL_LARGE, ROUTE_SMALL_MAX_TOKENS, sorted(ROUTE_LARGE_TOPICS)]
+
+def cost_usd(model: str, usage) -> float:
+    """Estimated spend for one call's usage; 0 for models without a price"""
+    prices = LLM_PRICES.get(model)
+    if usage is None or prices is None:
+        return 0.0
+    return (usage.prompt_tokens * prices[0] + usage.completion_tokens * prices[1]) / 1_000_000
+
+def routing_stats() -> dict:
+    return {
+        "routing": MODEL_ROUTING,
+        "small": LLM_MODEL_SMALL,
+        "large": LLM_MODEL_LARGE
+    }
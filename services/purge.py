@@ -0,0 +1,173 @@
+"""
+Conversation deletion: hidden at once, removed in the background.
+
+Deleting conversations only stamps their deleted_at, which every read path
+filters on. The request is one short UPDATE however long the threads are.
+The purger then removes each deleted conversation's messages in batches of
+PURGE_BATCH_SIZE, one short transaction per batch, and finally the row
+itself; ON DELETE CASCADE takes anything written to it in the meantime.
+Every step is an idempotent DELETE, so any number of processes can purge
+at once.
+"""
+from dotenv import load_dotenv
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import Conversation, GenerationJob, Message, SessionLocal, utcnow
+from services.hub import get_conversation_hub
+from services.jobs import PENDING
+from utils.metrics import PURGE_FAILURES, PURGED_ROWS
+import asyncio
+import logging
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Seconds between purge passes in each API process (0 = never purge here);
+# deleting conversations in the same process starts a pass at once
+PURGE_INTERVAL = float(os.getenv("PURGE_INTERVAL", "30"))
+# Messages removed per transaction
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "1000"))
+# Pause between batches, so purging a huge thread yields to live traffic
+PURGE_BATCH_PAUSE = float(os.getenv("PURGE_BATCH_PAUSE", "0.05"))
+# Deleted conversations picked up per pass
+PURGE_CONVERSATIONS_PER_PASS = 100
+
+async def soft_delete_conversations(db: AsyncSession, user_id: int, conv_ids: list[int] | None = None) -> list[int]:
+    """
+    Hide the user's conversations, all of them when `conv_ids` is None, and
+    drop their pending reply jobs; a worker already generating one finds its
+    job gone and discards the reply. Returns the ids actually deleted, which
+    excludes ids the user does not own or had already deleted.
+    """
+    query = update(Conversation).where(Conversation.user_id == user_id, Conversation.deleted_at.is_(None))
+    if conv_ids is not None:
+        query = query.where(Conversation.id.in_(conv_ids))
+    try:
+        result = await db.execute(
+            query.values(deleted_at=utcnow())
+            .returning(Conversation.id)
+            .execution_options(synchronize_session=False)
+        )
+        deleted = list(result.scalars().all())
+        if deleted:
+            await db.execute(delete(GenerationJob).where(
+                GenerationJob.conversation_id.in_(deleted),
+                GenerationJob.status.in_(PENDING)
+            ))
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+    # Open WebSocket connections to them are closed
+    for conv_id in deleted:
+        await get_conversation_hub().publish(conv_id, {"type": "deleted"})
+    if deleted:
+        conversation_purger.wake()
+    return deleted
+
+async def purge_conversation(conv_id: int) -> int:
+    """Remove a deleted conversation and everything in it; returns the messages removed"""
+    async with SessionLocal() as db:
+        # Jobs point at messages, so they go first
+        await db.execute(delete(GenerationJob).where(GenerationJob.conversation_id == conv_id))
+        await db.commit()
+
+    removed = 0
+    while True:
+        async with SessionLocal() as db:
+            batch = select(Message.id).where(Message.conversation_id == conv_id).limit(PURGE_BATCH_SIZE)
+            result = await db.execute(delete(Message).where(Message.id.in_(batch)))
+            await db.commit()
+        removed += result.rowcount
+        if result.rowcount < PURGE_BATCH_SIZE:
+            break
+        await asyncio.sleep(PURGE_BATCH_PAUSE)
+
+    async with SessionLocal() as db:
+        result = await db.execute(delete(Conversation).where(
+            Conversation.id == conv_id,
+            Conversation.deleted_at.is_not(None)
+        ))
+        await db.commit()
+    PURGED_ROWS.labels("messages").inc(removed)
+    PURGED_ROWS.labels("conversations").inc(result.rowcount)
+    return removed
+
+async def purge_deleted(stopping=lambda: False) -> int:
+    """
+    One pass over the oldest deleted conversations; returns how many were
+    purged. A conversation that fails to purge is left for the next pass,
+    so it cannot hold up the rest.
+    """
+    async with SessionLocal() as db:
+        result = await db.execute(
+            select(Conversation.id)
+            .where(Conversation.deleted_at.is_not(None))
+            .order_by(Conversation.deleted_at)
+            .limit(PURGE_CONVERSATIONS_PER_PASS)
+        )
+        conv_ids = result.scalars().all()
+        await db.commit()
+    purged = 0
+    for conv_id in conv_ids:
+        if stopping():
+            return 0
+        try:
+            removed = await purge_conversation(conv_id)
+        except Exception as e:
+            PURGE_FAILURES.inc()
+            logger.error(f"Failed to purge conversation {conv_id}: {str(e)}")
+            continue
+        purged += 1
+        logger.info(f"Purged conversation {conv_id} ({removed} messages)")
+    return purged
+
+class ConversationPurger:
+    """Background task running purge passes until stopped"""
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self._wake = asyncio.Event()
+        self._stopping = False
+
+    def start(self, interval: float):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(interval))
+        logger.info(f"Started conversation purger (every {interval:g}s)")
+
+    def wake(self):
+        self._wake.set()
+
+    async def stop(self, grace: float = 5.0):
+        """
+        Let the conversation being purged finish for up to `grace` seconds,
+        then cancel; whatever is left is picked up by the next pass.
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        _, pending = await asyncio.wait([self._task], timeout=grace)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self, interval: float):
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                # A full pass may have left more behind
+                while await purge_deleted(lambda: self._stopping) == PURGE_CONVERSATIONS_PER_PASS:
+                    pass
+            except Exception as e:
+                logger.error(f"Conversation purge failed: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+conversation_purger = ConversationPurger()
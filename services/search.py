@@ -0,0 +1,159 @@
+"""
+Full-text search over a user's messages.
+
+PostgreSQL matches and ranks with the chat_search text search
+configuration: English stemming and stop words for ASCII words, other
+scripts such as Bengali indexed as they are, lower-cased. A GIN index on
+to_tsvector('chat_search', content) serves the match and is kept current
+by Postgres on every write. SQLite uses the FTS5 table messages_fts,
+kept in step with messages by triggers. Either way the match is limited
+to the user's conversations before it is ranked, so a common word costs
+what the user's own history holds rather than the whole table.
+
+Archived conversations (services.archive) have one search document each in
+conversation_archive_search. Matching ones are rehydrated by the first
+page of a search, so their messages are found like any other.
+
+Both are created by migrations (0005, 0006); the statements here are
+written per dialect because neither index is expressible in the ORM.
+"""
+from dotenv import load_dotenv
+from sqlalchemy import DateTime, text
+from sqlalchemy.ext.asyncio import AsyncSession
+import html
+import os
+
+load_dotenv()
+
+SEARCH_CONFIG = "chat_search"
+DEFAULT_SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 50
+# Deepest result reachable by paging; ranked pages are offsets
+MAX_SEARCH_OFFSET = 500
+# Matching archived conversations restored by one search (0 = archives are not searched)
+SEARCH_REHYDRATE_LIMIT = int(os.getenv("SEARCH_REHYDRATE_LIMIT", "5"))
+
+# Matches are wrapped in these in a hit's snippet; the rest is the message
+# text, HTML-escaped
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+SNIPPET_WORDS = 16
+# The database marks matches with these control characters; highlight()
+# turns them into tags only after escaping the text around them
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+
+def highlight(snippet: str) -> str:
+    """A snippet as HTML: the message text escaped, matches wrapped in HIGHLIGHT_START/END"""
+    escaped = html.escape(snippet)
+    return escaped.replace(_MATCH_START, HIGHLIGHT_START).replace(_MATCH_END, HIGHLIGHT_END)
+
+def fts5_query(query: str) -> str:
+    """
+    FTS5 MATCH expression for user input: every word must occur. Words are
+    quoted, so FTS5 operators and punctuation in the input are plain text.
+    """
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+def search_statement(dialect: str, user_id: int, query: str, limit: int, offset: int):
+    """Best matches first among the user's live conversations"""
+    if dialect == "postgresql":
+        # Only the user's messages are matched and ranked, reached through
+        # their conversation ids; snippets only for the page
+        return text(f"""
+            SELECT m.id, m.conversation_id, c.title, m.sender, m.created_at,
+                   ts_headline('{SEARCH_CONFIG}'::regconfig, m.content, hits.query, :headline) AS snippet
+            FROM (
+                SELECT m.id, q.query,
+                       ts_rank_cd(to_tsvector('{SEARCH_CONFIG}'::regconfig, m.content), q.query) AS rank
+                FROM messages m,
+                     websearch_to_tsquery('{SEARCH_CONFIG}'::regconfig, :query) AS q(query)
+                WHERE m.conversation_id = ANY(ARRAY(
+                        SELECT c.id FROM conversations c WHERE c.user_id = :user_id AND c.deleted_at IS NULL
+                      ))
+                  AND to_tsvector('{SEARCH_CONFIG}'::regconfig, m.content) @@ q.query
+                ORDER BY rank DESC, m.id DESC
+                LIMIT :limit OFFSET :offset
+            ) hits
+            JOIN messages m ON m.id = hits.id
+            JOIN conversations c ON c.id = m.conversation_id
+            ORDER BY hits.rank DESC, m.id DESC
+        """).bindparams(
+            user_id=user_id, query=query, limit=limit, offset=offset,
+            headline=(
+                f'StartSel="{_MATCH_START}", StopSel="{_MATCH_END}", '
+                f"MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}, MaxFragments=2"
+            )
+        ).columns(created_at=DateTime(timezone=True))
+    # messages_fts also indexes conversation_id: the MATCH is limited to the
+    # user's conversations, so FTS5 ranks only their messages. Column weight
+    # 0 keeps the conversation terms out of the score; a user without
+    # conversations matches conversation 0, which never exists
+    return text(f"""
+        SELECT m.id, m.conversation_id, c.title, m.sender, m.created_at,
+               snippet(messages_fts, 0, :match_start, :match_end, '…', {SNIPPET_WORDS}) AS snippet
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        JOIN conversations c ON c.id = m.conversation_id
+        WHERE messages_fts MATCH (
+            SELECT 'conversation_id : (' || coalesce(group_concat(id, ' OR '), '0') || ') AND content : (' || :query || ')'
+            FROM conversations
+            WHERE user_id = :user_id AND deleted_at IS NULL
+        )
+        ORDER BY bm25(messages_fts, 1.0, 0.0), m.id DESC
+        LIMIT :limit OFFSET :offset
+    """).bindparams(
+        user_id=user_id, query=fts5_query(query), limit=limit, offset=offset,
+        match_start=_MATCH_START, match_end=_MATCH_END
+    ).columns(created_at=DateTime(timezone=True))
+
+def archived_statement(dialect: str, user_id: int, query: str, limit: int):
+    """The user's most recently active archived conversations that match"""
+    if dialect == "postgresql":
+        match = (
+            "JOIN conversations c ON c.id = s.conversation_id "
+            f"WHERE s.document @@ websearch_to_tsquery('{SEARCH_CONFIG}'::regconfig, :query)"
+        )
+    else:
+        query = fts5_query(query)
+        match = "JOIN conversations c ON c.id = s.rowid WHERE conversation_archive_search MATCH :query"
+    return text(f"""
+        SELECT c.id FROM conversation_archive_search s {match}
+          AND c.user_id = :user_id AND c.deleted_at IS NULL AND c.archived_at IS NOT NULL
+        ORDER BY c.updated_at DESC
+        LIMIT :limit
+    """).bindparams(user_id=user_id, query=query, limit=limit)
+
+def _dialect(db: AsyncSession) -> str:
+    return db.get_bind().dialect.name
+
+async def search_messages(db: AsyncSession, user_id: int, query: str, limit: int, offset: int) -> list:
+    """
+    One page of hits: (id, conversation_id, title, sender, created_at,
+    snippet) rows. Snippets are raw text with marked matches; pass them
+    through highlight() before handing them to a client.
+    """
+    if not query.split():
+        return []
+    result = await db.execute(search_statement(_dialect(db), user_id, query, limit, offset))
+    return result.all()
+
+async def find_archived(db: AsyncSession, user_id: int, query: str, limit: int) -> list[int]:
+    """Ids of archived conversations of the user matching `query`"""
+    if limit <= 0 or not query.split():
+        return []
+    result = await db.execute(archived_statement(_dialect(db), user_id, query, limit))
+    return list(result.scalars().all())
+
+async def index_archived(db: AsyncSession, conv_id: int, content: str):
+    """Add the search document of a conversation being archived, in the caller's transaction"""
+    if _dialect(db) == "postgresql":
+        # Positions are dropped: this only picks conversations to rehydrate,
+        # and it keeps long threads well under the tsvector size limit
+        statement = text(
+            "INSERT INTO conversation_archive_search (conversation_id, document) "
+            f"VALUES (:conv_id, strip(to_tsvector('{SEARCH_CONFIG}'::regconfig, :content)))"
+        )
+    else:
+        statement = text("INSERT INTO conversation_archive_search (rowid, content) VALUES (:conv_id, :content)")
+    await db.execute(statement, {"conv_id": conv_id, "content": content})
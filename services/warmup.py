@@ -0,0 +1,121 @@
+"""
+Startup warmup and readiness.
+
+Importing the app creates nothing; the engine, the LLM client, the LLM
+gate, the answer cache, the chat hub and the password context are built on
+first use. Warmup runs in the background
+right after startup so the first real requests do not pay for that:
+
+- opens WARMUP_DB_CONNECTIONS pool connections
+- opens a keep-alive connection to the LLM provider
+- builds the knowledge base index
+- loads the bcrypt backend
+
+/health answers as soon as the worker is up. /ready answers 503 until
+warmup has finished, and again once shutdown starts, so a load balancer or
+rolling deploy only sends traffic to warm workers. A failed step is logged
+and reported but does not hold readiness back; the request path creates
+whatever is missing on demand.
+"""
+from contextlib import AsyncExitStack
+from dotenv import load_dotenv
+from database import DB_POOL_MODE, DB_POOL_SIZE, get_engine
+from services.knowledge_base import knowledge_base
+from services.llm_providers import get_provider
+from utils.security import warm_password_hashing
+import asyncio
+import logging
+import os
+import time
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Pool connections opened up front (0 = none); kept idle in the pool afterwards
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", str(min(DB_POOL_SIZE, 4))))
+WARMUP_LLM = os.getenv("WARMUP_LLM", "true").lower() in ("1", "true", "yes")
+# Seconds each step may take
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "30"))
+# Seconds /ready waits for the database to answer
+READY_DB_TIMEOUT = float(os.getenv("READY_DB_TIMEOUT", "2"))
+
+async def _open_db_connections(count: int):
+    """Open `count` connections at once, so the pool keeps that many"""
+    async with AsyncExitStack() as stack:
+        connections = await asyncio.gather(*(
+            stack.enter_async_context(get_engine().connect()) for _ in range(count)
+        ))
+        await asyncio.gather(*(conn.exec_driver_sql("SELECT 1") for conn in connections))
+
+async def _ping_database():
+    async with get_engine().connect() as conn:
+        await conn.exec_driver_sql("SELECT 1")
+
+class Warmup:
+    """Background warmup task; its progress is the worker's readiness"""
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self._done = asyncio.Event()
+        self.steps = {}
+        self.stopping = False
+
+    def _steps(self) -> dict:
+        steps = {"knowledge_base": lambda: asyncio.to_thread(knowledge_base.load)}
+        # With pgbouncer transaction pooling nothing is pooled in-process
+        if WARMUP_DB_CONNECTIONS > 0 and DB_POOL_MODE != "transaction":
+            steps["db"] = lambda: _open_db_connections(WARMUP_DB_CONNECTIONS)
+        if WARMUP_LLM:
+            steps["llm"] = lambda: get_provider().warmup()
+        steps["password_hashing"] = warm_password_hashing
+        return steps
+
+    def start(self):
+        self.stopping = False
+        self.steps = {}
+        self._done = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def wait(self):
+        await self._done.wait()
+
+    async def stop(self):
+        """Mark the worker not ready (shutdown has begun) and cancel a warmup still running"""
+        self.stopping = True
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _step(self, name: str, step):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(), WARMUP_TIMEOUT)
+            self.steps[name] = {"ok": True}
+        except Exception as e:
+            logger.warning(f"Warmup step {name} failed: {type(e).__name__}: {str(e)}")
+            self.steps[name] = {"ok": False, "error": type(e).__name__}
+        self.steps[name]["ms"] = round(1000 * (time.perf_counter() - start), 1)
+
+    async def _run(self):
+        start = time.perf_counter()
+        await asyncio.gather(*(self._step(name, step) for name, step in self._steps().items()))
+        self._done.set()
+        logger.info(f"Warmup finished in {time.perf_counter() - start:.2f}s: {self.steps}")
+
+    async def readiness(self) -> tuple[bool, dict]:
+        """(ready, report) for /ready"""
+        if self.stopping:
+            return False, {"status": "stopping"}
+        if not self._done.is_set():
+            return False, {"status": "warming_up", "warmup": self.steps}
+        try:
+            await asyncio.wait_for(_ping_database(), READY_DB_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Readiness check: database unavailable: {type(e).__name__}")
+            return False, {"status": "database_unavailable", "warmup": self.steps}
+        return True, {"status": "ready", "warmup": self.steps}
+
+warmup = Warmup()
@@ -0,0 +1,68 @@
+"""
+Test settings. The app reads its configuration at import time, so the
+environment is set here, before any test imports it: a throwaway SQLite
+database, the in-process stub LLM provider and no Redis.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_DB_DIR = tempfile.mkdtemp(prefix="chatbot-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_DB_DIR}/test.db",
+    "SECRET_KEY": "test-secret-key",
+    "GROQ_API_KEY": "test",
+    "LLM_PROVIDER": "stub",
+    "LLM_STUB_LATENCY": "0",
+    "ANSWER_CACHE_BACKEND": "off",
+    "LLM_GATE_BACKEND": "memory",
+    "CHAT_HUB_BACKEND": "memory",
+})
+
+import asyncio
+import pytest
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture(scope="session")
+def migrated_db():
+    """The shared test database, migrated to the latest revision"""
+    from database import dispose_engine, upgrade_schema
+
+    async def upgrade():
+        await upgrade_schema()
+        await dispose_engine()
+
+    asyncio.run(upgrade())
+
+@pytest.fixture
+async def db(migrated_db):
+    """A session on the test database; the pool is closed after each test's event loop"""
+    from database import SessionLocal, dispose_engine
+
+    async with SessionLocal() as session:
+        yield session
+    await dispose_engine()
+
+@pytest.fixture
+async def user(db):
+    from database import User
+
+    user = User(username=f"user-{os.urandom(4).hex()}", hashed_password="x")
+    db.add(user)
+    await db.commit()
+    return user
+
+@pytest.fixture
+async def conversation(db, user):
+    from database import Conversation
+
+    conv = Conversation(user_id=user.id, title="New Conversation")
+    db.add(conv)
+    await db.commit()
+    return conv
@@ -0,0 +1,67 @@
+"""FAQ answer cache: keys, eviction, failing open, and answering repeated first questions"""
+import pytest
+
+from database import Message
+from services import ai_services, answer_cache
+from services.answer_cache import AnswerCache, MemoryAnswerBackend
+from services.llm_providers import StubProvider
+
+pytestmark = pytest.mark.anyio
+
+class BrokenBackend:
+    async def get(self, key):
+        raise ConnectionError("cache down")
+
+    async def set(self, key, value):
+        raise ConnectionError("cache down")
+
+    def size(self):
+        return None
+
+def test_keys_ignore_case_and_spacing_but_not_language_or_prompt():
+    key = AnswerCache.make_key("How do I add credits?", "fp1")
+    assert AnswerCache.make_key("  how do I ADD credits? ", "fp1") == key
+    assert AnswerCache.make_key("How do I add credits?", "fp2") != key
+    assert AnswerCache.make_key("ক্রেডিট কীভাবে যোগ করব?", "fp1") != key
+
+async def test_least_recently_used_answer_is_evicted():
+    cache = AnswerCache(MemoryAnswerBackend(maxsize=2, ttl=60))
+    await cache.set("a", "A")
+    await cache.set("b", "B")
+    assert await cache.get("a") == "A"
+    await cache.set("c", "C")
+
+    assert await cache.get("b") is None
+    assert (await cache.get("a"), await cache.get("c")) == ("A", "C")
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 1
+
+async def test_backend_errors_are_misses():
+    cache = AnswerCache(BrokenBackend())
+    await cache.set("a", "A")
+    assert await cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+class CountingProvider(StubProvider):
+    def __init__(self):
+        super().__init__(0)
+        self.calls = 0
+
+    async def complete(self, model: str, messages: list, **params):
+        self.calls += 1
+        return await super().complete(model, messages, **params)
+
+async def test_repeated_first_question_is_answered_from_the_cache(monkeypatch):
+    provider = CountingProvider()
+    monkeypatch.setattr(ai_services, "get_provider", lambda: provider)
+    monkeypatch.setattr(answer_cache, "_answer_cache", AnswerCache(MemoryAnswerBackend(maxsize=10, ttl=60)))
+
+    question = [Message(sender="user", content="How do I add credits?")]
+    first = await ai_services.get_ai_response(question)
+    again = await ai_services.get_ai_response([Message(sender="user", content="how do i add credits")])
+    assert again == first and provider.calls == 1
+
+    # Follow-ups depend on the conversation, so they are never cached
+    follow_up = question + [Message(sender="ai", content=first), Message(sender="user", content="How do I add credits?")]
+    await ai_services.get_ai_response(follow_up)
+    await ai_services.get_ai_response(follow_up)
+    assert provider.calls == 3
@@ -0,0 +1,75 @@
+"""Hot/cold tiering: archived messages come back intact, and one bad conversation cannot stall a pass"""
+from datetime import timedelta
+from sqlalchemy import func, select
+import pytest
+
+from database import Conversation, ConversationArchive, Message, utcnow
+from services import archive
+
+pytestmark = pytest.mark.anyio
+
+async def _inactive_conversation(db, user, days: int, messages: int = 3) -> int:
+    conv = Conversation(user_id=user.id, title="old", updated_at=utcnow() - timedelta(days=days))
+    db.add(conv)
+    await db.flush()
+    db.add_all([
+        Message(conversation_id=conv.id, sender="user" if i % 2 == 0 else "ai", content=f"message {i}", token_count=i)
+        for i in range(messages)
+    ])
+    await db.commit()
+    return conv.id
+
+async def _rows(db, conv_id: int) -> list:
+    result = await db.execute(
+        select(Message.id, Message.sender, Message.content, Message.token_count, Message.created_at)
+        .where(Message.conversation_id == conv_id).order_by(Message.id)
+    )
+    return result.all()
+
+async def test_archive_and_rehydrate_round_trip(db, user):
+    conv_id = await _inactive_conversation(db, user, days=60)
+    before = await _rows(db, conv_id)
+
+    assert await archive.archive_conversation(conv_id, utcnow() - timedelta(days=30)) == 3
+    assert await _rows(db, conv_id) == []
+    stored = await db.scalar(select(ConversationArchive).where(ConversationArchive.conversation_id == conv_id))
+    assert stored.message_count == 3 and stored.compressed_bytes > 0
+
+    db.expire_all()
+    conv = await db.get(Conversation, conv_id)
+    assert conv.archived_at is not None
+    await archive.ensure_hot(db, conv)
+
+    assert await _rows(db, conv_id) == before
+    assert await db.scalar(select(func.count()).where(ConversationArchive.conversation_id == conv_id)) == 0
+    db.expire_all()
+    conv = await db.get(Conversation, conv_id)
+    assert conv.archived_at is None and conv.rehydrated_at is not None
+    # Reading it counts as activity: the next pass leaves it hot
+    assert await archive.archive_conversation(conv_id, utcnow() - timedelta(days=30)) is None
+
+async def test_failing_conversation_does_not_stop_the_pass(db, user, monkeypatch):
+    bad = await _inactive_conversation(db, user, days=400)
+    good = await _inactive_conversation(db, user, days=399)
+    encode = archive.encode_messages
+
+    def encode_messages(messages):
+        if messages and messages[0].conversation_id == bad:
+            raise ValueError("cannot encode")
+        return encode(messages)
+
+    monkeypatch.setattr(archive, "encode_messages", encode_messages)
+    monkeypatch.setattr(archive, "ARCHIVE_PAUSE", 0)
+    failures = archive.ARCHIVE_OPERATIONS.labels("failed")._value.get()
+    cutoff = utcnow() - timedelta(days=archive.ARCHIVE_AFTER_DAYS)
+    candidates = await db.scalar(select(func.count()).where(*archive._inactive(cutoff)))
+
+    picked = await archive.archive_inactive()
+    assert archive.ARCHIVE_OPERATIONS.labels("failed")._value.get() == failures + 1
+
+    db.expire_all()
+    assert (await db.get(Conversation, bad)).archived_at is None
+    assert len(await _rows(db, bad)) == 3
+    assert (await db.get(Conversation, good)).archived_at is not None
+    # The failure is not counted as picked up, so the archiver does not rerun the pass at once
+    assert picked == candidates - 1
@@ -0,0 +1,41 @@
+"""Message exchanges: saved together, or dropped if the conversation went away meanwhile"""
+from fastapi import HTTPException
+from sqlalchemy import func, select, update
+import pytest
+
+from database import Conversation, Message, utcnow
+from services.chat import finish_exchange, start_exchange
+
+pytestmark = pytest.mark.anyio
+
+async def _message_count(db, conv_id: int) -> int:
+    return await db.scalar(select(func.count()).where(Message.conversation_id == conv_id))
+
+async def test_exchange_is_saved_with_activity(db, conversation, user):
+    conv_id = conversation.id
+    exchange = await start_exchange(db, conv_id, user.id, "How do I withdraw money?")
+    await finish_exchange(db, exchange, "Open the app and tap Wallet.")
+
+    assert await _message_count(db, conv_id) == 2
+    db.expire_all()
+    conv = await db.get(Conversation, conv_id)
+    assert conv.message_count == 2
+    assert conv.last_message_preview == "Open the app and tap Wallet."
+    assert conv.title == "How do I withdraw money?"
+
+@pytest.mark.parametrize("gone", ["deleted_at", "archived_at"])
+async def test_exchange_is_dropped_if_conversation_went_away(db, conversation, user, gone):
+    conv_id = conversation.id
+    exchange = await start_exchange(db, conv_id, user.id, "hello")
+    # Deleted or archived while the reply was being generated
+    await db.execute(update(Conversation).where(Conversation.id == conv_id).values({gone: utcnow()}))
+    await db.commit()
+
+    with pytest.raises(HTTPException) as error:
+        await finish_exchange(db, exchange, "reply")
+    assert error.value.status_code == 404
+
+    assert await _message_count(db, conv_id) == 0
+    db.expire_all()
+    conv = await db.get(Conversation, conv_id)
+    assert conv.message_count == 0 and conv.last_message_preview is None
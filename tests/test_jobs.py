@@ -0,0 +1,60 @@
+"""Generation jobs: retries with backoff, and failing for good without retrying"""
+from datetime import timedelta
+from sqlalchemy import update
+import pytest
+
+from database import Conversation, GenerationJob, utcnow
+from services import jobs
+from services.ai_services import AIServiceError
+
+pytestmark = pytest.mark.anyio
+
+async def _claim(db):
+    claim = await jobs.claim_job(db, "test-worker")
+    assert claim is not None
+    return claim
+
+async def _job(db, job_id: int) -> GenerationJob:
+    db.expire_all()
+    return await db.get(GenerationJob, job_id)
+
+async def test_job_saves_the_reply(db, conversation, user):
+    conv_id = conversation.id
+    job = await jobs.enqueue_reply(db, conversation, user.id, "How do I withdraw money?")
+
+    assert await jobs.run_job(await _claim(db)) == "done"
+    job = await _job(db, job.id)
+    assert job.status == "done" and job.ai_message_id is not None
+    conv = await db.get(Conversation, conv_id)
+    assert conv.message_count == 2
+
+async def test_deleted_conversation_fails_without_retrying(db, conversation, user):
+    job = await jobs.enqueue_reply(db, conversation, user.id, "hello")
+    await db.execute(update(Conversation).where(Conversation.id == conversation.id).values(deleted_at=utcnow()))
+    await db.commit()
+
+    assert await jobs.run_job(await _claim(db)) == "failed"
+    job = await _job(db, job.id)
+    assert (job.status, job.attempts, job.error) == ("failed", 1, "Conversation not found")
+    assert await jobs.claim_job(db, "test-worker") is None
+
+async def test_ai_errors_are_retried_then_fail(db, conversation, user, monkeypatch):
+    async def unavailable(messages, summary=None):
+        raise AIServiceError("AI is down")
+
+    monkeypatch.setattr(jobs, "get_ai_response", unavailable)
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+    job = await jobs.enqueue_reply(db, conversation, user.id, "hello")
+
+    assert await jobs.run_job(await _claim(db)) == "retried"
+    job = await _job(db, job.id)
+    assert job.status == "queued" and job.error == "AI is down"
+    # Backed off: not claimable until it is due
+    assert jobs._aware(job.available_at) > utcnow() + timedelta(seconds=4)
+    assert await jobs.claim_job(db, "test-worker") is None
+
+    await db.execute(update(GenerationJob).where(GenerationJob.id == job.id).values(available_at=utcnow()))
+    await db.commit()
+    assert await jobs.run_job(await _claim(db)) == "failed"
+    job = await _job(db, job.id)
+    assert (job.status, job.attempts) == ("failed", 2)
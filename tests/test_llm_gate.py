@@ -0,0 +1,71 @@
+"""LLM gate: quota handed back for calls that were never made"""
+import asyncio
+import pytest
+
+from services.llm_gate import LLMGate, MemoryLimiter, Priority
+
+pytestmark = pytest.mark.anyio
+
+RPM = 6
+TPM = 600
+
+def _levels(limiter: MemoryLimiter) -> tuple:
+    """Requests and tokens left, rounded past the refill of a few milliseconds"""
+    return round(limiter._requests.level, 1), round(limiter._tokens.level)
+
+class SlowLimiter(MemoryLimiter):
+    """A limiter whose quota check yields, like the Redis one"""
+
+    async def acquire(self, tokens: int, lease_id: str) -> float:
+        await asyncio.sleep(0.01)
+        return await super().acquire(tokens, lease_id)
+
+async def test_used_slot_settles_tokens_only():
+    limiter = MemoryLimiter(RPM, TPM)
+    gate = LLMGate(limiter, 1, 10)
+
+    ticket = await gate.acquire(Priority.CHAT, 100)
+    assert _levels(limiter) == (RPM - 1, TPM - 100)
+    await ticket.release(40)
+    assert _levels(limiter) == (RPM - 1, TPM - 40)
+    assert gate.stats()["active"] == 0
+
+async def test_unused_grant_refunds_request_and_tokens():
+    limiter = MemoryLimiter(RPM, TPM)
+    gate = LLMGate(limiter, 1, 10)
+
+    ticket = await gate.acquire(Priority.CHAT, 100)
+    await ticket.release(used=False)
+    assert _levels(limiter) == (RPM, TPM)
+    assert gate.stats()["active"] == 0
+
+async def test_waiter_cancelled_in_line_takes_nothing():
+    limiter = MemoryLimiter(RPM, TPM)
+    gate = LLMGate(limiter, 1, 10)
+    first = await gate.acquire(Priority.CHAT, 100)
+    second = await gate.enqueue(Priority.CHAT, 100, 5)
+    waiter = asyncio.ensure_future(second.wait())
+    await asyncio.sleep(0)
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    await first.release(100)
+    await asyncio.sleep(0.01)
+
+    assert not second.waiting
+    assert _levels(limiter) == (RPM - 1, TPM - 100)
+    assert gate.stats()["active"] == 0
+
+async def test_caller_gone_during_quota_check_refunds_both():
+    limiter = SlowLimiter(RPM, TPM)
+    gate = LLMGate(limiter, 1, 10)
+
+    ticket = await gate.enqueue(Priority.CHAT, 100, 5)
+    # The pump is inside the quota check; the caller gives up meanwhile
+    await ticket.release()
+    await asyncio.sleep(0.05)
+
+    assert not ticket.granted.done() or ticket.granted.cancelled()
+    assert _levels(limiter) == (RPM, TPM)
+    assert gate.stats()["active"] == 0
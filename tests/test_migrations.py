@@ -0,0 +1,103 @@
+"""
+Migrations against a database the original startup create_all built:
+upgrading it must add and backfill everything the models expect, and a
+fresh database must end up identical to the models.
+"""
+from alembic import command
+from sqlalchemy import create_engine, event, inspect, text
+import pytest
+
+import database
+
+def _engine(path):
+    """Sync engine with foreign keys enforced, as the app's engine does"""
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def _enable_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+    return engine
+
+def _run(engine, *args, fn=command.upgrade):
+    with engine.connect() as conn:
+        fn(database._alembic_config(conn), *args)
+        conn.commit()
+
+@pytest.fixture
+def original_db(tmp_path):
+    """users/conversations/messages as the original create_all made them, with data"""
+    engine = _engine(tmp_path / "original.db")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR, hashed_password VARCHAR, PRIMARY KEY (id))"))
+        conn.execute(text("CREATE UNIQUE INDEX ix_users_username ON users (username)"))
+        conn.execute(text("CREATE INDEX ix_users_id ON users (id)"))
+        conn.execute(text(
+            "CREATE TABLE conversations (id INTEGER NOT NULL, user_id INTEGER, title VARCHAR, "
+            "PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id))"
+        ))
+        conn.execute(text("CREATE INDEX ix_conversations_id ON conversations (id)"))
+        conn.execute(text(
+            "CREATE TABLE messages (id INTEGER NOT NULL, conversation_id INTEGER, sender VARCHAR, content TEXT, "
+            "PRIMARY KEY (id), FOREIGN KEY(conversation_id) REFERENCES conversations (id))"
+        ))
+        conn.execute(text("CREATE INDEX ix_messages_id ON messages (id)"))
+
+        conn.execute(text("INSERT INTO users (id, username, hashed_password) VALUES (1, 'a', 'x'), (2, 'b', 'x')"))
+        conn.execute(text(
+            "INSERT INTO conversations (id, user_id, title) VALUES "
+            "(1, 2, 't1'), (2, 1, 't2'), (3, 2, 't3'), (4, 1, 't4'), (5, 2, 't5')"
+        ))
+        # Conversation 1 has the latest message, 5 has none
+        conn.execute(text(
+            "INSERT INTO messages (id, conversation_id, sender, content) VALUES "
+            "(1, 2, 'user', 'hello'), (2, 3, 'user', 'x'), (3, 2, 'user', 'second  in\n two'), "
+            "(4, 4, 'user', 'four'), (5, 1, 'user', 'latest one')"
+        ))
+    yield engine
+    engine.dispose()
+
+def test_existing_database_upgrades_and_is_backfilled(original_db):
+    _run(original_db, "head")
+    _run(original_db, fn=command.check)
+
+    with original_db.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT id, message_count, last_message_preview, summary_upto_id, deleted_at "
+            "FROM conversations ORDER BY updated_at DESC, id DESC"
+        )).all()
+        assert [tuple(row) for row in rows] == [
+            (1, 1, "latest one", 0, None),
+            (4, 1, "four", 0, None),
+            (2, 2, "second in two", 0, None),
+            (3, 1, "x", 0, None),
+            (5, 0, None, 0, None),
+        ]
+        assert conn.scalar(text("SELECT count(*) FROM messages WHERE token_count IS NULL")) == 5
+
+def test_upgraded_foreign_keys_cascade(original_db):
+    _run(original_db, "head")
+
+    with original_db.begin() as conn:
+        conn.execute(text("DELETE FROM users WHERE id = 1"))
+    with original_db.connect() as conn:
+        assert conn.scalars(text("SELECT id FROM conversations ORDER BY id")).all() == [1, 3, 5]
+        assert conn.scalars(text("SELECT id FROM messages ORDER BY id")).all() == [2, 5]
+
+def test_downgrade_restores_the_original_schema(original_db):
+    _run(original_db, "head")
+    _run(original_db, "0001", fn=command.downgrade)
+
+    columns = {c["name"] for c in inspect(original_db).get_columns("conversations")}
+    assert columns == {"id", "user_id", "title"}
+    with original_db.connect() as conn:
+        assert conn.scalar(text("SELECT count(*) FROM messages")) == 5
+
+    _run(original_db, "head")
+    _run(original_db, fn=command.check)
+
+def test_fresh_database_matches_the_models(tmp_path):
+    engine = _engine(tmp_path / "fresh.db")
+    _run(engine, "head")
+    _run(engine, fn=command.check)
+    engine.dispose()
@@ -0,0 +1,65 @@
+"""Model cascade: which model answers, and when a small-model answer is redone"""
+import pytest
+
+from database import Message
+from services import ai_services
+from services.llm_providers import Completion, StubProvider, Usage
+from services.model_router import LLM_MODEL_LARGE, LLM_MODEL_SMALL, choose_model, unsure_signal
+
+CONTACT_ANSWER = "Open Wallet and tap Add credits. For contact: nikoo@app.com"
+
+def _history(*questions: str) -> list:
+    history = []
+    for question in questions:
+        history += [Message(sender="user", content=question), Message(sender="ai", content="ok")]
+    return history[:-1]
+
+class ScriptedProvider(StubProvider):
+    """Answers every call with the same text and records which models were asked"""
+
+    def __init__(self, text: str):
+        super().__init__(0)
+        self.text = text
+        self.models = []
+
+    def _reply(self, model: str, messages: list) -> Completion:
+        self.models.append(model)
+        return Completion(self.text, "stop", Usage(10, 10, 20))
+
+@pytest.mark.parametrize("history, summary, tier, reason", [
+    (_history("How do I add credits?"), None, "small", "routine"),
+    (_history("My payout failed"), None, "large", "intent"),
+    (_history("hi"), "Earlier they asked about payouts", "large", "context"),
+    (_history("a", "b", "c", "d"), None, "large", "context"),
+    (_history(" ".join(["word"] * 80)), None, "large", "length"),
+])
+def test_choose_model(history, summary, tier, reason):
+    route = choose_model(history, summary)
+    assert (route.tier, route.reason) == (tier, reason)
+    assert route.model == (LLM_MODEL_SMALL if tier == "small" else LLM_MODEL_LARGE)
+
+@pytest.mark.parametrize("text, finish_reason, signal", [
+    (CONTACT_ANSWER, "stop", None),
+    ("Please ask our support team at nikoo@app.com for the form.", "stop", None),
+    ("I can't fix this here, please contact our support.", "stop", "handoff"),
+    ("I'm not sure how that works.", "stop", "hedging"),
+    ("Step 1: open", "length", "truncated"),
+])
+def test_unsure_signal(text, finish_reason, signal):
+    assert unsure_signal(text, finish_reason) == signal
+
+@pytest.mark.anyio
+async def test_contact_line_is_not_escalated(monkeypatch):
+    provider = ScriptedProvider(CONTACT_ANSWER)
+    monkeypatch.setattr(ai_services, "get_provider", lambda: provider)
+
+    assert await ai_services.get_ai_response(_history("How do I add credits?")) == CONTACT_ANSWER
+    assert provider.models == [LLM_MODEL_SMALL]
+
+@pytest.mark.anyio
+async def test_unsure_answer_is_redone_on_the_large_model(monkeypatch):
+    provider = ScriptedProvider("I'm not sure, sorry.")
+    monkeypatch.setattr(ai_services, "get_provider", lambda: provider)
+
+    await ai_services.get_ai_response(_history("How do I change my avatar?"))
+    assert provider.models == [LLM_MODEL_SMALL, LLM_MODEL_LARGE]
@@ -0,0 +1,78 @@
+"""Keyset pagination: cursors walk every row exactly once, in both directions"""
+from datetime import timedelta
+from fastapi import HTTPException
+import json
+import pytest
+
+from database import Conversation, Message, utcnow
+from dependencies import CurrentUser
+from routes.conversations import list_conversations
+from routes.messages import get_messages
+from utils.pagination import decode_id_cursor, encode_cursor
+
+pytestmark = pytest.mark.anyio
+
+def _body(response) -> dict:
+    return json.loads(response.body)
+
+async def _messages(db, conv_id: int, count: int) -> list[int]:
+    msgs = [Message(conversation_id=conv_id, sender="user", content=f"m{i}") for i in range(count)]
+    db.add_all(msgs)
+    await db.commit()
+    return [m.id for m in msgs]
+
+async def test_message_pages_walk_back_and_forward(db, conversation, user):
+    ids = await _messages(db, conversation.id, 5)
+    principal = CurrentUser(id=user.id, username=user.username)
+
+    async def page(**cursor):
+        params = {"before": None, "after": None, **cursor}
+        return _body(await get_messages(conversation.id, limit=2, current_user=principal, db=db, **params))
+
+    latest = await page()
+    assert [m["id"] for m in latest["messages"]] == ids[3:]
+    assert latest["prev_cursor"] is None
+
+    older = await page(before=latest["next_cursor"])
+    oldest = await page(before=older["next_cursor"])
+    assert [m["id"] for m in older["messages"]] == ids[1:3]
+    assert [m["id"] for m in oldest["messages"]] == ids[:1]
+    assert oldest["next_cursor"] is None
+
+    newer = await page(after=oldest["prev_cursor"])
+    assert [m["id"] for m in newer["messages"]] == ids[1:3]
+    assert newer["next_cursor"] is not None and newer["prev_cursor"] is not None
+
+async def test_conversation_pages_follow_activity(db, user):
+    now = utcnow()
+    convs = [
+        Conversation(user_id=user.id, title=f"c{i}", updated_at=now - timedelta(minutes=i % 2))
+        for i in range(5)
+    ]
+    db.add_all(convs)
+    await db.commit()
+    # Most recent first; ties on updated_at broken by id
+    expected = [c.id for c in sorted(convs, key=lambda c: (c.updated_at, c.id), reverse=True)]
+    principal = CurrentUser(id=user.id, username=user.username)
+
+    seen, cursor = [], None
+    while True:
+        body = _body(await list_conversations(limit=2, before=cursor, after=None, current_user=principal, db=db))
+        seen += [c["id"] for c in body["conversations"]]
+        if not (cursor := body["next_cursor"]):
+            break
+    assert seen == expected
+
+    back = _body(await list_conversations(limit=2, before=None, after=body["prev_cursor"],
+                                          current_user=principal, db=db))
+    assert [c["id"] for c in back["conversations"]] == expected[2:4]
+
+async def test_bad_cursors_are_rejected(db, conversation, user):
+    principal = CurrentUser(id=user.id, username=user.username)
+    cursor = encode_cursor({"id": 1})
+
+    for before, after in [("not-a-cursor", None), (encode_cursor({"id": "1"}), None), (cursor, cursor)]:
+        with pytest.raises(HTTPException) as error:
+            await get_messages(conversation.id, limit=2, before=before, after=after, current_user=principal, db=db)
+        assert error.value.status_code == 400
+    assert decode_id_cursor(cursor) == 1
@@ -0,0 +1,56 @@
+"""Deletion: hidden at once, purged in the background, one bad conversation cannot stall the purge"""
+from sqlalchemy import func, select
+import pytest
+
+from database import Conversation, Message
+from services import purge
+
+pytestmark = pytest.mark.anyio
+
+async def _conversation_with_messages(db, user, messages: int = 3) -> int:
+    conv = Conversation(user_id=user.id, title="to delete")
+    db.add(conv)
+    await db.flush()
+    db.add_all([Message(conversation_id=conv.id, sender="user", content=f"m{i}") for i in range(messages)])
+    await db.commit()
+    return conv.id
+
+async def _message_count(db, conv_id: int) -> int:
+    return await db.scalar(select(func.count()).where(Message.conversation_id == conv_id))
+
+async def test_soft_delete_then_purge(db, user, monkeypatch):
+    monkeypatch.setattr(purge, "PURGE_BATCH_SIZE", 2)
+    monkeypatch.setattr(purge, "PURGE_BATCH_PAUSE", 0)
+    kept = await _conversation_with_messages(db, user)
+    deleted = await _conversation_with_messages(db, user, messages=5)
+
+    assert await purge.soft_delete_conversations(db, user.id, [deleted, 10**9]) == [deleted]
+    assert await purge.soft_delete_conversations(db, user.id, [deleted]) == []
+
+    assert await purge.purge_conversation(deleted) == 5
+    db.expire_all()
+    assert await db.get(Conversation, deleted) is None
+    assert await _message_count(db, deleted) == 0
+    assert await _message_count(db, kept) == 3
+
+async def test_failing_conversation_does_not_stop_the_pass(db, user, monkeypatch):
+    bad = await _conversation_with_messages(db, user)
+    good = await _conversation_with_messages(db, user)
+    await purge.soft_delete_conversations(db, user.id, [bad, good])
+    purge_conversation = purge.purge_conversation
+
+    async def failing(conv_id):
+        if conv_id == bad:
+            raise RuntimeError("database went away")
+        return await purge_conversation(conv_id)
+
+    monkeypatch.setattr(purge, "purge_conversation", failing)
+    failures = purge.PURGE_FAILURES._value.get()
+    pending = await db.scalar(select(func.count()).where(Conversation.deleted_at.is_not(None)))
+
+    assert await purge.purge_deleted() == pending - 1
+    assert purge.PURGE_FAILURES._value.get() == failures + 1
+    db.expire_all()
+    assert await db.get(Conversation, good) is None
+    assert (await db.get(Conversation, bad)).deleted_at is not None
+    assert await _message_count(db, bad) == 3
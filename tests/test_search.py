@@ -0,0 +1,61 @@
+"""Full-text search: only the user's live conversations, and snippets safe to render as HTML"""
+from datetime import timedelta
+import json
+import pytest
+
+from database import Conversation, Message, User, utcnow
+from dependencies import CurrentUser
+from routes.conversations import search_conversations
+from services import archive
+from services.search import highlight
+
+pytestmark = pytest.mark.anyio
+
+async def _search(db, user, q: str, limit: int = 20, cursor: str | None = None) -> dict:
+    principal = CurrentUser(id=user.id, username=user.username)
+    response = await search_conversations(q=q, limit=limit, cursor=cursor, current_user=principal, db=db)
+    return json.loads(response.body)
+
+async def _conversation(db, user, *contents: str, **values) -> int:
+    conv = Conversation(user_id=user.id, title="search", **values)
+    db.add(conv)
+    await db.flush()
+    db.add_all([Message(conversation_id=conv.id, sender="user", content=c) for c in contents])
+    await db.commit()
+    return conv.id
+
+def test_highlight_escapes_before_marking():
+    assert highlight("a <b>\x02match\x03</b> & 'c'") == "a &lt;b&gt;<mark>match</mark>&lt;/b&gt; &amp; &#x27;c&#x27;"
+
+async def test_markup_in_messages_is_escaped(db, user):
+    await _conversation(db, user, 'Hi <script>alert("xss")</script> <img src=x onerror=alert(1)> payout')
+
+    hits = (await _search(db, user, "payout alert"))["results"]
+    assert len(hits) == 1
+    snippet = hits[0]["snippet"]
+    assert "<script>" not in snippet and "<img" not in snippet
+    assert "&lt;script&gt;" in snippet and "&lt;img src=x" in snippet
+    assert "<mark>payout</mark>" in snippet and "<mark>alert</mark>" in snippet
+
+async def test_only_the_users_live_conversations_are_searched(db, user):
+    other = User(username=f"other-{user.id}", hashed_password="x")
+    db.add(other)
+    await db.commit()
+    mine = await _conversation(db, user, "withdraw to bank")
+    await _conversation(db, user, "withdraw deleted", deleted_at=utcnow())
+    await _conversation(db, other, "withdraw theirs")
+
+    hits = (await _search(db, user, "withdraw"))["results"]
+    assert [h["conversation_id"] for h in hits] == [mine]
+
+async def test_pages_and_archived_conversations(db, user):
+    conv_id = await _conversation(db, user, "streaming tips", updated_at=utcnow() - timedelta(days=90))
+    await _conversation(db, user, *["streaming setup"] * 3)
+    assert await archive.archive_conversation(conv_id, utcnow() - timedelta(days=30)) == 1
+
+    first = await _search(db, user, "streaming", limit=2)
+    second = await _search(db, user, "streaming", limit=2, cursor=first["next_cursor"])
+    ids = [h["message_id"] for h in first["results"] + second["results"]]
+    # The archived conversation was restored by the first page and is found too
+    assert len(ids) == len(set(ids)) == 4 and second["next_cursor"] is None
+    assert conv_id in {h["conversation_id"] for h in first["results"] + second["results"]}
@@ -0,0 +1,86 @@
+"""Single-flight: concurrent identical calls share one result"""
+import asyncio
+import pytest
+
+from database import Message
+from services import ai_services
+from services.llm_providers import StubProvider
+from utils.singleflight import LeaderGone, SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+async def test_concurrent_calls_share_one_run():
+    flight = SingleFlight("test")
+    runs = 0
+
+    async def work():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.01)
+        return runs
+
+    results = await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+    assert results == [1] * 5 and runs == 1
+    assert (flight.leaders, flight.followers) == (1, 4)
+    # Once finished, the next call runs again
+    assert await flight.do("k", work) == 2
+
+async def test_errors_are_shared_too():
+    flight = SingleFlight("test")
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(flight.do("k", work), flight.do("k", work), return_exceptions=True)
+    assert [type(r) for r in results] == [ValueError, ValueError]
+
+async def test_work_stops_only_when_every_caller_is_gone():
+    flight = SingleFlight("test")
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def work():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    leader = asyncio.ensure_future(flight.do("k", work))
+    follower = asyncio.ensure_future(flight.do("k", work))
+    await started.wait()
+
+    leader.cancel()
+    await asyncio.sleep(0)
+    assert not cancelled.is_set()
+    follower.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    assert flight.stats()["in_flight"] == 0
+
+async def test_stream_leader_without_result_releases_followers():
+    flight = SingleFlight("test")
+    future = flight.begin("k")
+    follower = asyncio.ensure_future(flight.join("k"))
+    await asyncio.sleep(0)
+
+    flight.finish(future, None)
+    with pytest.raises(LeaderGone):
+        await follower
+    assert await flight.join("k") is None
+
+async def test_identical_replies_make_one_provider_call(monkeypatch):
+    class SlowProvider(StubProvider):
+        calls = 0
+
+        async def complete(self, model: str, messages: list, **params):
+            SlowProvider.calls += 1
+            await asyncio.sleep(0.02)
+            return await super().complete(model, messages, **params)
+
+    provider = SlowProvider(0)
+    monkeypatch.setattr(ai_services, "get_provider", lambda: provider)
+    history = [Message(sender="user", content="How do I go live?")]
+
+    answers = await asyncio.gather(*(ai_services.get_ai_response(history) for _ in range(3)))
+    assert len(set(answers)) == 1 and SlowProvider.calls == 1
@@ -0,0 +1,268 @@
+"""
+Prometheus metrics for HTTP requests, Groq calls and database queries.
+
+Set PROMETHEUS_MULTIPROC_DIR to an empty, writable directory when running
+several worker processes (gunicorn); each worker then writes its samples
+there and /metrics aggregates all of them.
+"""
+from dotenv import load_dotenv
+import weakref
+
+# prometheus_client picks single- or multi-process storage at import time
+load_dotenv()
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+from starlette.routing import Match
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from sqlalchemy import event
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# Statements slower than this are logged with the route that ran them
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency, until the last body byte is sent",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being served",
+    ["method", "route"],
+    multiprocess_mode="livesum"
+)
+
+GROQ_LATENCY = Histogram(
+    "groq_request_duration_seconds",
+    "LLM provider call latency per attempt; streams are timed to the last chunk",
+    ["operation", "model", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+GROQ_RETRIES = Counter("groq_retries_total", "Groq calls retried after an error", ["operation"])
+GROQ_FALLBACKS = Counter(
+    "groq_fallbacks_total",
+    "Replies replaced by a fallback message because Groq failed",
+    ["reason"]
+)
+GROQ_TOKENS = Counter("groq_tokens_total", "Tokens reported by the LLM provider", ["operation", "model", "kind"])
+LLM_COST = Counter("llm_cost_usd_total", "Estimated LLM spend from token usage and LLM_PRICES", ["model"])
+LLM_ROUTES = Counter("llm_routes_total", "Replies routed to each model tier, and why", ["tier", "reason"])
+LLM_UNSURE = Counter(
+    "llm_unsure_answers_total",
+    "Small-model answers that looked unsure, by signal and whether the large model was asked instead",
+    ["signal", "escalated"]
+)
+
+LLM_QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds",
+    "Time a Groq call waited for a slot in the LLM gate",
+    ["priority"],
+    buckets=LATENCY_BUCKETS
+)
+LLM_REJECTIONS = Counter(
+    "llm_gate_rejections_total",
+    "Groq calls turned away by the LLM gate (full, deadline, timeout)",
+    ["reason"]
+)
+
+SINGLEFLIGHT_CALLS = Counter(
+    "singleflight_calls_total",
+    "Coalesced calls: leaders did the work, followers shared its result",
+    ["name", "role"]
+)
+
+ANSWER_CACHE_LOOKUPS = Counter("answer_cache_lookups_total", "FAQ answer cache lookups", ["result"])
+
+WEBSOCKET_CONNECTIONS = Gauge(
+    "websocket_connections",
+    "Open conversation WebSocket connections",
+    multiprocess_mode="livesum"
+)
+HUB_EVENTS = Counter("chat_hub_events_total", "Conversation events published to connections", ["type"])
+
+GENERATION_JOB_WAIT = Histogram(
+    "generation_job_wait_seconds",
+    "Time an async reply job waited in the queue before a worker claimed it",
+    buckets=LATENCY_BUCKETS
+)
+GENERATION_JOBS = Counter(
+    "generation_jobs_total",
+    "Async reply jobs handled by generation workers, by outcome",
+    ["outcome"]
+)
+
+PURGED_ROWS = Counter("purged_rows_total", "Rows of deleted conversations removed by the purger", ["table"])
+PURGE_FAILURES = Counter("purge_failures_total", "Deleted conversations the purger failed to remove, retried next pass")
+
+# Hot/cold tiers (services.archive); database-wide, refreshed by each archive
+# pass, so across workers the most recent reading wins
+TIER_CONVERSATIONS = Gauge(
+    "conversation_tier_conversations",
+    "Live conversations per storage tier (hot, archived)",
+    ["tier"],
+    multiprocess_mode="mostrecent"
+)
+TIER_MESSAGES = Gauge(
+    "conversation_tier_messages",
+    "Messages of live conversations per storage tier (hot, archived)",
+    ["tier"],
+    multiprocess_mode="mostrecent"
+)
+ARCHIVE_BYTES = Gauge(
+    "conversation_archive_bytes",
+    "Size of the archived tier's messages, raw and compressed",
+    ["kind"],
+    multiprocess_mode="mostrecent"
+)
+ARCHIVE_OPERATIONS = Counter(
+    "conversation_archive_operations_total",
+    "Conversations archived or rehydrated, and archive attempts that failed",
+    ["operation"]
+)
+
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "SQL statements executed per HTTP request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_query_duration_per_request_seconds",
+    "Total time spent executing SQL per HTTP request",
+    ["route"],
+    buckets=LATENCY_BUCKETS
+)
+
+@dataclass
+class RequestStats:
+    """Database work done while serving one request"""
+    route: str
+    queries: int = 0
+    db_seconds: float = 0.0
+
+# Set by MetricsMiddleware; SQLAlchemy runs event hooks in a greenlet that
+# shares the calling task's context, so the hooks below see it
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+_instrumented_engines = weakref.WeakSet()
+
+def instrument_engine(engine):
+    """Count and time every statement against the current request; once per engine"""
+    sync_engine = engine.sync_engine
+    if sync_engine in _instrumented_engines:
+        return
+    _instrumented_engines.add(sync_engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            route = stats.route if stats is not None else "(no request)"
+            # Statement only: parameters can hold message content
+            logger.warning(
+                f"Slow query ({elapsed * 1000:.0f} ms) in {route}: {' '.join(statement.split())[:500]}"
+            )
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        # after_cursor_execute does not run for failed statements
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+def route_template(scope) -> str:
+    """Path template of the matching route, to keep label cardinality bounded"""
+    partial = None
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are timed to completion"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        stats = RequestStats(route=route)
+        token = current_request.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_LATENCY.labels(method, route, str(status_code)).observe(time.perf_counter() - start)
+            in_flight.dec()
+            DB_QUERIES_PER_REQUEST.labels(route).observe(stats.queries)
+            DB_TIME_PER_REQUEST.labels(route).observe(stats.db_seconds)
+            current_request.reset(token)
+
+@contextmanager
+def observe_groq(operation: str, model: str):
+    """Time one LLM call; the outcome label is "error" if the block raises"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        GROQ_LATENCY.labels(operation, model, outcome).observe(time.perf_counter() - start)
+
+def record_groq_usage(operation: str, model: str, usage, cost: float = 0.0) -> None:
+    """Add a `usage` object's token counts and their estimated cost, if the response carried one"""
+    if usage is None:
+        return
+    if usage.prompt_tokens:
+        GROQ_TOKENS.labels(operation, model, "prompt").inc(usage.prompt_tokens)
+    if usage.completion_tokens:
+        GROQ_TOKENS.labels(operation, model, "completion").inc(usage.completion_tokens)
+    if cost:
+        LLM_COST.labels(model).inc(cost)
+
+def render_metrics() -> tuple[bytes, str]:
+    """Exposition text for /metrics, aggregated across workers in multiprocess mode"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,43 @@
+from fastapi import HTTPException, status
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(values: dict) -> str:
+    """Encode keyset values as an opaque, URL-safe cursor"""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *keys: str) -> dict:
+    """Decode a cursor produced by encode_cursor, requiring the given keys"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, dict) or any(k not in values for k in keys):
+            raise ValueError("missing cursor keys")
+        return values
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+
+def decode_id_cursor(cursor: str) -> int:
+    """Decode a cursor keyed on a single integer id"""
+    value = decode_cursor(cursor, "id")["id"]
+    if not isinstance(value, int):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+    return value
+
+def check_single_cursor(before: str | None, after: str | None):
+    """Reject requests that page in both directions at once"""
+    if before and after:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either 'before' or 'after', not both"
+        )
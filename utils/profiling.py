@@ -0,0 +1,128 @@
+"""
+Per-request diagnostics: SQL statement count headers and an on-demand
+sampling profiler that writes folded stacks (flamegraph.pl / speedscope).
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>` or is
+picked by PROFILE_SAMPLE_RATE. The sampler walks the event loop thread's
+stack, so requests running concurrently in the same worker show up too;
+profile on a quiet worker for clean results.
+"""
+from dotenv import load_dotenv
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from utils.metrics import current_request, route_template
+import asyncio
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import threading
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# X-DB-Queries / X-DB-Time-Ms response headers; on by default outside production
+QUERY_COUNT_HEADER = os.getenv(
+    "QUERY_COUNT_HEADER",
+    "false" if os.getenv("AUTH_MODE", "development") == "production" else "true"
+).lower() in ("1", "true", "yes")
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval into folded-stack counts"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_qualname} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path: Path):
+        """Folded format: `root;caller;callee <samples>` per line"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+# One profile per worker at a time; overlapping samplers would see the same thread
+_profiling = threading.Lock()
+
+def _wants_profile(scope) -> bool:
+    if PROFILE_TOKEN:
+        for name, value in scope["headers"]:
+            if name == b"x-profile" and hmac.compare_digest(value, PROFILE_TOKEN.encode()):
+                return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def _profile_path(method: str, route: str) -> Path:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return PROFILE_DIR / f"{stamp}-{method}-{slug}-{os.getpid()}.folded"
+
+class ProfilingMiddleware:
+    """Adds query-count headers and profiles selected requests; runs inside MetricsMiddleware"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampler = None
+        if _wants_profile(scope) and _profiling.acquire(blocking=False):
+            sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+            sampler.start()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and QUERY_COUNT_HEADER:
+                stats = current_request.get()
+                if stats is not None:
+                    # Counted up to the headers; a streamed body may run more
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-db-queries", str(stats.queries).encode()),
+                        (b"x-db-time-ms", f"{stats.db_seconds * 1000:.1f}".encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if sampler is not None:
+                sampler.stop()
+                _profiling.release()
+                path = _profile_path(scope["method"], route_template(scope))
+                try:
+                    await asyncio.to_thread(sampler.write, path)
+                    logger.info(f"Profile of {scope['method']} {scope['path']} written to {path}")
+                except OSError as e:
+                    logger.error(f"Failed to write profile {path}: {str(e)}")
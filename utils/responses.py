@@ -0,0 +1,158 @@
+"""
+Response encoding: orjson bodies, streamed JSON documents and compression.
+
+FastJSONResponse is the app's default response class. The hot read
+endpoints (message pages, the conversation list, search) select plain
+columns and return it directly, skipping FastAPI's re-validation of the
+response through its model; the model still documents the schema.
+Timestamps are written like pydantic writes them (UTC as "Z").
+
+CompressionMiddleware negotiates gzip, or brotli when enabled, for bodies
+of at least COMPRESSION_MIN_SIZE bytes. Compressor state (a few hundred
+KiB for gzip) is only allocated for a body that is compressed, and event
+streams are never compressed, as a compressor would hold events back.
+"""
+from dotenv import load_dotenv
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import AsyncIterator
+import orjson
+import os
+import zlib
+
+load_dotenv()
+
+# Smallest response body compressed, in bytes (0 = never compress)
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Offered encodings, preferred first: gzip, br (needs the brotli package)
+COMPRESSION_ENCODINGS = [
+    e.strip().lower() for e in os.getenv("COMPRESSION_ENCODINGS", "gzip").split(",") if e.strip()
+]
+# 1 (fastest) to 9 (smallest); JSON compresses well at low levels
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+# 0 (fastest) to 11 (smallest); above 5 is too slow for per-request use
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+# Rows fetched and encoded per chunk of a streamed export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, option=_OPTIONS)
+
+class FastJSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+async def stream_json_document(fields: dict, key: str, batches: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    """
+    `fields` plus a `key` array holding every item of `batches`, encoded a
+    batch at a time, so the whole document is never in memory at once.
+    """
+    # '{...,"key":[]}' without its closing ']}'
+    yield dumps({**fields, key: []})[:-2]
+    separator = b""
+    async for batch in batches:
+        if batch:
+            yield separator + dumps(batch)[1:-1]
+            separator = b","
+    yield b"]}"
+
+def accepted_encodings(header: str) -> set:
+    """Content codings an Accept-Encoding header allows (q > 0)"""
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip().lower()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+class CompressionMiddleware:
+    """Compresses response bodies the client accepts an encoding for"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE, encodings: list = COMPRESSION_ENCODINGS):
+        unknown = set(encodings) - {"gzip", "br"}
+        if unknown:
+            raise RuntimeError(f"Unsupported COMPRESSION_ENCODINGS: {', '.join(sorted(unknown))}")
+        self._brotli = None
+        if "br" in encodings:
+            try:
+                import brotli
+            except ImportError:
+                raise RuntimeError("COMPRESSION_ENCODINGS=br requires the 'brotli' package")
+            self._brotli = brotli
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = encodings
+
+    def _compressor(self, encoding: str, size: int | None = None) -> tuple:
+        """(compress, finish) functions of a new compressor for a body of `size` bytes, if known"""
+        if encoding == "br":
+            compressor = self._brotli.Compressor(quality=BROTLI_QUALITY)
+            return compressor.process, compressor.finish
+        # A window larger than the body, and the hash table sized for it, only
+        # cost memory: a 7 KB page compresses the same in a third of it
+        window_bits = min(15, max(9, (size - 1).bit_length())) if size else 15
+        # 16 + window_bits: deflate with a gzip header and trailer
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + window_bits, min(8, window_bits - 7))
+        return compressor.compress, compressor.flush
+
+    def _negotiate(self, scope: Scope) -> str | None:
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        return next((e for e in self.encodings if e in accepted), None)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        encoding = None
+        if scope["type"] == "http" and self.minimum_size > 0:
+            encoding = self._negotiate(scope)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Message | None = None
+        compress = finish = None
+
+        async def send_compressed(message: Message):
+            nonlocal start, compress, finish
+            if message["type"] == "http.response.start":
+                # Held until the first body chunk shows whether to compress
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                if not (
+                    "content-encoding" in headers
+                    or headers.get("content-type", "").startswith("text/event-stream")
+                    or (len(body) < self.minimum_size and not more_body)
+                ):
+                    compress, finish = self._compressor(encoding, None if more_body else len(body))
+                    headers["Content-Encoding"] = encoding
+                    headers.add_vary_header("Accept-Encoding")
+                    del headers["Content-Length"]
+                    if more_body:
+                        body = compress(body)
+                    else:
+                        body = compress(body) + finish()
+                        headers["Content-Length"] = str(len(body))
+                    message = {"type": "http.response.body", "body": body, "more_body": more_body}
+                await send(start)
+                start = None
+            elif compress is not None:
+                body = compress(body) + (b"" if more_body else finish())
+                message = {"type": "http.response.body", "body": body, "more_body": more_body}
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -1,8 +1,9 @@
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
-from passlib.context import CryptContext
 from dotenv import load_dotenv
 from fastapi import HTTPException, status
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
 import logging
 
@@ -18,19 +19,93 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 # 1 day
 if not SECRET_KEY:
     raise ValueError("SECRET_KEY environment variable not set")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor. Hashes made with any other cost are rehashed on the
+# next successful login (min == max makes passlib flag them for update).
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+_pwd_context = None
+
+def pwd_context():
+    """The passlib context, built on first use"""
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+
+        _pwd_context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=BCRYPT_ROUNDS,
+            bcrypt__min_rounds=BCRYPT_ROUNDS,
+            bcrypt__max_rounds=BCRYPT_ROUNDS,
+        )
+    return _pwd_context
+
+# bcrypt runs on its own small pool so a burst of logins cannot starve the
+# threadpool and event loop that chat requests use. Beyond workers + queue
+# waiting calls are rejected straight away with 503.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_in_flight = 0
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain password against its hashed version"""
     try:
-        return pwd_context.verify(plain_password, hashed_password)
+        return pwd_context().verify(plain_password, hashed_password)
     except Exception as e:
         logger.error(f"Password verification error: {str(e)}")
         return False
 
 def get_password_hash(password: str) -> str:
     """Hash a password"""
-    return pwd_context.hash(password)
+    return pwd_context().hash(password)
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> tuple:
+    try:
+        return pwd_context().verify_and_update(plain_password, hashed_password)
+    except Exception as e:
+        logger.error(f"Password verification error: {str(e)}")
+        return False, None
+
+async def _run_hashing(fn, *args):
+    """Run a bcrypt call on the dedicated pool, or 503 if its queue is full"""
+    global _hash_in_flight
+    if _hash_in_flight >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE:
+        logger.warning("Password hashing queue full, rejecting request")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    _hash_in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    finally:
+        _hash_in_flight -= 1
+
+async def hash_password_async(password: str) -> str:
+    """Hash a password on the bcrypt pool"""
+    return await _run_hashing(get_password_hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> tuple:
+    """
+    Verify a password on the bcrypt pool.
+    
+    Returns:
+        tuple: (matches, new_hash) where new_hash is set when the stored hash
+        uses an outdated cost and should be replaced
+    """
+    return await _run_hashing(_verify_and_update, plain_password, hashed_password)
+
+async def warm_password_hashing():
+    """
+    Load the bcrypt backend on the hashing pool ahead of the first login;
+    passlib self-tests it on first use, which takes a few hashes.
+    """
+    await asyncio.get_running_loop().run_in_executor(
+        _hash_executor, lambda: pwd_context().handler("bcrypt").get_backend()
+    )
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     """Create a JWT access token with user data"""
@@ -0,0 +1,106 @@
+from typing import Awaitable, Callable, TypeVar
+from utils.metrics import SINGLEFLIGHT_CALLS
+import asyncio
+
+T = TypeVar("T")
+
+class LeaderGone(Exception):
+    """The call being waited on ended without a result; followers should run their own"""
+
+def _consume_exception(fut: asyncio.Future):
+    # Followers may all be gone; keep asyncio from logging an unretrieved error
+    if not fut.cancelled():
+        fut.exception()
+
+class _Call:
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one.
+
+    The first caller (the leader) runs the work; callers arriving while it is
+    in flight (followers) await the same result. Work started with `do()`
+    runs as its own task and is only cancelled once every caller waiting on
+    it has gone away. Streams, whose result is produced piecemeal, register
+    with `begin()` and publish the final result with `finish()`.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[str, _Call] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def _register(self, key: str, future: asyncio.Future) -> _Call:
+        call = _Call(future)
+        self._calls[key] = call
+        self.leaders += 1
+        SINGLEFLIGHT_CALLS.labels(self.name, "leader").inc()
+        future.add_done_callback(_consume_exception)
+        future.add_done_callback(lambda _: self._calls.pop(key) if self._calls.get(key) is call else None)
+        return call
+
+    async def _wait(self, call: _Call, leader: bool = False):
+        call.waiters += 1
+        try:
+            result = await asyncio.shield(call.future)
+        except asyncio.CancelledError:
+            call.waiters -= 1
+            if call.waiters == 0 and isinstance(call.future, asyncio.Task):
+                call.future.cancel()
+            raise
+        if not leader:
+            # Counted only once a shared result was actually received
+            self.followers += 1
+            SINGLEFLIGHT_CALLS.labels(self.name, "follower").inc()
+        return result
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run `fn()` unless an identical call is in flight, then share its result"""
+        call = self._calls.get(key)
+        if call is not None:
+            try:
+                return await self._wait(call)
+            except LeaderGone:
+                pass
+        call = self._register(key, asyncio.ensure_future(fn()))
+        return await self._wait(call, leader=True)
+
+    async def join(self, key: str):
+        """
+        Await the result of an in-flight call for `key`.
+
+        Returns None without waiting if there is none. Raises LeaderGone if
+        the call ends without a result.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            return None
+        return await self._wait(call)
+
+    def begin(self, key: str) -> asyncio.Future:
+        """Register the caller as leader for `key`; always pair with `finish()`"""
+        future = asyncio.get_running_loop().create_future()
+        self._register(key, future)
+        return future
+
+    def finish(self, future: asyncio.Future, result=None):
+        """Publish the leader's result, or release followers with LeaderGone if None"""
+        if future.done():
+            return
+        if result is None:
+            future.set_exception(LeaderGone())
+        else:
+            future.set_result(result)
+
+    def stats(self) -> dict:
+        total = self.leaders + self.followers
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "coalesced_rate": round(self.followers / total, 4) if total else 0.0
+        }
@@ -0,0 +1,13 @@
+import re
+
+_BENGALI = re.compile(r"[\u0980-\u09FF]")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.।,;:]+$")
+
+def detect_language(text: str) -> str:
+    """Return "bn" for text containing Bengali script, otherwise "en" """
+    return "bn" if _BENGALI.search(text or "") else "en"
+
+def normalize_question(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    text = " ".join((text or "").lower().split())
+    return _TRAILING_PUNCTUATION.sub("", text)
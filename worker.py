@@ -0,0 +1,55 @@
+# worker.py
+"""
+Generation worker process for async replies (POST .../messages?mode=async).
+
+    python worker.py --concurrency 8
+
+Run as many as needed on any host that reaches the database; they share the
+generation_jobs table through SKIP LOCKED. Set GENERATION_WORKERS=0 on the
+API so all generation happens here. With several worker processes, use the
+redis LLM gate backend so Groq quotas are shared too.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+from database import dispose_engine, ensure_schema
+from services.jobs import generation_workers
+from services.knowledge_base import knowledge_base
+from services.llm_gate import LLM_MAX_CONCURRENCY
+from services.llm_providers import close_provider
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+async def main(concurrency: int, grace: float):
+    await ensure_schema()
+    knowledge_base.load()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    generation_workers.start(concurrency)
+    await stop.wait()
+    logger.info("Stopping generation workers")
+    await generation_workers.stop(grace)
+    await close_provider()
+    await dispose_engine()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--concurrency", type=int, default=LLM_MAX_CONCURRENCY,
+        help="jobs run at once in this process (default: LLM_MAX_CONCURRENCY)"
+    )
+    parser.add_argument(
+        "--grace", type=float, default=30.0,
+        help="seconds running jobs get to finish on shutdown before being requeued"
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency, args.grace))